@@ -1,10 +1,26 @@
-from .fontshape import TesserocrFontShape
-from .recognize import TesserocrRecognize
-from .segment import TesserocrSegment
-from .segment_word import TesserocrSegmentWord
-from .segment_line import TesserocrSegmentLine
-from .segment_table import TesserocrSegmentTable
-from .segment_region import TesserocrSegmentRegion
-from .crop import TesserocrCrop
-from .deskew import TesserocrDeskew
-from .binarize import TesserocrBinarize
+# (processors get imported on first access, to keep startup fast)
+_PROCESSORS = {
+    'TesserocrFontShape': 'fontshape',
+    'TesserocrRecognize': 'recognize',
+    'TesserocrSegment': 'segment',
+    'TesserocrSegmentWord': 'segment_word',
+    'TesserocrSegmentLine': 'segment_line',
+    'TesserocrSegmentTable': 'segment_table',
+    'TesserocrSegmentRegion': 'segment_region',
+    'TesserocrCrop': 'crop',
+    'TesserocrDeskew': 'deskew',
+    'TesserocrBinarize': 'binarize',
+    'TesserocrPreprocess': 'preprocess',
+}
+
+__all__ = list(_PROCESSORS)
+
+def __getattr__(name):
+    if name in _PROCESSORS:
+        from importlib import import_module
+        module = import_module('.' + _PROCESSORS[name], __name__)
+        return getattr(module, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
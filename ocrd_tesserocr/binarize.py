@@ -15,6 +15,7 @@ from ocrd_models.ocrd_page import (
 from ocrd.processor import OcrdPageResult, OcrdPageResultImage
 
 from .recognize import TesserocrRecognize
+from .timing import TIMER
 
 class TesserocrBinarize(TesserocrRecognize):
     @property
@@ -22,8 +23,9 @@ class TesserocrBinarize(TesserocrRecognize):
         return 'ocrd-tesserocr-binarize'
 
     def _init(self):
-        # use default model (eng) with vanilla tesserocr API
-        self.tessapi = PyTessBaseAPI()
+        # use vanilla tesserocr API without model (only layout analysis)
+        self.tessapi = PyTessBaseAPI(init=False)
+        self.tessapi.InitForAnalysePage()
 
     def process_page_pcgts(self, *input_pcgts: Optional[OcrdPage], page_id : Optional[str] = None) -> OcrdPageResult:
         """Performs binarization of the region / line with Tesseract on the workspace.
@@ -97,7 +99,8 @@ class TesserocrBinarize(TesserocrRecognize):
         return result
 
     def _process_segment(self, ril, segment, image, xywh, where) -> Optional[OcrdPageResultImage]:
-        self.tessapi.SetImage(image)
+        with TIMER('SetImage'):
+            self.tessapi.SetImage(image)
         features = xywh['features'] + ",binarized"
         image_bin = None
         if ril == -1:
@@ -107,14 +110,17 @@ class TesserocrBinarize(TesserocrRecognize):
                 features += ",clipped"
                 # will trigger FindLines() → SegmentPage() → AutoPageSeg()
                 # → SetupPageSegAndDetectOrientation() → FindAndRemoveLines() + FindImages()
-                self.tessapi.AnalyseLayout()
-            image_bin = self.tessapi.GetThresholdedImage()
+                with TIMER('AnalyseLayout'):
+                    self.tessapi.AnalyseLayout()
+            with TIMER('GetThresholdedImage'):
+                image_bin = self.tessapi.GetThresholdedImage()
         else:
             if ril == RIL.BLOCK:
                 self.tessapi.SetPageSegMode(PSM.SINGLE_BLOCK)
             if ril == RIL.TEXTLINE:
                 self.tessapi.SetPageSegMode(PSM.SINGLE_LINE)
-            layout = self.tessapi.AnalyseLayout()
+            with TIMER('AnalyseLayout'):
+                layout = self.tessapi.AnalyseLayout()
             if layout:
                 image_bin = layout.GetBinaryImage(ril)
         if not image_bin:
@@ -1,63 +1,177 @@
+import sys
 import click
 
-from ocrd.decorators import ocrd_cli_options, ocrd_cli_wrap_processor
-from ocrd_tesserocr.fontshape import TesserocrFontShape
-from ocrd_tesserocr.recognize import TesserocrRecognize
-from ocrd_tesserocr.segment import TesserocrSegment
-from ocrd_tesserocr.segment_region import TesserocrSegmentRegion
-from ocrd_tesserocr.segment_table import TesserocrSegmentTable
-from ocrd_tesserocr.segment_line import TesserocrSegmentLine
-from ocrd_tesserocr.segment_word import TesserocrSegmentWord
-from ocrd_tesserocr.crop import TesserocrCrop
-from ocrd_tesserocr.deskew import TesserocrDeskew
-from ocrd_tesserocr.binarize import TesserocrBinarize
+from ocrd.decorators import ocrd_cli_options, ocrd_cli_wrap_processor, ocrd_loglevel
+from ocrd_utils import initLogging, DEFAULT_METS_BASENAME
+
+# (each command only imports what it needs, to keep startup fast)
+
+def _limit_openmp(kwargs):
+    """Split the cores between page workers and threads before the processor loads Tesseract."""
+    from ocrd_utils import parse_json_string_or_file, set_json_key_value_overrides
+    from ocrd_tesserocr.threads import get_parameter_threads, set_openmp_limit
+    try:
+        parameter = parse_json_string_or_file(*kwargs.get('parameter', ()))
+    except ValueError:
+        # (preset files only get resolved by the processor)
+        parameter = {}
+    set_json_key_value_overrides(parameter, *kwargs.get('parameter_override', ()))
+    set_openmp_limit(get_parameter_threads(parameter))
 
 @click.command()
 @ocrd_cli_options
 def ocrd_tesserocr_segment(*args, **kwargs):
+    _limit_openmp(kwargs)
+    from ocrd_tesserocr.segment import TesserocrSegment
     return ocrd_cli_wrap_processor(TesserocrSegment, *args, **kwargs)
 
 @click.command()
 @ocrd_cli_options
 def ocrd_tesserocr_segment_region(*args, **kwargs):
+    _limit_openmp(kwargs)
+    from ocrd_tesserocr.segment_region import TesserocrSegmentRegion
     return ocrd_cli_wrap_processor(TesserocrSegmentRegion, *args, **kwargs)
 
 @click.command()
 @ocrd_cli_options
 def ocrd_tesserocr_segment_table(*args, **kwargs):
+    _limit_openmp(kwargs)
+    from ocrd_tesserocr.segment_table import TesserocrSegmentTable
     return ocrd_cli_wrap_processor(TesserocrSegmentTable, *args, **kwargs)
 
 @click.command()
 @ocrd_cli_options
 def ocrd_tesserocr_segment_line(*args, **kwargs):
+    _limit_openmp(kwargs)
+    from ocrd_tesserocr.segment_line import TesserocrSegmentLine
     return ocrd_cli_wrap_processor(TesserocrSegmentLine, *args, **kwargs)
 
 @click.command()
 @ocrd_cli_options
 def ocrd_tesserocr_segment_word(*args, **kwargs):
+    _limit_openmp(kwargs)
+    from ocrd_tesserocr.segment_word import TesserocrSegmentWord
     return ocrd_cli_wrap_processor(TesserocrSegmentWord, *args, **kwargs)
 
 @click.command()
 @ocrd_cli_options
 def ocrd_tesserocr_recognize(*args, **kwargs):
+    _limit_openmp(kwargs)
+    from ocrd_tesserocr.recognize import TesserocrRecognize
     return ocrd_cli_wrap_processor(TesserocrRecognize, *args, **kwargs)
 
 @click.command()
 @ocrd_cli_options
 def ocrd_tesserocr_fontshape(*args, **kwargs):
+    _limit_openmp(kwargs)
+    from ocrd_tesserocr.fontshape import TesserocrFontShape
     return ocrd_cli_wrap_processor(TesserocrFontShape, *args, **kwargs)
 
 @click.command()
 @ocrd_cli_options
 def ocrd_tesserocr_crop(*args, **kwargs):
+    _limit_openmp(kwargs)
+    from ocrd_tesserocr.crop import TesserocrCrop
     return ocrd_cli_wrap_processor(TesserocrCrop, *args, **kwargs)
 
 @click.command()
 @ocrd_cli_options
 def ocrd_tesserocr_deskew(*args, **kwargs):
+    _limit_openmp(kwargs)
+    from ocrd_tesserocr.deskew import TesserocrDeskew
     return ocrd_cli_wrap_processor(TesserocrDeskew, *args, **kwargs)
 
 @click.command()
 @ocrd_cli_options
 def ocrd_tesserocr_binarize(*args, **kwargs):
+    _limit_openmp(kwargs)
+    from ocrd_tesserocr.binarize import TesserocrBinarize
     return ocrd_cli_wrap_processor(TesserocrBinarize, *args, **kwargs)
+
+@click.command()
+@ocrd_cli_options
+def ocrd_tesserocr_preprocess(*args, **kwargs):
+    _limit_openmp(kwargs)
+    from ocrd_tesserocr.preprocess import TesserocrPreprocess
+    return ocrd_cli_wrap_processor(TesserocrPreprocess, *args, **kwargs)
+
+@click.command()
+@ocrd_loglevel
+@click.option('-m', '--mets', help="METS to process", default=DEFAULT_METS_BASENAME)
+@click.option('-g', '--page-id', help="ID(s) of the pages to process")
+@click.option('--overwrite', is_flag=True, default=False, help="Remove output pages/images if they already exist")
+@click.option('--save-all', is_flag=True, default=False, help="Write the output fileGrps of all tasks, not just the last")
+@click.argument('tasks', nargs=-1, required=True)
+def ocrd_tesserocr_pipeline(log_level, mets, page_id, overwrite, save_all, tasks):
+    """
+    Run a chain of ocrd-tesserocr processors page by page in one process
+
+    TASKS are given as in `ocrd process` (but only for the processors of this
+    package, and each consuming the output of the previous one), e.g.
+
+    \b
+        ocrd-tesserocr-pipeline \\
+          "tesserocr-preprocess -I OCR-D-IMG -O OCR-D-BIN" \\
+          "tesserocr-segment-region -O OCR-D-SEG-REGION" \\
+          "tesserocr-segment-line -O OCR-D-SEG-LINE" \\
+          "tesserocr-recognize -O OCR-D-OCR -P model eng"
+
+    All processors get set up once, and pages and images get passed
+    between them in memory. Only the last output fileGrp is written
+    (along with any images it still references), unless --save-all.
+    """
+    from ocrd import Resolver
+    from ocrd.task_sequence import ProcessorTask
+    from ocrd_tesserocr.threads import get_parameter_threads, set_openmp_limit
+    # (pages are processed one at a time, and so are the steps)
+    set_openmp_limit(max(get_parameter_threads(ProcessorTask.parse(task).parameters)
+                         for task in tasks), workers=1)
+    from ocrd_tesserocr.pipeline import parse_tasks, run_pipeline
+    initLogging()
+    workspace = Resolver().workspace_from_url(mets)
+    run_pipeline(workspace, parse_tasks(tasks), page_id=page_id, save_all=save_all,
+                 existing_output='OVERWRITE' if overwrite else None)
+
+@click.command()
+@ocrd_loglevel
+@click.option('-S', '--socket', 'path', required=True, help="Path of the Unix socket to listen on")
+@click.option('--max-processors', type=int, default=0,
+              help="Maximum number of processors (each with its own parameters) to keep set up "
+              "(default: OCRD_MAX_PROCESSOR_CACHE)")
+def ocrd_tesserocr_server(log_level, path, max_processors):
+    """
+    Run ocrd-tesserocr processors as a warm worker on a local socket
+
+    Keeps processors (with their models loaded) for each set of parameters
+    across jobs, which can be submitted via ocrd-tesserocr-client.
+    Jobs are run one at a time.
+    """
+    from ocrd_tesserocr.server import WorkerServer
+    initLogging()
+    server = WorkerServer(path, max_processors or None)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+@click.command()
+@click.option('-S', '--socket', 'path', required=True, help="Path of the Unix socket of the server")
+@click.option('-m', '--mets', help="METS to process", default=DEFAULT_METS_BASENAME)
+@click.option('-g', '--page-id', help="ID(s) of the pages to process")
+@click.option('--overwrite', is_flag=True, default=False, help="Remove output pages/images if they already exist")
+@click.option('--save-all', is_flag=True, default=False, help="Write the output fileGrps of all tasks, not just the last")
+@click.argument('tasks', nargs=-1, required=True)
+def ocrd_tesserocr_client(path, mets, page_id, overwrite, save_all, tasks):
+    """
+    Submit TASKS on a workspace to ocrd-tesserocr-server and wait for the result
+
+    TASKS are given like for ocrd-tesserocr-pipeline.
+    """
+    from ocrd_tesserocr.server import submit_job
+    response = submit_job(path, mets, tasks, page_id=page_id,
+                          save_all=save_all, overwrite=overwrite)
+    if response['status'] != 'ok':
+        click.echo(response['message'], err=True)
+        sys.exit(1)
@@ -1,15 +1,16 @@
 import itertools
+import os
+import struct
 from PIL import Image, ImageStat
 
 import numpy as np
-from scipy.sparse.csgraph import minimum_spanning_tree
-from shapely.geometry import Polygon, LineString
-from shapely.ops import unary_union, nearest_points, orient
-from shapely import set_precision
-
+from tesserocr import get_languages
+# (scipy and shapely are slow to import, so they get
+#  imported in the functions needing them on first use)
 
 from ocrd_utils import (
     getLogger,
+    coordinates_of_segment,
     polygon_from_points,
     points_from_polygon,
 )
@@ -29,6 +30,17 @@ from ocrd_models.ocrd_page_generateds import (
     TextLineOrderSimpleType,
 )
 
+from .timing import timed
+
+MAX_DENSE_DISTANCES = 500 # maximum number of rectangles in make_join to calculate all distances for (2 MB per matrix)
+MAX_VALID_STEPS = 10 # maximum number of tolerances in make_valid to try simplification and enlargement with
+MAX_REPAIR_POINTS = 50 # maximum number of vertices in make_valid to try repairing by shapely for
+TESSDATA_INTTEMP = 3 # index of the legacy classifier templates in the traineddata header
+TESSDATA_LSTM = 17 # index of the LSTM network in the traineddata header
+
+# installed models per tessdata directory (along with the mtimes of all its directories)
+_MODELS = {}
+
 
 def page_element_unicode0(element):
     """Get Unicode string of the first text result."""
@@ -65,6 +77,7 @@ def page_get_reading_order(ro, rogroup):
         if not isinstance(elem, (RegionRefType, RegionRefIndexedType)):
             page_get_reading_order(ro, elem)
         
+@timed('page_update_higher_textequiv_levels')
 def page_update_higher_textequiv_levels(level, pcgts, overwrite=True):
     """Update the TextEquivs of all PAGE-XML hierarchy levels above ``level`` for consistency.
     
@@ -220,12 +233,18 @@ def join_segments(segments):
     return join_polygons([polygon_from_points(segment.get_Coords().points)
                           for segment in segments])
 
+@timed('join_polygons')
 def join_polygons(polygons, scale=20):
     """construct concave hull (alpha shape) from input polygons by connecting their pairwise nearest points"""
+    from shapely.geometry import Polygon
     return make_join([make_valid(Polygon(poly)) for poly in polygons], scale=scale).exterior.coords[:-1]
 
 def make_join(polygons, scale=20):
     """construct concave hull (alpha shape) from input polygons by connecting their pairwise nearest points"""
+    import shapely
+    from shapely.geometry import Polygon
+    from shapely.ops import unary_union, orient
+    from scipy.sparse.csgraph import minimum_spanning_tree
     # ensure input polygons are simply typed and all oriented equally
     polygons = [orient(poly)
                 for poly in itertools.chain.from_iterable(
@@ -237,33 +256,68 @@ def make_join(polygons, scale=20):
     if npoly == 1:
         return polygons[0]
     # find min-dist path through all polygons (travelling salesman)
-    pairs = itertools.combinations(range(npoly), 2)
-    dists = np.zeros((npoly, npoly), dtype=float)
-    for i, j in pairs:
-        dist = polygons[i].distance(polygons[j])
-        if dist < 1e-5:
-            dist = 1e-5 # if pair merely touches, we still need to get an edge
-        dists[i, j] = dist
-        dists[j, i] = dist
+    polygons = np.array(polygons, dtype=object)
+    dists = make_distances(polygons)
     dists = minimum_spanning_tree(dists, overwrite=True)
     # add bridge polygons (where necessary)
-    for prevp, nextp in zip(*dists.nonzero()):
-        prevp = polygons[prevp]
-        nextp = polygons[nextp]
-        nearest = nearest_points(prevp, nextp)
-        bridgep = LineString(nearest).buffer(max(1, scale/5), resolution=1)
-        polygons.append(bridgep)
-    jointp = unary_union(polygons)
+    prevp, nextp = dists.nonzero()
+    bridges = shapely.buffer(shapely.shortest_line(polygons[prevp], polygons[nextp]),
+                             max(1, scale/5), quad_segs=1)
+    jointp = unary_union(np.concatenate([polygons, bridges]))
     assert jointp.geom_type == 'Polygon', jointp.wkt
     # follow-up calculations will necessarily be integer;
     # so anticipate rounding here and then ensure validity
-    jointp2 = set_precision(jointp, 1.0)
+    jointp2 = shapely.set_precision(jointp, 1.0)
     if jointp2.geom_type != 'Polygon' or not jointp2.is_valid:
         jointp2 = Polygon(np.round(jointp.exterior.coords))
         jointp2 = make_valid(jointp2)
     assert jointp2.geom_type == 'Polygon', jointp2.wkt
     return jointp2
 
+def make_distances(polygons):
+    """get pairwise distances between polygons as (upper triangular) graph for the minimum spanning tree
+
+    For rectangles, calculate all distances arithmetically (if not too many).
+
+    Otherwise, only calculate distances for pairs within some radius (found via
+    spatial index), increasing it until the graph is connected. (Since the
+    maximum edge of the minimum spanning tree is the smallest radius which
+    connects all polygons, the result is the same as with all distances.)
+    """
+    import shapely
+    from shapely.strtree import STRtree
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+    npoly = len(polygons)
+    bounds = shapely.bounds(polygons)
+    if (npoly <= MAX_DENSE_DISTANCES and
+        np.all(shapely.get_num_coordinates(polygons) == 5) and
+        np.allclose(shapely.area(polygons),
+                    np.prod(bounds[:, 2:] - bounds[:, :2], axis=1))):
+        # rectangles: distance is the hypotenuse of the horizontal and vertical gaps
+        # (one axis at a time, to keep temporaries at npoly x npoly)
+        minx, miny, maxx, maxy = bounds.T
+        gapx = np.maximum(minx[:, np.newaxis] - maxx, minx - maxx[:, np.newaxis])
+        gapy = np.maximum(miny[:, np.newaxis] - maxy, miny - maxy[:, np.newaxis])
+        dists = np.hypot(np.maximum(gapx, 0, out=gapx), np.maximum(gapy, 0, out=gapy))
+        # if pair merely touches, we still need to get an edge
+        return np.triu(np.maximum(dists, 1e-5), 1)
+    tree = STRtree(polygons)
+    _, nearest = tree.query_nearest(polygons, exclusive=True, return_distance=True)
+    radius = max(1, np.max(nearest, initial=0))
+    while True:
+        prevp, nextp = tree.query(polygons, predicate='dwithin', distance=radius)
+        pairs = prevp < nextp
+        prevp, nextp = prevp[pairs], nextp[pairs]
+        dists = shapely.distance(polygons[prevp], polygons[nextp])
+        # if pair merely touches, we still need to get an edge
+        dists = np.maximum(dists, 1e-5)
+        dists = coo_matrix((dists, (prevp, nextp)), shape=(npoly, npoly)).tocsr()
+        if connected_components(dists, directed=False)[0] == 1:
+            return dists
+        radius *= 2
+
+@timed('pad_image')
 def pad_image(image, padding):
     # TODO: input padding can create extra edges if not binarized; at least try to smooth
     stat = ImageStat.Stat(image)
@@ -279,31 +333,42 @@ def pad_image(image, padding):
     padded.paste(image, (padding, padding))
     return padded
 
-def polygon_for_parent(polygon, parent):
+@timed('polygon_for_parent')
+def polygon_for_parent(polygon, parent, cache=None):
     """Clip polygon to parent polygon range.
     
+    If ``cache`` is given (a dict, e.g. per page), look up and store the
+    validated parent geometry in there (keyed by parent identity and points).
+
+    If both polygons are axis-aligned rectangles, avoid geometry operations.
+
     (Should be moved to ocrd_utils.coordinates_for_segment.)
     """
+    parentp, parent_bbox = _parent_geometry(parent, cache)
+    child_bbox = _rectangle_bbox(polygon)
+    if child_bbox is not None and parent_bbox is not None:
+        # check if clipping is necessary
+        if (child_bbox[0] >= parent_bbox[0] and child_bbox[1] >= parent_bbox[1] and
+            child_bbox[2] <= parent_bbox[2] and child_bbox[3] <= parent_bbox[3]):
+            return [(float(x), float(y)) for x, y in polygon]
+        # clip to parent (unless too small for follow-up calculations)
+        left, top = max(child_bbox[0], parent_bbox[0]), max(child_bbox[1], parent_bbox[1])
+        right, bottom = min(child_bbox[2], parent_bbox[2]), min(child_bbox[3], parent_bbox[3])
+        if right - left >= 1 and bottom - top >= 1:
+            return [(float(min(max(x, left), right)), float(min(max(y, top), bottom)))
+                    for x, y in polygon]
+    from shapely.geometry import Polygon
     childp = Polygon(polygon)
-    if isinstance(parent, PageType):
-        if parent.get_Border():
-            parentp = Polygon(polygon_from_points(parent.get_Border().get_Coords().points))
-        else:
-            parentp = Polygon([[0, 0], [0, parent.get_imageHeight()],
-                               [parent.get_imageWidth(), parent.get_imageHeight()],
-                               [parent.get_imageWidth(), 0]])
-    else:
-        parentp = Polygon(polygon_from_points(parent.get_Coords().points))
     # ensure input coords have valid paths (without self-intersection)
     # (this can happen when shapes valid in floating point are rounded)
     childp = make_valid(childp)
-    parentp = make_valid(parentp)
     if not childp.is_valid:
         return None
     if not parentp.is_valid:
         return None
     # check if clipping is necessary
-    if childp.within(parentp):
+    # (same as childp.within(parentp), but using the prepared geometry)
+    if parentp.contains(childp):
         return childp.exterior.coords[:-1]
     # clip to parent
     interp = make_intersection(childp, parentp)
@@ -311,7 +376,115 @@ def polygon_for_parent(polygon, parent):
         return None
     return interp.exterior.coords[:-1] # keep open
 
+def polygons_from_bboxes(bboxes, coords):
+    """Convert relative bboxes to absolute polygons (in batch).
+
+    Like ``coordinates_for_segment(polygon_from_x0y0x1y1(bbox), None, coords)``
+    for each of the (N, 4) ``bboxes``, but with a single matrix multiplication.
+
+    Return the rounded (N, 4, 2) numpy array of the resulting polygons.
+    """
+    bboxes = np.array(bboxes, dtype=np.float64).reshape(-1, 4)
+    # same corner order as polygon_from_x0y0x1y1
+    polygons = bboxes[:, [[0, 1], [2, 1], [2, 3], [0, 3]]]
+    # apply inverse of affine transform
+    inv_transform = np.linalg.inv(coords['transform'])
+    polygons = polygons @ inv_transform[:2, :2].T + inv_transform[:2, 2]
+    return np.round(polygons).astype(np.int32)
+
+@timed('polygons_for_parent')
+def polygons_for_parent(polygons, parent, cache=None):
+    """Clip polygons to parent polygon range (in batch).
+
+    Like ``polygon_for_parent`` for each of the (N, 4, 2) ``polygons`` (as
+    returned by ``polygons_from_bboxes``), but if the parent is an axis-aligned
+    rectangle, first find all axis-aligned rectangles within it in a single
+    operation, and only clip the others one by one.
+
+    Return a list of polygons (or None if invalid/outside), respectively.
+    """
+    results = [None] * len(polygons)
+    todo = np.ones(len(polygons), dtype=bool)
+    _, parent_bbox = _parent_geometry(parent, cache)
+    if parent_bbox is not None and len(polygons):
+        (x0, y0), (x1, y1), (x2, y2), (x3, y3) = polygons.transpose(1, 2, 0)
+        within = ((x0 == x3) & (x1 == x2) & (y0 == y1) & (y2 == y3) &
+                  (x0 < x1) & (y0 < y2) &
+                  (x0 >= parent_bbox[0]) & (y0 >= parent_bbox[1]) &
+                  (x1 <= parent_bbox[2]) & (y2 <= parent_bbox[3]))
+        for index in np.flatnonzero(within):
+            results[index] = polygons[index].tolist()
+        todo &= ~within
+    for index in np.flatnonzero(todo):
+        results[index] = polygon_for_parent(polygons[index], parent, cache=cache)
+    return results
+
+def bbox_overlaps(bboxes1, bboxes2):
+    """Calculate intersection areas between all pairs of bboxes.
+
+    Given (N, 4) and (M, 4) arrays of bboxes (as x0y0x1y1),
+    return the (N, M) array of their intersection areas.
+    """
+    bboxes1 = np.array(bboxes1).reshape(-1, 1, 4)
+    bboxes2 = np.array(bboxes2).reshape(1, -1, 4)
+    widths = (np.minimum(bboxes1[..., 2], bboxes2[..., 2]) -
+              np.maximum(bboxes1[..., 0], bboxes2[..., 0]))
+    heights = (np.minimum(bboxes1[..., 3], bboxes2[..., 3]) -
+               np.maximum(bboxes1[..., 1], bboxes2[..., 1]))
+    return np.maximum(widths, 0) * np.maximum(heights, 0)
+
+def bbox_of_segment(segment, parent_image, parent_coords):
+    """Get the bbox (as x0y0x1y1) of a segment relative to its parent image."""
+    polygon = coordinates_of_segment(segment, parent_image, parent_coords)
+    return np.concatenate([np.min(polygon, axis=0), np.max(polygon, axis=0)])
+
+def _parent_geometry(parent, cache=None):
+    # get (prepared) validated parent polygon and its bbox (if a rectangle)
+    if isinstance(parent, PageType):
+        if parent.get_Border():
+            points = parent.get_Border().get_Coords().points
+        else:
+            points = None
+    else:
+        points = parent.get_Coords().points
+    if cache is not None:
+        entry = cache.get(id(parent), None)
+        if entry and entry[0] is parent and entry[1] == points:
+            return entry[2:]
+    if points is None:
+        polygon = [[0, 0], [0, parent.get_imageHeight()],
+                   [parent.get_imageWidth(), parent.get_imageHeight()],
+                   [parent.get_imageWidth(), 0]]
+    else:
+        polygon = polygon_from_points(points)
+    import shapely
+    from shapely.geometry import Polygon
+    parentp = make_valid(Polygon(polygon))
+    shapely.prepare(parentp)
+    bbox = _rectangle_bbox(polygon)
+    if cache is not None:
+        # (keep reference to parent, so its id cannot be reused)
+        cache[id(parent)] = (parent, points, parentp, bbox)
+    return parentp, bbox
+
+def _rectangle_bbox(polygon):
+    # get bbox of polygon if it is an axis-aligned rectangle (with positive area)
+    if len(polygon) != 4:
+        return None
+    (x0, y0), (x1, y1), (x2, y2), (x3, y3) = polygon
+    # edges must alternate between vertical and horizontal
+    if not (x0 == x1 and y1 == y2 and x2 == x3 and y3 == y0 or
+            y0 == y1 and x1 == x2 and y2 == y3 and x3 == x0):
+        return None
+    left, right = min(x0, x2), max(x0, x2)
+    top, bottom = min(y0, y2), max(y0, y2)
+    if left >= right or top >= bottom:
+        return None
+    return left, top, right, bottom
+
 def make_intersection(poly1, poly2):
+    from shapely.geometry import Polygon
+    from shapely.ops import unary_union
     interp = poly1.intersection(poly2)
     # post-process
     if interp.is_empty or interp.area == 0.0:
@@ -332,29 +505,64 @@ def make_intersection(poly1, poly2):
         interp = make_valid(interp)
     return interp
 
+@timed('make_valid')
 def make_valid(polygon):
-    points = list(polygon.exterior.coords)
-    for split in range(1, len(points)):
-        if polygon.is_valid or polygon.simplify(polygon.area).is_valid:
-            break
-        # simplification may not be possible (at all) due to ordering
-        # in that case, try another starting point
-        polygon = Polygon(points[-split:]+points[:-split])
+    """ensure polygon is valid (without self-intersection) and a single part, in bounded time
+
+    Try repairing by shapely first (its linework method only for few vertices,
+    because its runtime grows quickly with the number of self-intersections,
+    otherwise its structure method). If that does not yield a single polygon,
+    try by zero buffering, then by simplification, and then by enlarging, each
+    with exponentially increasing tolerance (up to ``MAX_VALID_STEPS`` times).
+    No candidate may lose more than 10% of the area covered by the repaired parts.
+    As a last resort, use the convex hull.
+    """
+    if polygon.is_valid:
+        return polygon
+    import shapely
+    if len(polygon.exterior.coords) <= MAX_REPAIR_POINTS:
+        repaired = shapely.make_valid(polygon)
+    else:
+        try:
+            repaired = shapely.make_valid(polygon, method='structure', keep_collapsed=False)
+        except (TypeError, ValueError, shapely.errors.UnsupportedGEOSVersionError):
+            # (structure method needs shapely 2.1 and GEOS 3.10)
+            repaired = shapely.unary_union(shapely.polygonize(
+                shapely.get_parts(shapely.node(polygon.exterior))))
+    # (keeps all parts)
+    parts = [part for part in shapely.get_parts(repaired)
+             if part.area > 0]
+    if len(parts) == 1 and parts[0].geom_type == 'Polygon':
+        return parts[0]
+    repaired = shapely.union_all(parts)
+    def keeps_area(candidate):
+        return (_is_valid_polygon(candidate) and
+                candidate.intersection(repaired).area >= 0.9 * repaired.area)
+    # try by buffering (can lose parts)
+    candidate = polygon.buffer(0)
+    if keeps_area(candidate):
+        return candidate
     # try by simplification
-    for tolerance in range(int(polygon.area + 1.5)):
-        if polygon.is_valid:
-            break
-        # simplification may require a larger tolerance
-        polygon = polygon.simplify(tolerance + 1)
+    # (preserving topology does not work on invalid input)
+    for step in range(MAX_VALID_STEPS):
+        candidate = polygon.simplify(2 ** step, preserve_topology=False)
+        if keeps_area(candidate):
+            return candidate
     # try by enlarging
-    for tolerance in range(1, int(polygon.area + 2.5)):
-        if polygon.is_valid:
-            break
-        # enlargement may require a larger tolerance
-        polygon = polygon.buffer(tolerance)
+    for step in range(MAX_VALID_STEPS):
+        candidate = polygon.buffer(2 ** step)
+        if keeps_area(candidate):
+            return candidate
+    polygon = polygon.convex_hull
+    if polygon.geom_type != 'Polygon':
+        # degenerate (zero area)
+        polygon = polygon.buffer(1)
     assert polygon.is_valid, polygon.wkt
     return polygon
 
+def _is_valid_polygon(polygon):
+    return polygon.geom_type == 'Polygon' and polygon.is_valid and polygon.area > 0
+
 def iterate_level(it, ril, parent=None):
     LOG = getLogger('processor.TesserocrRecognize')
     # improves over tesserocr.iterate_level by
@@ -394,3 +602,110 @@ def iterate_level(it, ril, parent=None):
             if not it.Next(ril):
                 break
         pos += 1
+
+def get_models():
+    """Get the tessdata directory and its installed models (cached per process).
+
+    Return the path (like ``tesserocr.get_languages``) and a dict mapping each
+    model name to its file ``size`` and whether it contains ``legacy`` and/or
+    ``lstm`` components. Only scan the directory (recursively, like Tesseract)
+    again if the modification time of the directory or any of its subdirectories
+    has changed since.
+    """
+    path = os.environ.get('TESSDATA_PREFIX')
+    if path:
+        path = os.path.join(path, '')
+    else:
+        path = _default_tessdata()
+    if path in _MODELS:
+        mtimes, models = _MODELS[path]
+        try:
+            if all(os.stat(dirpath).st_mtime_ns == mtime
+                   for dirpath, mtime in mtimes.items()):
+                return path, models
+        except OSError:
+            pass
+    mtimes = {}
+    models = {}
+    for dirpath, _, filenames in os.walk(path, followlinks=True):
+        mtimes[dirpath] = os.stat(dirpath).st_mtime_ns
+        for filename in filenames:
+            if not filename.endswith('.traineddata'):
+                continue
+            filepath = os.path.join(dirpath, filename)
+            name = os.path.relpath(filepath, path)[:-len('.traineddata')]
+            models[name] = _read_traineddata_header(filepath)
+    _MODELS[path] = mtimes, models
+    return path, models
+
+def _default_tessdata():
+    # compiled-in default (without TESSDATA_PREFIX) cannot change during runtime
+    if None not in _MODELS:
+        _MODELS[None] = get_languages()[0]
+    return _MODELS[None]
+
+def _read_traineddata_header(filepath):
+    # header: number of entries (int32), then offset of each component (int64, -1 if absent)
+    model = {'size': os.path.getsize(filepath), 'legacy': False, 'lstm': False}
+    try:
+        with open(filepath, 'rb') as file:
+            header = file.read(4)
+            for order in '<>':
+                num_entries, = struct.unpack(order + 'i', header)
+                if 0 < num_entries <= 1000:
+                    break
+            else:
+                return model
+            offsets = struct.unpack('%s%dq' % (order, num_entries), file.read(8 * num_entries))
+    except (OSError, struct.error):
+        return model
+    model['legacy'] = num_entries > TESSDATA_INTTEMP and offsets[TESSDATA_INTTEMP] >= 0
+    model['lstm'] = num_entries > TESSDATA_LSTM and offsets[TESSDATA_LSTM] >= 0
+    return model
+
+def check_model(model, oem='DEFAULT'):
+    """Ensure every part of ``model`` (like ``deu+eng``) is installed and usable with ``oem`` (by name).
+
+    (Raise an exception instead of letting Tesseract fail on init.)
+    """
+    path, models = get_models()
+    for sub_model in model.split('+'):
+        if sub_model not in models:
+            raise Exception("configured model " + sub_model + " is not installed in " + path)
+        if oem in ['TESSERACT_ONLY', 'TESSERACT_LSTM_COMBINED']:
+            if not models[sub_model]['legacy']:
+                raise Exception("configured model " + sub_model + " has no legacy (pre-LSTM) "
+                                "components, which are needed for oem " + oem)
+        elif not models[sub_model]['lstm']:
+            if not models[sub_model]['legacy']:
+                raise Exception("configured model " + sub_model + " has neither LSTM nor legacy components")
+            if oem == 'LSTM_ONLY':
+                # Tesseract falls back to legacy
+                getLogger('processor.TesserocrRecognize').warning(
+                    "configured model %s has no LSTM components, using legacy instead", sub_model)
+
+def memory_usage():
+    """Get the resident (RSS) and proportional (PSS) memory size of this process in MiB.
+
+    (Only on Linux, otherwise return None.)
+    """
+    usage = {}
+    try:
+        with open('/proc/self/smaps_rollup') as smaps:
+            for line in smaps:
+                key, _, value = line.partition(':')
+                if key in ['Rss', 'Pss']:
+                    usage[key] = int(value.split()[0]) / 1024
+    except OSError:
+        return None
+    if len(usage) < 2:
+        return None
+    return usage['Rss'], usage['Pss']
+
+def trim_memory():
+    """Return free heap memory of this process to the OS (only with glibc, otherwise no-op)."""
+    import ctypes
+    try:
+        ctypes.CDLL(None).malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
@@ -25,6 +25,72 @@ from ocrd.processor import OcrdPageResult, OcrdPageResultImage
 
 from .recognize import TesserocrRecognize
 from .common import polygon_for_parent
+from .timing import TIMER
+
+def filter_text_block(image, ident, zoom, logger):
+    """Check whether the text block ``ident`` with binarized ``image`` is large enough to delimit the page."""
+    # filter region results:
+    bin_bbox = image.getbbox() if image else None
+    if not bin_bbox:
+        # this does happen!
+        logger.warning("Ignoring region '%s' because its binarization is empty", ident)
+        return False
+    width = bin_bbox[2]-bin_bbox[0]
+    if width < 25 / zoom:
+        # we must be conservative here: page numbers are tiny regions, too!
+        logger.warning("Ignoring region '%s' because its width is too small (%d)", ident, width)
+        return False
+    height = bin_bbox[3]-bin_bbox[1]
+    if height < 25 / zoom:
+        # we must be conservative here: page numbers are tiny regions, too!
+        logger.warning("Ignoring region '%s' because its height is too small (%d)", ident, height)
+        return False
+    return True
+
+def combine_bounds(page, page_image, bboxes, logger):
+    """Get outer bounds of all detected text blocks ``bboxes`` and existing text regions of ``page``."""
+    all_left = page_image.width
+    all_top = page_image.height
+    all_right = 0
+    all_bottom = 0
+    for left, top, right, bottom in bboxes:
+        all_left = min(all_left, left)
+        all_top = min(all_top, top)
+        all_right = max(all_right, right)
+        all_bottom = max(all_bottom, bottom)
+    # use existing segmentation as "upper bound"
+    regions = page.get_AllRegions(classes=['Text'])
+    for region in regions:
+        left, top, right, bottom = bbox_from_points(region.get_Coords().points)
+        logger.debug("Found existing text region '%s': %i:%i,%i:%i",
+                     region.id, left, right, top, bottom)
+        all_left = min(all_left, left)
+        all_top = min(all_top, top)
+        all_right = max(all_right, right)
+        all_bottom = max(all_bottom, bottom)
+    logger.info("Combined page bounds from text regions: %i:%i,%i:%i",
+                all_left, all_right, all_top, all_bottom)
+    return all_left, all_top, all_right, all_bottom
+
+def get_border(page, page_image, page_xywh, bounds, padding, logger) -> Optional[BorderType]:
+    """Get the page border from ``bounds`` (padded and within the page), if valid."""
+    left, top, right, bottom = bounds
+    if left >= right or top >= bottom:
+        logger.error("Cannot find valid extent for page")
+        return None
+    # add padding:
+    left = max(left - padding, 0)
+    right = min(right + padding, page_image.width)
+    top = max(top - padding, 0)
+    bottom = min(bottom + padding, page_image.height)
+    logger.info("Padded page border: %i:%i,%i:%i", left, right, top, bottom)
+    polygon = polygon_from_bbox(left, top, right, bottom)
+    polygon = coordinates_for_segment(polygon, page_image, page_xywh)
+    polygon = polygon_for_parent(polygon, page)
+    if polygon is None:
+        logger.error("Ignoring extant border")
+        return None
+    return BorderType(Coords=CoordsType(points_from_polygon(polygon)))
 
 class TesserocrCrop(TesserocrRecognize):
     @property
@@ -32,8 +98,9 @@ class TesserocrCrop(TesserocrRecognize):
         return 'ocrd-tesserocr-crop'
 
     def _init(self):
-        # use default model (eng) with vanilla tesserocr API
-        self.tessapi = tesserocr.PyTessBaseAPI()
+        # use vanilla tesserocr API without model (only layout analysis)
+        self.tessapi = tesserocr.PyTessBaseAPI(init=False)
+        self.tessapi.InitForAnalysePage()
         # disable table detection here (tables count as text blocks),
         # because we do not want to risk confusing the spine with
         # a column separator and thus creeping into a neighbouring
@@ -98,20 +165,20 @@ class TesserocrCrop(TesserocrRecognize):
         
     def _estimate_bounds(self, page, page_image, zoom=1.0):
         """Get outer bounds of all (existing or detected) regions."""
-        all_left = page_image.width
-        all_top = page_image.height
-        all_right = 0
-        all_bottom = 0
         self.logger.info("Cropping with Tesseract")
-        self.tessapi.SetImage(page_image)
+        with TIMER('SetImage'):
+            self.tessapi.SetImage(page_image)
         # PSM.SPARSE_TEXT: get as much text as possible in no particular order
         # PSM.AUTO (default): includes tables (dangerous)
         # PSM.SPARSE_TEXT_OSD: sparse but all orientations
         self.tessapi.SetPageSegMode(tesserocr.PSM.SPARSE_TEXT)
         #
-        # iterate over all text blocks and compare their
-        # bbox extent to the running min and max values
-        for component in self.tessapi.GetComponentImages(tesserocr.RIL.BLOCK, True):
+        # iterate over all text blocks and collect
+        # the bboxes of those large enough
+        with TIMER('GetComponentImages'):
+            components = self.tessapi.GetComponentImages(tesserocr.RIL.BLOCK, True)
+        bboxes = []
+        for component in components:
             image, xywh, index, _ = component
             #
             # the region reference in the reading order element
@@ -120,61 +187,16 @@ class TesserocrCrop(TesserocrRecognize):
             left, top, right, bottom = bbox_from_xywh(xywh)
             self.logger.debug("Detected text region '%s': %i:%i,%i:%i",
                               ID, left, right, top, bottom)
-            # filter region results:
-            bin_bbox = image.getbbox()
-            if not bin_bbox:
-                # this does happen!
-                self.logger.warning("Ignoring region '%s' because its binarization is empty", ID)
-                continue
-            width = bin_bbox[2]-bin_bbox[0]
-            if width < 25 / zoom:
-                # we must be conservative here: page numbers are tiny regions, too!
-                self.logger.warning("Ignoring region '%s' because its width is too small (%d)", ID, width)
-                continue
-            height = bin_bbox[3]-bin_bbox[1]
-            if height < 25 / zoom:
-                # we must be conservative here: page numbers are tiny regions, too!
-                self.logger.warning("Ignoring region '%s' because its height is too small (%d)", ID, height)
-                continue
-            all_left = min(all_left, left)
-            all_top = min(all_top, top)
-            all_right = max(all_right, right)
-            all_bottom = max(all_bottom, bottom)
-        # use existing segmentation as "upper bound"
-        regions = page.get_AllRegions(classes=['Text'])
-        for region in regions:
-            left, top, right, bottom = bbox_from_points(region.get_Coords().points)
-            self.logger.debug("Found existing text region '%s': %i:%i,%i:%i",
-                              region.id, left, right, top, bottom)
-            all_left = min(all_left, left)
-            all_top = min(all_top, top)
-            all_right = max(all_right, right)
-            all_bottom = max(all_bottom, bottom)
-        self.logger.info("Combined page bounds from text regions: %i:%i,%i:%i",
-                         all_left, all_right, all_top, all_bottom)
-        return all_left, all_top, all_right, all_bottom
+            if filter_text_block(image, ID, zoom, self.logger):
+                bboxes.append((left, top, right, bottom))
+        return combine_bounds(page, page_image, bboxes, self.logger)
 
     def _process_page(self, page, page_image, page_xywh, bounds) -> Optional[OcrdPageResultImage]:
         """Set the identified page border, if valid."""
-        left, top, right, bottom = bounds
-        if left >= right or top >= bottom:
-            self.logger.error("Cannot find valid extent for page")
-            return None
-        padding = self.parameter['padding']
-        # add padding:
-        left = max(left - padding, 0)
-        right = min(right + padding, page_image.width)
-        top = max(top - padding, 0)
-        bottom = min(bottom + padding, page_image.height)
-        self.logger.info("Padded page border: %i:%i,%i:%i", left, right, top, bottom)
-        polygon = polygon_from_bbox(left, top, right, bottom)
-        polygon = coordinates_for_segment(polygon, page_image, page_xywh)
-        polygon = polygon_for_parent(polygon, page)
-        if polygon is None:
-            self.logger.error("Ignoring extant border")
+        border = get_border(page, page_image, page_xywh, bounds,
+                            self.parameter['padding'], self.logger)
+        if not border:
             return None
-        border = BorderType(Coords=CoordsType(
-            points_from_polygon(polygon)))
         # intersection with parent could have changed bbox,
         # so recalculate:
         bbox = bbox_from_polygon(coordinates_of_segment(border, page_image, page_xywh))
@@ -23,6 +23,133 @@ from ocrd_models.ocrd_page import (
 from ocrd.processor import OcrdPageResult, OcrdPageResultImage
 
 from .recognize import TesserocrRecognize
+from .timing import TIMER
+
+# map Tesseract OSD script names to PAGE script values
+OSD_SCRIPTS = {
+    "Arabic": "Arab - Arabic",
+    "Armenian": "Armn - Armenian",
+    "Bengali": "Armn - Armenian",
+    "Canadian_Aboriginal": "Cans - Unified Canadian Aboriginal Syllabics",
+    "Cherokee": "Cher - Cherokee",
+    "Common": "Latn - Latin", # not in scripts/
+    "Cyrillic": "Cyrl - Cyrillic",
+    "Devanagari": "Deva - Devanagari (Nagari)",
+    "Ethiopic": "Ethi - Ethiopic",
+    "Fraktur": "Latf - Latin (Fraktur variant)",
+    "Georgian": "Geor - Georgian (Mkhedruli)",
+    "Greek": "Grek - Greek",
+    "Gujarati": "Gujr - Gujarati",
+    "Gurmukhi": "Guru - Gurmukhi",
+    "Han": "Hant - Han (Traditional variant)", # not in scripts/
+    "Hangul": "Hang - Hangul",
+    "Hangul_vert": "Hang - Hangul",
+    "HanS": "Hans - Han (Simplified variant)",
+    "HanS_vert": "Hans - Han (Simplified variant)",
+    "HanT": "Hant - Han (Traditional variant)",
+    "HanT_vert": "Hant - Han (Traditional variant)",
+    "Hebrew": "Hebr - Hebrew",
+    "Hiragana": "Jpan - Japanese", # not in scripts/
+    "Japanese": "Jpan - Japanese",
+    "Japanese_vert": "Jpan - Japanese",
+    "Kannada": "Knda - Kannada",
+    "Katakana": "Jpan - Japanese", # not in scripts/
+    "Khmer": "Khmr - Khmer",
+    "Lao": "Laoo - Lao",
+    "Latin": "Latn - Latin",
+    "Malayalam": "Mlym - Malayalam",
+    "Myanmar": "Mymr - Myanmar (Burmese)",
+    "Oriya": "Orya - Oriya",
+    "Sinhala": "Sinh - Sinhala",
+    "Syriac": "Syrc - Syriac",
+    "Tamil": "Taml - Tamil",
+    "Telugu": "Telu - Telugu",
+    "Thaana": "Thaa - Thaana",
+    "Thai": "Thai - Thai",
+    "Tibetan": "Tibt - Tibetan",
+    "Vietnamese": "Tavt - Tai Viet",
+}
+
+
+def detect_orientation(tessapi, segment, min_confidence, where, logger):
+    """Run OSD on the current image of ``tessapi``, annotate the script of ``segment``, and return its orientation angle.
+
+    (The angle is zero unless detected with at least ``min_confidence``.)
+    """
+    angle = 0.
+    with TIMER('DetectOrientationScript'):
+        osr = tessapi.DetectOrientationScript()
+    if not osr:
+        logger.warning('no OSD result in %s', where)
+        return angle
+    assert not math.isnan(osr['orient_conf']), \
+        "orientation detection failed (Tesseract probably compiled without legacy OEM, or osd model not installed)"
+    if osr['orient_conf'] < min_confidence:
+        logger.info('ignoring OSD orientation result %d° clockwise due to low confidence %.0f in %s',
+                    osr['orient_deg'], osr['orient_conf'], where)
+    else:
+        logger.info('applying OSD orientation result %d° clockwise with high confidence %.0f in %s',
+                    osr['orient_deg'], osr['orient_conf'], where)
+        # defined as 'the detected clockwise rotation of the input image'
+        # i.e. the same amount to be applied counter-clockwise for deskewing:
+        angle = osr['orient_deg']
+    assert not math.isnan(osr['script_conf']), \
+        "script detection failed (Tesseract probably compiled without legacy OEM, or osd model not installed)"
+    if osr['script_conf'] < 10:
+        logger.info('ignoring OSD script result "%s" due to low confidence %.0f in %s',
+                    osr['script_name'], osr['script_conf'], where)
+    else:
+        logger.info('applying OSD script result "%s" with high confidence %.0f in %s',
+                    osr['script_name'], osr['script_conf'], where)
+        if isinstance(segment, (TextLineType, TextRegionType, PageType)):
+            segment.set_primaryScript(OSD_SCRIPTS.get(osr['script_name'], "Latn - Latin"))
+    return angle
+
+def detect_skew(layout, segment, angle, where, logger):
+    """Annotate reading direction and line order of ``segment`` from ``layout``, and return its skew angle.
+
+    (Also compare the orientation of ``layout`` with ``angle`` from OSD, which takes precedence.)
+    """
+    orientation, writing_direction, textline_order, deskew_angle = layout.Orientation()
+    if isinstance(segment, (TextRegionType, PageType)):
+        segment.set_readingDirection({
+            WritingDirection.LEFT_TO_RIGHT: 'left-to-right',
+            WritingDirection.RIGHT_TO_LEFT: 'right-to-left',
+            WritingDirection.TOP_TO_BOTTOM: 'top-to-bottom'
+        }.get(writing_direction, 'bottom-to-top'))
+        segment.set_textLineOrder({
+            TextlineOrder.LEFT_TO_RIGHT: 'left-to-right',
+            TextlineOrder.RIGHT_TO_LEFT: 'right-to-left',
+            TextlineOrder.TOP_TO_BOTTOM: 'top-to-bottom'
+        }.get(textline_order, 'bottom-to-top'))
+    # baseline = layout.Baseline(RIL.BLOCK)
+    # if baseline:
+    #     points = points_from_x0y0x1y1(list(baseline[0]) + list(baseline[1]))
+    #     segment.add_Baseline(BaselineType(points=points))
+    # defined as 'how many radians does one have to rotate the block anti-clockwise'
+    # i.e. positive amount to be applied counter-clockwise for deskewing:
+    deskew_angle *= 180 / math.pi
+    logger.info('orientation/deskewing for %s: %s / %s / %s / %.3f°', where,
+                membername(Orientation, orientation),
+                membername(WritingDirection, writing_direction),
+                membername(TextlineOrder, textline_order),
+                deskew_angle)
+    # defined as 'the amount of clockwise rotation to be applied to the input image'
+    # i.e. the negative amount to be applied counter-clockwise for deskewing:
+    # (as defined in Tesseract OrientationIdToValue):
+    angle2 = {
+        Orientation.PAGE_RIGHT: 90,
+        Orientation.PAGE_DOWN: 180,
+        Orientation.PAGE_LEFT: 270
+    }.get(orientation, 0)
+    if angle2 != angle:
+        # This effectively ignores Orientation from AnalyseLayout,
+        # because it is usually wrong when it deviates from OSD results.
+        # (We do keep deskew_angle, though.)
+        # FIXME: revisit that decision after trying with api.set_min_orientation_margin
+        logger.warning('inconsistent angles from layout analysis (%d) and orientation detection (%d) in %s',
+                       angle2, angle, where)
+    return deskew_angle
 
 
 class TesserocrDeskew(TesserocrRecognize):
@@ -122,127 +249,26 @@ class TesserocrDeskew(TesserocrRecognize):
             self.logger.warning("Skipping %s with zero size", where)
             return None
         angle0 = xywh['angle'] # deskewing (w.r.t. top image) already applied to image
-        angle = 0. # additional angle to be applied at current level
-        self.tessapi.SetImage(image)
+        with TIMER('SetImage'):
+            self.tessapi.SetImage(image)
         #self.tessapi.SetPageSegMode(PSM.AUTO_OSD)
         #
         # orientation/script
         #
-        osr = self.tessapi.DetectOrientationScript()
-        if osr:
-            assert not math.isnan(osr['orient_conf']), \
-                "orientation detection failed (Tesseract probably compiled without legacy OEM, or osd model not installed)"
-            if osr['orient_conf'] < self.parameter['min_orientation_confidence']:
-                self.logger.info('ignoring OSD orientation result %d° clockwise due to low confidence %.0f in %s',
-                                 osr['orient_deg'], osr['orient_conf'], where)
-            else:
-                self.logger.info('applying OSD orientation result %d° clockwise with high confidence %.0f in %s',
-                                 osr['orient_deg'], osr['orient_conf'], where)
-                # defined as 'the detected clockwise rotation of the input image'
-                # i.e. the same amount to be applied counter-clockwise for deskewing:
-                angle = osr['orient_deg']
-            assert not math.isnan(osr['script_conf']), \
-                "script detection failed (Tesseract probably compiled without legacy OEM, or osd model not installed)"
-            if osr['script_conf'] < 10:
-                self.logger.info('ignoring OSD script result "%s" due to low confidence %.0f in %s',
-                                 osr['script_name'], osr['script_conf'], where)
-            else:
-                self.logger.info('applying OSD script result "%s" with high confidence %.0f in %s',
-                                 osr['script_name'], osr['script_conf'], where)
-                if isinstance(segment, (TextLineType, TextRegionType, PageType)):
-                    segment.set_primaryScript({
-                        "Arabic": "Arab - Arabic",
-                        "Armenian": "Armn - Armenian",
-                        "Bengali": "Armn - Armenian",
-                        "Canadian_Aboriginal": "Cans - Unified Canadian Aboriginal Syllabics",
-                        "Cherokee": "Cher - Cherokee",
-                        "Common": "Latn - Latin", # not in scripts/
-                        "Cyrillic": "Cyrl - Cyrillic",
-                        "Devanagari": "Deva - Devanagari (Nagari)",
-                        "Ethiopic": "Ethi - Ethiopic",
-                        "Fraktur": "Latf - Latin (Fraktur variant)",
-                        "Georgian": "Geor - Georgian (Mkhedruli)",
-                        "Greek": "Grek - Greek",
-                        "Gujarati": "Gujr - Gujarati",
-                        "Gurmukhi": "Guru - Gurmukhi",
-                        "Han": "Hant - Han (Traditional variant)", # not in scripts/
-                        "Hangul": "Hang - Hangul",
-                        "Hangul_vert": "Hang - Hangul",
-                        "HanS": "Hans - Han (Simplified variant)",
-                        "HanS_vert": "Hans - Han (Simplified variant)",
-                        "HanT": "Hant - Han (Traditional variant)",
-                        "HanT_vert": "Hant - Han (Traditional variant)",
-                        "Hebrew": "Hebr - Hebrew",
-                        "Hiragana": "Jpan - Japanese", # not in scripts/
-                        "Japanese": "Jpan - Japanese",
-                        "Japanese_vert": "Jpan - Japanese",
-                        "Kannada": "Knda - Kannada",
-                        "Katakana": "Jpan - Japanese", # not in scripts/
-                        "Khmer": "Khmr - Khmer",
-                        "Lao": "Laoo - Lao",
-                        "Latin": "Latn - Latin",
-                        "Malayalam": "Mlym - Malayalam",
-                        "Myanmar": "Mymr - Myanmar (Burmese)",
-                        "Oriya": "Orya - Oriya",
-                        "Sinhala": "Sinh - Sinhala",
-                        "Syriac": "Syrc - Syriac",
-                        "Tamil": "Taml - Tamil",
-                        "Telugu": "Telu - Telugu",
-                        "Thaana": "Thaa - Thaana",
-                        "Thai": "Thai - Thai",
-                        "Tibetan": "Tibt - Tibetan",
-                        "Vietnamese": "Tavt - Tai Viet",
-                    }.get(osr['script_name'], "Latn - Latin"))
-        else:
-            self.logger.warning('no OSD result in %s', where)
+        # additional angle to be applied at current level
+        angle = detect_orientation(self.tessapi, segment, self.parameter['min_orientation_confidence'],
+                                   where, self.logger)
         if isinstance(segment, TextLineType):
             return None
         #
         # orientation/skew
         #
-        layout = self.tessapi.AnalyseLayout()
+        with TIMER('AnalyseLayout'):
+            layout = self.tessapi.AnalyseLayout()
         if not layout:
             self.logger.warning('no result iterator in %s', where)
             return None
-        orientation, writing_direction, textline_order, deskew_angle = layout.Orientation()
-        if isinstance(segment, (TextRegionType, PageType)):
-            segment.set_readingDirection({
-                WritingDirection.LEFT_TO_RIGHT: 'left-to-right',
-                WritingDirection.RIGHT_TO_LEFT: 'right-to-left',
-                WritingDirection.TOP_TO_BOTTOM: 'top-to-bottom'
-            }.get(writing_direction, 'bottom-to-top'))
-            segment.set_textLineOrder({
-                TextlineOrder.LEFT_TO_RIGHT: 'left-to-right',
-                TextlineOrder.RIGHT_TO_LEFT: 'right-to-left',
-                TextlineOrder.TOP_TO_BOTTOM: 'top-to-bottom'
-            }.get(textline_order, 'bottom-to-top'))
-        # baseline = layout.Baseline(RIL.BLOCK)
-        # if baseline:
-        #     points = points_from_x0y0x1y1(list(baseline[0]) + list(baseline[1]))
-        #     segment.add_Baseline(BaselineType(points=points))
-        # defined as 'how many radians does one have to rotate the block anti-clockwise'
-        # i.e. positive amount to be applied counter-clockwise for deskewing:
-        deskew_angle *= 180 / math.pi
-        self.logger.info('orientation/deskewing for %s: %s / %s / %s / %.3f°', where,
-                         membername(Orientation, orientation),
-                         membername(WritingDirection, writing_direction),
-                         membername(TextlineOrder, textline_order),
-                         deskew_angle)
-        # defined as 'the amount of clockwise rotation to be applied to the input image'
-        # i.e. the negative amount to be applied counter-clockwise for deskewing:
-        # (as defined in Tesseract OrientationIdToValue):
-        angle2 = {
-            Orientation.PAGE_RIGHT: 90,
-            Orientation.PAGE_DOWN: 180,
-            Orientation.PAGE_LEFT: 270
-        }.get(orientation, 0)
-        if angle2 != angle:
-            # This effectively ignores Orientation from AnalyseLayout,
-            # because it is usually wrong when it deviates from OSD results.
-            # (We do keep deskew_angle, though – see below.)
-            # FIXME: revisit that decision after trying with api.set_min_orientation_margin
-            self.logger.warning('inconsistent angles from layout analysis (%d) and orientation detection (%d) in %s',
-                                angle2, angle, where)
+        deskew_angle = detect_skew(layout, segment, angle, where, self.logger)
         # annotate result:
         angle += deskew_angle
         # page angle: PAGE @orientation is defined clockwise,
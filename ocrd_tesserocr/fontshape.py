@@ -2,19 +2,28 @@ from __future__ import absolute_import
 
 from typing import Optional
 import os.path
+from collections import Counter
+from copy import copy
 from PIL import Image, ImageStat
 
 from tesserocr import (
     RIL, PSM, OEM,
     PyTessBaseAPI, 
-    get_languages
 )
 
 from ocrd_models.ocrd_page import TextStyleType, OcrdPage
 from ocrd.processor import OcrdPageResult
 
 from .recognize import TesserocrRecognize
-from .common import pad_image
+from .common import (
+    check_model,
+    get_models,
+    pad_image,
+    iterate_level,
+    bbox_overlaps,
+    bbox_of_segment
+)
+from .timing import TIMER
 
 class TesserocrFontShape(TesserocrRecognize):
     @property
@@ -23,14 +32,14 @@ class TesserocrFontShape(TesserocrRecognize):
 
     def _init(self):
         model = self.parameter['model']
-        if model not in get_languages()[1]:
-            raise Exception("model " + model + " (needed for font style detection) is not installed")
+        # (needed for font style detection)
+        check_model(model, 'TESSERACT_ONLY')
         # use vanilla tesserocr API
         self.tessapi = PyTessBaseAPI(oem=OEM.TESSERACT_ONLY, # legacy required for OSD or WordFontAttributes!
                                      #oem=OEM.TESSERACT_LSTM_COMBINED,
                                      lang=model)
         self.logger.info("Using model '%s' in %s for recognition at the word level",
-                         model, get_languages()[0])
+                         model, get_models()[0])
 
     def process_page_pcgts(self, *input_pcgts: Optional[OcrdPage], page_id: Optional[str] = None) -> OcrdPageResult:
         """Detect font shapes via rule-based OCR with Tesseract on the workspace.
@@ -45,6 +54,18 @@ class TesserocrFontShape(TesserocrRecognize):
         Query the result's font attributes and write them into the word element's
         ``TextStyle``.
         
+        If ``operation_level`` is ``line`` (or ``region``), then recognise
+        each line's (or region's) image only once instead, and assign each
+        detected word's font attributes to the existing word it overlaps most
+        with. (Words without any overlapping result get recognised on their own.)
+        
+        If ``sample_size`` is positive, then within each region (or line, depending
+        on ``sample_level``), first recognise only a sample of its words on their
+        own. If they agree on the font shape with high confidence, then annotate
+        the other words with their most frequent style without recognising them.
+        
+        Unless ``overwrite_style`` is set, skip words which already have a ``TextStyle``.
+        
         Produce new output files by serialising the resulting hierarchy.
         """
         pcgts = input_pcgts[0]
@@ -82,10 +103,38 @@ class TesserocrFontShape(TesserocrRecognize):
             textlines = region.get_TextLine()
             if not textlines:
                 self.logger.warning("Region '%s' contains no text lines", region.id)
+                continue
+            words = self._get_words([word for line in textlines for word in line.get_Word()])
+            done = set()
+            if self.parameter['sample_size']:
+                if self.parameter['sample_level'] == 'region':
+                    remaining = self._process_sample(words, region_image, region_coords)
+                elif self.parameter['operation_level'] == 'region':
+                    # sample each line before recognizing the region as a whole
+                    remaining = []
+                    for line in textlines:
+                        line_image, line_coords = self.workspace.image_from_segment(
+                            line, region_image, region_coords)
+                        remaining.extend(self._process_sample(self._get_words(line.get_Word()),
+                                                              line_image, line_coords))
+                else:
+                    # (sampled in _process_lines)
+                    remaining = words
+                done = set(word.id for word in words) - set(word.id for word in remaining)
+                words = remaining
+            if not words:
+                continue
+            if self.parameter['operation_level'] == 'region':
+                self.logger.debug("Recognizing text in region '%s'", region.id)
+                with TIMER('SetImage'):
+                    self.tessapi.SetImage(region_image)
+                self.tessapi.SetPageSegMode(PSM.SINGLE_BLOCK)
+                words = self._process_aligned(words, region_image, region_coords)
+                self._process_words(words, region_image, region_coords)
             else:
-                self._process_lines(textlines, region_image, region_coords)
+                self._process_lines(textlines, region_image, region_coords, done)
 
-    def _process_lines(self, textlines, region_image, region_coords):
+    def _process_lines(self, textlines, region_image, region_coords, done):
         for line in textlines:
             line_image, line_coords = self.workspace.image_from_segment(
                 line, region_image, region_coords)
@@ -93,49 +142,149 @@ class TesserocrFontShape(TesserocrRecognize):
             words = line.get_Word()
             if not words:
                 self.logger.warning("Line '%s' contains no words", line.id)
-            else:
-                self._process_words(words, line_image, line_coords)
+                continue
+            words = [word for word in self._get_words(words) if word.id not in done]
+            if (self.parameter['sample_size'] and
+                self.parameter['sample_level'] == 'line'):
+                words = self._process_sample(words, line_image, line_coords)
+            if not words:
+                continue
+            if self.parameter['operation_level'] == 'line':
+                with TIMER('SetImage'):
+                    self.tessapi.SetImage(line_image)
+                self.tessapi.SetPageSegMode(PSM.SINGLE_LINE)
+                words = self._process_aligned(words, line_image, line_coords)
+            self._process_words(words, line_image, line_coords)
+
+    def _get_words(self, words):
+        """Filter ``words`` which still need font attributes (or all if ``overwrite_style``)."""
+        if self.parameter['overwrite_style']:
+            return words
+        return [word for word in words if not word.get_TextStyle()]
+
+    def _process_sample(self, words, parent_image, parent_coords):
+        """Detect font attributes on a sample of ``words``, and propagate if they agree.
+
+        Recognize up to ``sample_size`` words (evenly spaced) on their own.
+        If all of them yield a style with the same font shape, and at least
+        ``sample_confidence``, then annotate the most frequent style among them
+        on all other ``words``.
+
+        Return the list of words which still need to be processed.
+        """
+        sample_size = self.parameter['sample_size']
+        if len(words) <= sample_size:
+            return words
+        step = max(1, len(words) // sample_size)
+        sample = words[::step][:sample_size]
+        results = [self._process_word(word, parent_image, parent_coords)
+                   for word in sample]
+        sampled = set(id(word) for word in sample)
+        remaining = [word for word in words if id(word) not in sampled]
+        if not all(style and conf >= self.parameter['sample_confidence']
+                   for style, conf in results):
+            return remaining
+        shapes = set((style.bold, style.italic, style.underlined, style.monospace, style.serif)
+                     for style, _ in results)
+        if len(shapes) > 1:
+            return remaining
+        styles = Counter((style.fontFamily, style.fontSize) for style, _ in results)
+        (family, size), _ = styles.most_common(1)[0]
+        style = next(style for style, _ in results
+                     if (style.fontFamily, style.fontSize) == (family, size))
+        self.logger.debug("Propagating style of %d sampled words to %d words",
+                          len(sample), len(remaining))
+        for word in remaining:
+            word.set_TextStyle(copy(style))
+        return []
+
+    def _process_aligned(self, words, parent_image, parent_coords):
+        """Recognize the current (parent) image, and assign font attributes to ``words``.
+
+        Iterate all detected words, and annotate each existing word with the
+        font attributes of the detected word it overlaps most with (by bounding
+        box, relative to ``parent_image`` and ``parent_coords``).
+
+        Return the list of words which no detected word could be assigned to.
+        """
+        with TIMER('Recognize'):
+            self.tessapi.Recognize()
+        boxes = []
+        styles = []
+        result_it = self.tessapi.GetIterator()
+        if result_it and not result_it.Empty(RIL.WORD):
+            for it in iterate_level(result_it, RIL.WORD, parent=RIL.BLOCK):
+                boxes.append(it.BoundingBox(RIL.WORD))
+                styles.append(self._get_style(it))
+        if not boxes:
+            return words
+        # intersection areas between all detected (rows) and existing words (columns)
+        overlaps = bbox_overlaps(boxes, [bbox_of_segment(word, parent_image, parent_coords)
+                                         for word in words])
+        unaligned = []
+        for word, word_overlaps in zip(words, overlaps.T):
+            best = word_overlaps.argmax()
+            if not word_overlaps[best] or not styles[best]:
+                unaligned.append(word)
+                continue
+            # (each word needs its own instance)
+            word.set_TextStyle(copy(styles[best]))
+        return unaligned
 
     def _process_words(self, words, line_image, line_coords):
         for word in words:
-            word_image, word_coords = self.workspace.image_from_segment(
-                word, line_image, line_coords)
-            if self.parameter['padding']:
-                self.tessapi.SetImage(pad_image(word_image, self.parameter['padding']))
-            else:
-                self.tessapi.SetImage(word_image)
-            self.tessapi.SetPageSegMode(PSM.SINGLE_WORD)
-            #self.tessapi.SetPageSegMode(PSM.RAW_LINE)
+            self._process_word(word, line_image, line_coords)
+
+    def _process_word(self, word, line_image, line_coords):
+        """Recognize ``word`` on its own, and annotate its font attributes.
+
+        Return the style and the recognition confidence (or None and 0).
+        """
+        word_image, word_coords = self.workspace.image_from_segment(
+            word, line_image, line_coords)
+        if self.parameter['padding']:
+            word_image = pad_image(word_image, self.parameter['padding'])
+        with TIMER('SetImage'):
+            self.tessapi.SetImage(word_image)
+        self.tessapi.SetPageSegMode(PSM.SINGLE_WORD)
+        #self.tessapi.SetPageSegMode(PSM.RAW_LINE)
+        with TIMER('Recognize'):
             self.tessapi.Recognize()
-            result_it = self.tessapi.GetIterator()
-            if not result_it or result_it.Empty(RIL.WORD):
-                self.logger.warning("No text in word '%s'", word.id)
-                continue
-            self.logger.debug("Decoding text in word '%s'", word.id)
-            # trigger recognition
-            word_text = result_it.GetUTF8Text(RIL.WORD)
-            self.logger.debug('Word "%s" detected "%s"', word.id, word_text)
-            textequiv = word.get_TextEquiv()
-            if textequiv:
-                self.logger.info('Word "%s" annotated "%s" / detected "%s"',
-                                 word.id, textequiv[0].Unicode, word_text)
-            word_attributes = result_it.WordFontAttributes()
-            if word_attributes:
-                #self.logger.debug("found font attributes: {}".format(word_attributes))
-                word_style = TextStyleType(
-                    fontSize=word_attributes['pointsize']
-                    if 'pointsize' in word_attributes else None,
-                    fontFamily=word_attributes['font_name']
-                    if 'font_name' in word_attributes else None,
-                    bold=word_attributes['bold']
-                    if 'bold' in word_attributes else None,
-                    italic=word_attributes['italic']
-                    if 'italic' in word_attributes else None,
-                    underlined=word_attributes['underlined']
-                    if 'underlined' in word_attributes else None,
-                    monospace=word_attributes['monospace']
-                    if 'monospace' in word_attributes else None,
-                    serif=word_attributes['serif']
-                    if 'serif' in word_attributes else None)
-                word.set_TextStyle(word_style) # (or somewhere in custom attribute?)
+        result_it = self.tessapi.GetIterator()
+        if not result_it or result_it.Empty(RIL.WORD):
+            self.logger.warning("No text in word '%s'", word.id)
+            return None, 0
+        self.logger.debug("Decoding text in word '%s'", word.id)
+        # trigger recognition
+        word_text = result_it.GetUTF8Text(RIL.WORD)
+        self.logger.debug('Word "%s" detected "%s"', word.id, word_text)
+        textequiv = word.get_TextEquiv()
+        if textequiv:
+            self.logger.info('Word "%s" annotated "%s" / detected "%s"',
+                             word.id, textequiv[0].Unicode, word_text)
+        word_style = self._get_style(result_it)
+        if word_style:
+            word.set_TextStyle(word_style) # (or somewhere in custom attribute?)
+        return word_style, result_it.Confidence(RIL.WORD)/100.0
 
+    def _get_style(self, result_it):
+        """Get the font attributes of the current word in ``result_it`` as TextStyle (or None)."""
+        word_attributes = result_it.WordFontAttributes()
+        if not word_attributes:
+            return None
+        #self.logger.debug("found font attributes: {}".format(word_attributes))
+        return TextStyleType(
+            fontSize=word_attributes['pointsize']
+            if 'pointsize' in word_attributes else None,
+            fontFamily=word_attributes['font_name']
+            if 'font_name' in word_attributes else None,
+            bold=word_attributes['bold']
+            if 'bold' in word_attributes else None,
+            italic=word_attributes['italic']
+            if 'italic' in word_attributes else None,
+            underlined=word_attributes['underlined']
+            if 'underlined' in word_attributes else None,
+            monospace=word_attributes['monospace']
+            if 'monospace' in word_attributes else None,
+            serif=word_attributes['serif']
+            if 'serif' in word_attributes else None)
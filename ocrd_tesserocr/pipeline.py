@@ -0,0 +1,347 @@
+from __future__ import absolute_import
+
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from os.path import join
+import json
+from pathlib import Path
+import signal
+import threading
+from types import SimpleNamespace
+
+from ocrd import Workspace
+from ocrd.task_sequence import ProcessorTask
+from ocrd.processor.helpers import get_processor
+from ocrd_models import OcrdExif
+from ocrd_models.ocrd_page import to_xml, AlternativeImageType, PageType
+from ocrd_modelfactory import page_from_file
+from ocrd_utils import (
+    config,
+    getLogger,
+    make_file_id,
+    pushd_popd,
+    MIMETYPE_PAGE,
+)
+
+import ocrd_tesserocr
+from .timing import TIMER
+
+# executables and their processor classes (imported on first use)
+PROCESSORS = {
+    'ocrd-tesserocr-recognize': 'TesserocrRecognize',
+    'ocrd-tesserocr-segment': 'TesserocrSegment',
+    'ocrd-tesserocr-segment-region': 'TesserocrSegmentRegion',
+    'ocrd-tesserocr-segment-table': 'TesserocrSegmentTable',
+    'ocrd-tesserocr-segment-line': 'TesserocrSegmentLine',
+    'ocrd-tesserocr-segment-word': 'TesserocrSegmentWord',
+    'ocrd-tesserocr-fontshape': 'TesserocrFontShape',
+    'ocrd-tesserocr-crop': 'TesserocrCrop',
+    'ocrd-tesserocr-deskew': 'TesserocrDeskew',
+    'ocrd-tesserocr-binarize': 'TesserocrBinarize',
+    'ocrd-tesserocr-preprocess': 'TesserocrPreprocess',
+}
+
+class PipelineWorkspace(Workspace):
+    """Workspace which serves images from memory within a pipeline.
+
+    Keeps decoded original images, and the derived images of each step
+    (under the path they would have been saved to) until :py:meth:`clear`.
+    """
+    def __init__(self, workspace):
+        super().__init__(workspace.resolver, workspace.directory,
+                         mets=workspace.mets,
+                         mets_basename=Path(workspace.mets_target).name,
+                         baseurl=workspace.baseurl)
+        self.images = {}
+        self.exifs = {}
+        # derived images which have not been saved yet
+        self.pending = {}
+
+    def clear(self):
+        self.images.clear()
+        self.exifs.clear()
+        self.pending.clear()
+
+    def add_image(self, image, file_id, file_grp, file_path, page_id):
+        self.images[file_path] = image
+        self.pending[file_path] = (image, file_id, file_grp, page_id)
+
+    def save_pending_images(self, pcgts, filenames=None, force=False):
+        """Save all images referenced by ``pcgts`` (or in ``filenames``) which only exist in memory."""
+        page = pcgts.get_Page()
+        filenames = list(filenames or [])
+        filenames.extend(alt.get_filename() for alt in page.get_AllAlternativeImages())
+        filenames.append(page.get_imageFilename())
+        for filename in filenames:
+            if filename not in self.pending:
+                continue
+            image, file_id, file_grp, page_id = self.pending.pop(filename)
+            self.save_image_file(image, file_id, file_grp, page_id=page_id, file_path=filename,
+                                 force=force)
+
+    def resolve_image_exif(self, image_url):
+        if image_url in self.images:
+            return OcrdExif(self.images[image_url])
+        if image_url not in self.exifs:
+            self.exifs[image_url] = super().resolve_image_exif(image_url)
+        return self.exifs[image_url]
+
+    def _resolve_image_as_pil(self, image_url, coords=None):
+        if coords is not None:
+            return super()._resolve_image_as_pil(image_url, coords)
+        if image_url not in self.images:
+            self.images[image_url] = super()._resolve_image_as_pil(image_url)
+        return self.images[image_url]
+
+class ProcessorCache:
+    """Keeps processors (with their models) set up across pipeline runs.
+
+    Instances are keyed by processor class and parameters, and the least recently
+    used get shut down beyond ``maxsize`` (default: ``OCRD_MAX_PROCESSOR_CACHE``).
+    """
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize or config.OCRD_MAX_PROCESSOR_CACHE
+        self.processors = OrderedDict()
+
+    def get(self, processor_class, parameter):
+        key = (processor_class, json.dumps(parameter, sort_keys=True))
+        if key in self.processors:
+            self.processors.move_to_end(key)
+            return self.processors[key]
+        processor = get_processor(processor_class, parameter=parameter)
+        self.processors[key] = processor
+        while len(self.processors) > self.maxsize:
+            _, processor_ = self.processors.popitem(last=False)
+            processor_.shutdown()
+        return processor
+
+    def clear(self):
+        for processor in self.processors.values():
+            processor.shutdown()
+        self.processors.clear()
+
+def parse_tasks(tasks):
+    """Parse task descriptions (as in ``ocrd process``) into processor classes,
+    parameters and fileGrps, chaining each input to the previous output."""
+    steps = []
+    for task in tasks:
+        task = ProcessorTask.parse(task)
+        if task.executable not in PROCESSORS:
+            raise ValueError("Unknown processor '%s' (must be one of: %s)" % (
+                task.executable, ', '.join(PROCESSORS)))
+        if len(task.output_file_grps) != 1:
+            raise ValueError("Task '%s' must have exactly one output fileGrp" % task)
+        if steps:
+            input_file_grp = steps[-1][3]
+            if task.input_file_grps and task.input_file_grps != [input_file_grp]:
+                raise ValueError("Task '%s' must consume the output of the previous task (%s)" % (
+                    task, input_file_grp))
+        elif len(task.input_file_grps) != 1:
+            raise ValueError("Task '%s' must have exactly one input fileGrp" % task)
+        else:
+            input_file_grp = task.input_file_grps[0]
+        processor_class = getattr(ocrd_tesserocr, PROCESSORS[task.executable])
+        steps.append((processor_class, task.parameters,
+                      input_file_grp, task.output_file_grps[0]))
+    return steps
+
+def run_pipeline(workspace, steps, page_id=None, save_all=False, cache=None, existing_output=None):
+    """Run a chain of processors on ``workspace`` page by page in this process.
+
+    Each step is a tuple of processor class, parameter dict, input fileGrp
+    and output fileGrp (cf. :py:func:`parse_tasks`). All processors get set up
+    only once. The PAGE result and derived images of each step are passed to
+    the next step in memory, without serialising and parsing or saving and
+    decoding. Only the last output fileGrp is written (along with all images
+    still referenced by it), unless ``save_all``.
+
+    If ``cache`` is a :py:class:`ProcessorCache`, then take processors from it
+    instead of setting up new ones.
+
+    Existing output files are handled according to ``existing_output``
+    (default: ``OCRD_EXISTING_OUTPUT``). Failing pages are handled as in
+    core processing (``OCRD_MISSING_OUTPUT``, ``OCRD_MAX_MISSING_OUTPUTS``
+    and ``OCRD_PROCESSING_PAGE_TIMEOUT``), and the results of all other
+    pages are kept in any case.
+    """
+    existing_output = existing_output or config.OCRD_EXISTING_OUTPUT
+    LOG = getLogger('processor.TesserocrPipeline')
+    workspace = PipelineWorkspace(workspace)
+    processors = []
+    for processor_class, parameter, input_file_grp, output_file_grp in steps:
+        if cache is None:
+            processor = get_processor(processor_class, parameter=parameter)
+        else:
+            processor = cache.get(processor_class, parameter)
+        processor.workspace = workspace
+        processor.page_id = page_id
+        processor.input_file_grp = input_file_grp
+        processor.output_file_grp = output_file_grp
+        processors.append(processor)
+    # (later input fileGrps only exist in memory)
+    processors[0].verify()
+    # (but images of any step may get saved)
+    for processor in processors[1:]:
+        assert (processor.output_file_grp not in workspace.mets.file_groups
+                or existing_output in ['OVERWRITE', 'SKIP']
+                or not any(workspace.mets.find_files(
+                    pageId=page_id, fileGrp=processor.output_file_grp))), \
+            f"output fileGrp {processor.output_file_grp} already exists in workspace {workspace}"
+    max_seconds = max(0, config.OCRD_PROCESSING_PAGE_TIMEOUT)
+    for processor in processors:
+        if 0 < processor.max_page_seconds < max_seconds:
+            max_seconds = processor.max_page_seconds
+    if config.OCRD_MISSING_OUTPUT == 'SKIP':
+        reason = "skipped"
+    elif config.OCRD_MISSING_OUTPUT == 'COPY':
+        reason = "fallback-copied"
+    nr_succeeded = 0
+    nr_failed = 0
+    nr_errors = defaultdict(int)
+    TIMER.start_run()
+    with pushd_popd(workspace.directory), \
+         TIMER.methods(workspace, ['image_from_page', 'image_from_segment',
+                                   'save_image_file', 'add_file']):
+        try:
+            input_file_tuples = processors[0].zip_input_files()
+            for input_files in input_file_tuples:
+                input_file = input_files[0]
+                if input_file is None:
+                    continue
+                page_id = input_file.pageId
+                output_file_ids = []
+                for processor in processors:
+                    output_file_ids.append(make_file_id(input_file, processor.output_file_grp))
+                    # chain the (virtual) input file for ID generation
+                    input_file = SimpleNamespace(ID=output_file_ids[-1],
+                                                 fileGrp=processor.output_file_grp,
+                                                 pageId=page_id)
+                saves = [save_all or index == len(processors) - 1
+                         for index in range(len(processors))]
+                if existing_output != 'OVERWRITE':
+                    existing = [output_file_id for output_file_id, save in zip(output_file_ids, saves)
+                                if save and next(workspace.mets.find_files(ID=output_file_id), None)]
+                    if existing and existing_output == 'SKIP':
+                        LOG.warning("skipping page %s with existing output %s", page_id, existing[0])
+                        continue
+                    if existing:
+                        raise FileExistsError(f"A file with ID=={existing[0]} already exists"
+                                              " and OCRD_EXISTING_OUTPUT != OVERWRITE")
+                LOG.info("processing page %s", page_id)
+                # number of steps with results
+                done = 0
+                try:
+                    with TIMER('page'), _page_timeout(max_seconds):
+                        pcgts = page_from_file(input_files[0])
+                        for processor, output_file_id, save in zip(processors, output_file_ids, saves):
+                            pcgts = _process_step(processor, workspace, pcgts, page_id, output_file_id, save,
+                                                  force=existing_output == 'OVERWRITE')
+                            done += 1
+                    nr_succeeded += 1
+                except KeyboardInterrupt:
+                    raise
+                # (as in Processor.process_workspace_handle_page_task)
+                except Exception as err:
+                    if config.OCRD_MISSING_OUTPUT == 'ABORT':
+                        LOG.error("Failure on page %s: %s", page_id, str(err) or err.__class__.__name__)
+                        raise
+                    LOG.exception("Failure on page %s: %s", page_id, str(err) or err.__class__.__name__)
+                    if config.OCRD_MISSING_OUTPUT == 'COPY':
+                        # (only the steps without saved results)
+                        for index in range(done, len(processors)):
+                            if saves[index]:
+                                _copy_page_file(processors[index], workspace, input_files[0], page_id,
+                                                output_file_ids[index], force=existing_output == 'OVERWRITE')
+                    elif config.OCRD_MISSING_OUTPUT != 'SKIP':
+                        desc = config.describe('OCRD_MISSING_OUTPUT', wrap_text=False, indent_text=False)
+                        raise ValueError(f"unknown configuration value {config.OCRD_MISSING_OUTPUT} - {desc}")
+                    nr_errors[err.__class__.__name__] += 1
+                    nr_failed += 1
+                    if (config.OCRD_MAX_MISSING_OUTPUTS > 0 and
+                        nr_failed / len(input_file_tuples) > config.OCRD_MAX_MISSING_OUTPUTS):
+                        # already irredeemably many failures, stop short
+                        raise Exception(f"too many failures with {reason} output ({nr_failed} of "
+                                        f"{nr_failed + nr_succeeded}, {str(dict(nr_errors))})")
+                finally:
+                    TIMER.end_page(page_id, LOG)
+                    workspace.clear()
+        finally:
+            # (keep results of the pages processed so far)
+            workspace.save_mets()
+    if nr_failed:
+        nr_all = nr_succeeded + nr_failed
+        if config.OCRD_MAX_MISSING_OUTPUTS >= 0 and nr_failed / nr_all > config.OCRD_MAX_MISSING_OUTPUTS:
+            raise Exception(f"too many failures with {reason} output ({nr_failed} of {nr_all}, "
+                            f"{str(dict(nr_errors))})")
+        LOG.warning("%s %d of %d pages due to %s", reason, nr_failed, nr_all, str(dict(nr_errors)))
+    TIMER.end_run(LOG)
+
+@contextmanager
+def _page_timeout(seconds):
+    """Raise TimeoutError if processing takes longer than ``seconds`` (if positive).
+
+    (Only possible in the main thread, and only gets checked between native calls.)
+    """
+    if not seconds or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    def timeout(signum, frame):
+        raise TimeoutError(f"page processing exceeded {seconds} seconds")
+    handler = signal.signal(signal.SIGALRM, timeout)
+    signal.alarm(seconds)
+    try:
+        yield
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, handler)
+
+def _copy_page_file(processor, workspace, input_file, page_id, output_file_id, force=False):
+    # (as in Processor._copy_page_file)
+    try:
+        pcgts = page_from_file(input_file)
+    except ValueError as err:
+        # not PAGE and not an image to generate PAGE for
+        getLogger('processor.TesserocrPipeline').error("non-PAGE input for page %s: %s", page_id, err)
+        return
+    pcgts.set_pcGtsId(output_file_id)
+    processor.add_metadata(pcgts)
+    workspace.add_file(
+        file_id=output_file_id,
+        file_grp=processor.output_file_grp,
+        page_id=page_id,
+        local_filename=join(processor.output_file_grp, output_file_id + '.xml'),
+        mimetype=MIMETYPE_PAGE,
+        content=to_xml(pcgts),
+        force=force,
+    )
+
+def _process_step(processor, workspace, pcgts, page_id, output_file_id, save, force=False):
+    output_file_grp = processor.output_file_grp
+    result = processor.process_page_pcgts(pcgts, page_id=page_id)
+    image_file_paths = []
+    for image_result in result.images:
+        image_file_id = f'{output_file_id}_{image_result.file_id_suffix}'
+        image_file_path = join(output_file_grp, f'{image_file_id}.png')
+        if isinstance(image_result.alternative_image, PageType):
+            image_result.alternative_image.set_imageFilename(image_file_path)
+            image_result.alternative_image.set_imageWidth(image_result.pil.width)
+            image_result.alternative_image.set_imageHeight(image_result.pil.height)
+        elif isinstance(image_result.alternative_image, AlternativeImageType):
+            image_result.alternative_image.set_filename(image_file_path)
+        workspace.add_image(image_result.pil, image_file_id, output_file_grp,
+                            image_file_path, page_id)
+        image_file_paths.append(image_file_path)
+    result.pcgts.set_pcGtsId(output_file_id)
+    processor.add_metadata(result.pcgts)
+    if save:
+        workspace.save_pending_images(result.pcgts, image_file_paths, force=force)
+        workspace.add_file(
+            file_id=output_file_id,
+            file_grp=output_file_grp,
+            page_id=page_id,
+            local_filename=join(output_file_grp, output_file_id + '.xml'),
+            mimetype=MIMETYPE_PAGE,
+            content=to_xml(result.pcgts),
+            force=force,
+        )
+    return result.pcgts
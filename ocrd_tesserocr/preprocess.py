@@ -0,0 +1,221 @@
+from __future__ import absolute_import
+
+from typing import Optional
+import math
+import numpy as np
+
+from PIL import Image
+from tesserocr import (
+    PyTessBaseAPI,
+    RIL, PSM, OEM, PT
+)
+
+from ocrd_utils import (
+    crop_image,
+    rotate_image,
+    rotate_coordinates,
+    transform_coordinates,
+    transpose_image,
+    image_from_polygon,
+    coordinates_of_segment,
+    bbox_from_polygon,
+    bbox_from_points,
+    polygon_from_bbox,
+)
+from ocrd_models.ocrd_page import (
+    AlternativeImageType,
+    OcrdPage
+)
+from ocrd.processor import OcrdPageResult, OcrdPageResultImage
+
+from .recognize import TesserocrRecognize
+from .deskew import detect_orientation, detect_skew
+from .crop import filter_text_block, combine_bounds, get_border
+from .common import iterate_level
+from .timing import TIMER
+
+# block types counted as text (cf. PTIsTextType)
+TEXT_BLOCK_TYPES = (PT.FLOWING_TEXT, PT.HEADING_TEXT, PT.PULLOUT_TEXT,
+                    PT.TABLE, PT.VERTICAL_TEXT, PT.CAPTION_TEXT,
+                    PT.INLINE_EQUATION)
+
+class TesserocrPreprocess(TesserocrRecognize):
+    @property
+    def executable(self):
+        return 'ocrd-tesserocr-preprocess'
+
+    def _init(self):
+        # use osd model with vanilla tesserocr API
+        self.tessapi = PyTessBaseAPI(lang="osd", # osd required for legacy init!
+                                     oem=OEM.TESSERACT_LSTM_COMBINED, # legacy required for OSD!
+                                     psm=PSM.SPARSE_TEXT_OSD)
+        # disable table detection here (cf. ocrd-tesserocr-crop)
+        self.tessapi.SetVariable("textord_tabfind_find_tables", "0")
+
+    def process_page_pcgts(self, *input_pcgts: Optional[OcrdPage], page_id: Optional[str] = None) -> OcrdPageResult:
+        """Performs page cropping, deskewing and binarization with Tesseract on the workspace.
+
+        Open and deserialize PAGE input file and its respective image.
+        Set up Tesseract to detect orientation and script, and to detect text
+        blocks (as sparse text with orientation) on each page, but only once.
+
+        From that single analysis, find the largest coordinate extent spanning
+        all text blocks, and add it as Border to the page (like ``ocrd-tesserocr-crop``).
+        Also annotate the orientation, skew, readingDirection, textLineOrder and
+        primaryScript of the page (like ``ocrd-tesserocr-deskew`` on the page level).
+
+        Then crop and rotate the page image accordingly, and threshold the result
+        (like ``ocrd-tesserocr-binarize`` on the page level), without writing and
+        reading intermediate images.
+
+        Reference the deskewed and the binarized image as AlternativeImage in the
+        Page element, with file ID suffixes ``.IMG-DESKEW`` and ``.IMG-BIN``,
+        respectively.
+
+        Produce new output files by serialising the resulting hierarchy.
+        """
+        pcgts = input_pcgts[0]
+        result = OcrdPageResult(pcgts)
+        page = pcgts.get_Page()
+
+        # warn of existing Border:
+        border = page.get_Border()
+        if border:
+            left, top, right, bottom = bbox_from_points(border.get_Coords().points)
+            self.logger.warning('Overwriting existing Border: %i:%i,%i:%i',
+                                left, top, right, bottom)
+
+        page_image, page_xywh, page_image_info = self.workspace.image_from_page(
+            page, page_id,
+            # image must not have been cropped or rotated already,
+            # (we will overwrite Border and @orientation anyway,)
+            # abort if no such image can be produced:
+            feature_filter='cropped,deskewed,rotated-90,rotated-180,rotated-270')
+        if self.parameter['dpi'] > 0:
+            dpi = self.parameter['dpi']
+            self.logger.info("Page '%s' images will use %d DPI from parameter override", page_id, dpi)
+        elif page_image_info.resolution != 1:
+            dpi = page_image_info.resolution
+            if page_image_info.resolutionUnit == 'cm':
+                dpi = round(dpi * 2.54)
+            self.logger.info("Page '%s' images will use %d DPI from image meta-data", page_id, dpi)
+        else:
+            dpi = 0
+            self.logger.info("Page '%s' images will use DPI estimated from segmentation", page_id)
+        self.tessapi.SetVariable('user_defined_dpi', str(dpi))
+        if dpi:
+            zoom = 300 / dpi
+        else:
+            zoom = 1
+
+        where = "page '%s'" % page_id
+        with TIMER('SetImage'):
+            self.tessapi.SetImage(page_image)
+        angle = detect_orientation(self.tessapi, page, self.parameter['min_orientation_confidence'],
+                                   where, self.logger)
+        self.tessapi.SetPageSegMode(PSM.SPARSE_TEXT_OSD)
+        with TIMER('AnalyseLayout'):
+            layout = self.tessapi.AnalyseLayout()
+        if not layout:
+            self.logger.error('no result iterator in %s', where)
+            return result
+        deskew_angle = detect_skew(layout, page, angle, where, self.logger)
+        bounds, baseline_angle = self._estimate_bounds(page, layout, page_image, zoom)
+        if not deskew_angle and baseline_angle:
+            # Tesseract does not estimate page skew reliably on uncropped pages
+            # (and we do not want to analyse again after cropping), so fall back
+            # to the median slope of the text line baselines:
+            self.logger.info('using skew %.3f° from text line baselines in %s', baseline_angle, where)
+            deskew_angle = baseline_angle
+        angle += deskew_angle
+        border = get_border(page, page_image, page_xywh, bounds,
+                            self.parameter['padding'], self.logger)
+        if not border:
+            return result
+        page.set_Border(border)
+        # page angle: PAGE @orientation is defined clockwise,
+        # whereas PIL/ndimage rotation is in mathematical direction:
+        orientation = -angle
+        orientation = 180 - (180 - orientation) % 360 # map to [-179.999,180]
+        page.set_orientation(orientation)
+
+        # crop and rotate the image in memory (like image_from_page would)
+        polygon = coordinates_of_segment(border, page_image, page_xywh)
+        image = image_from_polygon(page_image, polygon, fill='background', transparency=True)
+        image = crop_image(image, box=bbox_from_polygon(polygon))
+        features = page_xywh['features'] + ',cropped'
+        # partition into multiples of 90 and remaining skew:
+        quarters = (angle + 45) % 360
+        quarters = quarters - (quarters % 90)
+        skew = (angle % 360) - quarters
+        skew = 180 - (180 - skew) % 360 # map to [-45,45]
+        if quarters:
+            image = transpose_image(image, {
+                90: Image.Transpose.ROTATE_90,
+                180: Image.Transpose.ROTATE_180,
+                270: Image.Transpose.ROTATE_270
+            }[quarters])
+            features += ',rotated-%d' % quarters
+        if skew:
+            # rotate around center, then re-crop to the rotated border
+            # (with the same rounding as in image_from_page)
+            polygon = np.array(polygon_from_bbox(0, 0, image.width, image.height))
+            transform = rotate_coordinates(np.eye(3), skew, 0.5 * np.array(image.size))
+            polygon = np.round(transform_coordinates(polygon, transform)).astype(np.int32)
+            image = rotate_image(image, skew, fill='background', transparency=True)
+            image = image_from_polygon(image, polygon, fill='background', transparency=True)
+            image = crop_image(image, box=bbox_from_polygon(polygon))
+        if skew or not quarters:
+            # zero rotation does not change coordinates,
+            # but assures consuming processors that the
+            # workflow had deskewing
+            features += ',deskewed'
+        alternative = AlternativeImageType(comments=features)
+        page.add_AlternativeImage(alternative)
+        result.images.append(OcrdPageResultImage(image, '.IMG-DESKEW', alternative))
+
+        # binarize the derived image
+        with TIMER('SetImage'):
+            self.tessapi.SetImage(image)
+        self.tessapi.SetPageSegMode(PSM.AUTO_ONLY)
+        with TIMER('GetThresholdedImage'):
+            image_bin = self.tessapi.GetThresholdedImage()
+        if not image_bin:
+            self.logger.error('Cannot binarize %s', where)
+            return result
+        alternative = AlternativeImageType(comments=features + ',binarized')
+        page.add_AlternativeImage(alternative)
+        result.images.append(OcrdPageResultImage(image_bin, '.IMG-BIN', alternative))
+        return result
+
+    def _estimate_bounds(self, page, layout, page_image, zoom=1.0):
+        """Get outer bounds of all (existing or detected) regions, and median skew of their lines."""
+        angles = []
+        bboxes = []
+        # iterate over all text blocks and collect
+        # the bboxes of those large enough
+        index = 0
+        for it in iterate_level(layout, RIL.BLOCK):
+            if it.BlockType() not in TEXT_BLOCK_TYPES:
+                continue
+            ID = "region%04d" % index
+            index += 1
+            left, top, right, bottom = it.BoundingBox(RIL.BLOCK)
+            self.logger.debug("Detected text region '%s': %i:%i,%i:%i",
+                              ID, left, right, top, bottom)
+            if not filter_text_block(it.GetBinaryImage(RIL.BLOCK), ID, zoom, self.logger):
+                continue
+            bboxes.append((left, top, right, bottom))
+            for line in iterate_level(it, RIL.TEXTLINE, parent=RIL.BLOCK):
+                baseline = line.Baseline(RIL.TEXTLINE)
+                if not baseline:
+                    continue
+                (x1, y1), (x2, y2) = baseline
+                if x1 == x2 and y1 == y2:
+                    continue
+                # counter-clockwise angle (for deskewing) relative to the nearest multiple of 90°
+                # (y axis points down):
+                angle = math.degrees(math.atan2(y2 - y1, x2 - x1))
+                angles.append((angle + 45) % 90 - 45)
+        bounds = combine_bounds(page, page_image, bboxes, self.logger)
+        return bounds, float(np.median(angles)) if angles else 0.
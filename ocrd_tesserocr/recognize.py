@@ -2,28 +2,37 @@ from __future__ import absolute_import
 
 from typing import Optional
 from os.path import join
+import os
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import local
 import math
+import re
 
 import numpy as np
+from lxml import etree
+from PIL import Image
 from tesserocr import (
     RIL, PSM, PT, OEM,
     Orientation,
     WritingDirection,
     TextlineOrder,
     tesseract_version,
-    PyTessBaseAPI,
-    get_languages)
+    PyTessBaseAPI)
 
 from ocrd_utils import (
     getLogger,
     shift_coordinates,
     coordinates_for_segment,
+    coordinates_of_segment,
     polygon_from_x0y0x1y1,
     points_from_polygon,
     xywh_from_polygon,
     VERSION as OCRD_VERSION,
     membername
 )
+from ocrd_models.constants import NAMESPACES
 from ocrd_models.ocrd_page import (
     ReadingOrderType,
     RegionRefType,
@@ -51,25 +60,54 @@ from ocrd_models.ocrd_page_generateds import TextTypeSimpleType
 from ocrd import Processor, OcrdPageResult, OcrdPageResultImage
 
 from .common import *
+from .threads import get_page_workers, get_parameter_threads, get_thread_budget, get_openmp_limit
+from .timing import TIMER, timed
 
 
 CHOICE_THRESHOLD_NUM = 10 # maximum number of choices to query and annotate
 CHOICE_THRESHOLD_CONF = 1 # maximum score drop from best choice to query and annotate
 # (ChoiceIterator usually rounds to 0.0 for non-best, so this better be maximum)
+AUTO_MODEL_SAMPLE_LINES = 10 # maximum number of lines to try models on for auto_model_level=page|region
+# elements which xpath_parameters and xpath_model can apply to (i.e. segments passed to _reinit)
+SEGMENT_TEST = ("self::pc:Page or self::pc:TextLine or self::pc:Word or self::pc:Glyph or "
+                "(namespace-uri() = namespace-uri(/*) and "
+                "substring(local-name(), string-length(local-name()) - 5) = 'Region')")
+# expressions which depend on the context position or size
+CONTEXT_POSITION = re.compile(r'\b(position|last)\s*\(')
+# variables which Tesseract only reads during initialization (setting them later has no effect)
+INIT_ONLY_VARIABLES = frozenset([
+    'tessedit_ocr_engine_mode', 'tessedit_init_config_only', 'tessedit_load_sublangs',
+    'language_model_ngram_on', 'language_model_use_sigmoidal_certainty', 'ambigs_debug_level',
+    'load_system_dawg', 'load_freq_dawg', 'load_unambig_dawg',
+    'load_punc_dawg', 'load_number_dawg', 'load_bigram_dawg',
+    'user_words_file', 'user_words_suffix', 'user_patterns_file', 'user_patterns_suffix'])
 
 class TessBaseAPI(PyTessBaseAPI):
     """wraps the tesserocr base class so have some state (for parameter/model switching)"""
-    parameters = {}
     psm = PSM.AUTO
     image = None
+    rectangle = None
     path = ''
     lang = ''
     oem = OEM.DEFAULT
+    layout_only = False
+
+    def __init__(self, *args, **kwargs):
+        # (arguments are consumed by the base class)
+        # must not share the parameters dict between instances
+        self.parameters = {}
+        # temporary changes (within context) yet to be undone:
+        # - runtime variables with their previous native value
+        self.dirty = {}
+        # - init-only variables with their temporary value
+        self.dirty_init = {}
+        self.temporary = False
 
     def __repr__(self):
         return str({'parameters': self.parameters,
                     'psm': self.psm,
                     'image': self.image,
+                    'rectangle': self.rectangle,
                     'path': self.path,
                     'lang': self.lang,
                     'oem': self.oem})
@@ -82,9 +120,71 @@ class TessBaseAPI(PyTessBaseAPI):
         self.parameters = variables or self.parameters
         super().InitFull(path=self.path, lang=self.lang, oem=self.oem, variables=self.parameters)
 
+    def InitForAnalysePage(self):
+        """Initialize for layout analysis only (without loading any model)
+
+        Variables must be set before (or after) this.
+        """
+        self.layout_only = True
+        self.lang = ''
+        super().InitForAnalysePage()
+
     def SetVariable(self, name, val):
+        if not self.temporary:
+            # persistent change: nothing to undo later
+            self.dirty.pop(name, None)
+            self.parameters[name] = val
+            return super().SetVariable(name, val)
+        before = self.GetVariableAsString(name)
+        if before is None:
+            # unknown variable
+            return False
+        if name in INIT_ONLY_VARIABLES:
+            # can only be applied by reinitializing (cf. __exit__)
+            self.parameters[name] = val
+            self.dirty_init[name] = val
+            return True
+        if not super().SetVariable(name, val):
+            return False
         self.parameters[name] = val
-        return super().SetVariable(name, val)
+        self.dirty.setdefault(name, before)
+        return True
+
+    def RestoreVariables(self):
+        """Undo all temporary changes to variables in the native API.
+
+        Runtime variables are simply set back to their previous value.
+        Only if init-only variables were changed, reinitialize fully.
+        """
+        if self.dirty_init:
+            self.Reset()
+        # (reinitializing does not reset runtime variables)
+        for name, val in self.dirty.items():
+            super().SetVariable(name, val)
+        self.dirty.clear()
+        self.dirty_init.clear()
+
+    def SetImage(self, image):
+        self.image = image
+        self.rectangle = None
+        with TIMER('SetImage'):
+            super().SetImage(image)
+
+    def AnalyseLayout(self, *args, **kwargs):
+        with TIMER('AnalyseLayout'):
+            return super().AnalyseLayout(*args, **kwargs)
+
+    def Recognize(self, *args, **kwargs):
+        with TIMER('Recognize'):
+            return super().Recognize(*args, **kwargs)
+
+    def GetThresholdedImage(self):
+        with TIMER('GetThresholdedImage'):
+            return super().GetThresholdedImage()
+
+    def SetRectangle(self, left, top, width, height):
+        self.rectangle = (left, top, width, height)
+        super().SetRectangle(left, top, width, height)
 
     def SetPageSegMode(self, psm):
         self.psm = psm
@@ -92,18 +192,38 @@ class TessBaseAPI(PyTessBaseAPI):
 
     def Reset(self, path=None, lang=None, oem=None, psm=None, parameters=None):
         self.Clear()
-        self.InitFull(path=path, lang=lang, oem=oem, variables=parameters)
+        self.image = None
+        if self.layout_only:
+            # (the native instance and its variables are kept)
+            self.InitForAnalysePage()
+        else:
+            self.InitFull(path=path, lang=lang, oem=oem, variables=parameters)
         self.SetPageSegMode(psm or self.psm)
 
     def __enter__(self):
+        """Start temporary changes to variables (to be undone by ``RestoreVariables``)."""
         self.original_path = self.path
         self.original_lang = self.lang
         self.original_oem = self.oem
         self.original_parameters = self.parameters.copy()
         self.original_psm = self.psm
+        self.temporary = True
         return self
 
     def __exit__(self, exc_type, exc_val, exc_trace):
+        self.temporary = False
+        if self.dirty_init and self.layout_only:
+            # no model to apply them to (and reinitializing
+            # with lang would turn this into a recognition API)
+            self.dirty_init.clear()
+        if self.dirty_init:
+            # init-only variables can only be applied by reinitializing
+            # (but keep them out of the persistent state)
+            self.Clear()
+            super().InitFull(path=self.path, lang=self.lang, oem=self.oem,
+                             variables=dict(self.parameters, **self.dirty_init))
+            super().SetPageSegMode(self.psm)
+            self.image = None
         self.path = self.original_path
         self.lang = self.original_lang
         self.oem = self.original_oem
@@ -111,6 +231,94 @@ class TessBaseAPI(PyTessBaseAPI):
         self.psm = self.original_psm
         return None
 
+class TessBaseAPIPool:
+    """keeps initialized APIs for other models around (for fast model switching)
+
+    Besides the ``default`` API, cache up to ``size`` APIs keyed by model
+    (i.e. ``lang``), which share the path, OCR engine mode and variables
+    of the default API. Unload the least recently used API when full.
+
+    Also, create clones of the default API (for concurrent recognition).
+
+    All of these can also be loaded in advance (via ``preload``), e.g. so
+    forked page-parallel workers share the model memory (copy-on-write).
+    """
+    def __init__(self, default, size=1):
+        self.default = default
+        self.size = size
+        self.apis = OrderedDict()
+        self.clones = []
+        # preloaded clones not handed out yet
+        self.spares = []
+
+    def get(self, lang=None):
+        """Get an API with ``lang`` loaded (or the default API if empty)"""
+        if not lang or lang == self.default.lang:
+            return self.default
+        if lang in self.apis:
+            self.apis.move_to_end(lang)
+            api = self.apis[lang]
+        else:
+            while len(self.apis) >= self.size:
+                _, api = self.apis.popitem(last=False)
+                api.End()
+            api = TessBaseAPI(init=False)
+            api.InitFull(path=self.default.path, lang=lang, oem=self.default.oem,
+                         variables=self.default.parameters.copy())
+            self.apis[lang] = api
+        return self.sync(api)
+
+    def clone(self):
+        """Create another API with the same model and variables as the default"""
+        if self.spares:
+            api = self.sync(self.spares.pop())
+        else:
+            api = self._init_clone()
+        self.clones.append(api)
+        return api
+
+    def _init_clone(self):
+        api = TessBaseAPI(init=False)
+        if self.default.layout_only:
+            for name, val in self.default.parameters.items():
+                api.SetVariable(name, val)
+            api.InitForAnalysePage()
+        else:
+            api.InitFull(path=self.default.path, lang=self.default.lang, oem=self.default.oem,
+                         variables=self.default.parameters.copy())
+        return api
+
+    def preload(self, langs, clones=0):
+        """Load APIs for all ``langs`` (up to ``size``), and ``clones`` clones of the default"""
+        for lang in langs[:self.size]:
+            self.get(lang)
+        for _ in range(clones):
+            self.spares.append(self._init_clone())
+
+    def sync(self, api):
+        """Update ``api`` with the runtime variables of the default"""
+        # these may have changed since initialization (e.g. DPI)
+        for name, val in self.default.parameters.items():
+            if api.parameters.get(name) != val:
+                api.SetVariable(name, val)
+        return api
+
+    def restore(self):
+        """Undo temporary changes to variables in all APIs"""
+        self.default.RestoreVariables()
+        for api in self.apis.values():
+            api.RestoreVariables()
+
+    def clear(self):
+        """Unload all APIs except the default"""
+        while self.apis:
+            _, api = self.apis.popitem()
+            api.End()
+        while self.clones:
+            self.clones.pop().End()
+        while self.spares:
+            self.spares.pop().End()
+
 class TesserocrRecognize(Processor):
     @property
     def executable(self):
@@ -122,24 +330,59 @@ class TesserocrRecognize(Processor):
 
     @property
     def moduledir(self):
-        return get_languages()[0]
+        return get_models()[0]
 
     def setup(self):
-        self.logger.debug("TESSDATA: %s, installed Tesseract models: %s", *get_languages())
+        self.logger.debug("TESSDATA: %s, installed Tesseract models: %s",
+                          get_models()[0], sorted(get_models()[1]))
         self._init()
+        self._report_threads()
+
+    def _report_threads(self):
+        """Log how the available cores get split between page workers and threads"""
+        workers = get_page_workers()
+        if self.max_workers > 0:
+            workers = min(workers, self.max_workers)
+        threads = getattr(self, 'max_threads', 1)
+        cores, budget = get_thread_budget(workers, threads)
+        limit = get_openmp_limit()
+        self.logger.info("Thread budget: %d cores, %d page workers, %d threads per worker, %s",
+                         cores, workers, threads, "Tesseract without OpenMP" if limit is None else
+                         "up to %d OpenMP threads per Tesseract call" % limit)
+        if workers * threads > cores:
+            self.logger.warning("Oversubscribing %d cores with %d page workers and %d threads each",
+                                cores, workers, threads)
+        elif limit is not None and limit > budget:
+            self.logger.warning("OMP_THREAD_LIMIT=%d oversubscribes %d cores (should be %d)",
+                                limit, cores, budget)
+        elif limit is not None and limit < budget:
+            self.logger.info("OMP_THREAD_LIMIT=%d leaves cores idle (could be %d)",
+                             limit, budget)
 
     def _init(self):
         model = "eng"
+        # without recognition, only layout analysis is needed (no model data at all)
+        segment_only = (self.parameter['textequiv_level'] == 'none' or
+                        not self.parameter.get('model', ''))
         if 'model' in self.parameter:
-            model = self.parameter['model']
-            for sub_model in model.split('+'):
+            sub_models = []
+            for sub_model in self.parameter['model'].split('+'):
                 if sub_model.endswith('.traineddata'):
                     self.logger.warning("Model '%s' has a  .traineddata extension, removing. Please use model names without .traineddata extension" % sub_model)
                     sub_model = sub_model.replace('.traineddata', '')
-                if sub_model not in get_languages()[1]:
-                    raise Exception("configured model " + sub_model + " is not installed")
+                sub_models.append(sub_model)
+            model = '+'.join(sub_models)
+            # (from the cached inventory, without trying to load)
+            check_model(model, 'DEFAULT' if segment_only else self.parameter['oem'])
+        if not segment_only:
+            for xpath_model in self.parameter['xpath_model'].values():
+                check_model(xpath_model, self.parameter['oem'])
+        if segment_only:
+            self.logger.info("Using no model for segmentation at the %s level",
+                             self.parameter['segmentation_level'])
+        else:
             self.logger.info("Using model '%s' in %s for recognition at the %s level",
-                             model, get_languages()[0], self.parameter['textequiv_level'])
+                             model, get_models()[0], self.parameter['textequiv_level'])
         self.tessapi = TessBaseAPI(init=False)
         # Set init-time parameters
         # self.SetVariable("debug_file", "") # show debug output (default: /dev/null)
@@ -199,9 +442,171 @@ class TesserocrRecognize(Processor):
         # user_patterns_file
         for variable, value in self.parameter['tesseract_parameters'].items():
             self.tessapi.SetVariable(variable, value)
-        # Initialize Tesseract (loading model)
-        self.tessapi.InitFull(lang=model, oem=getattr(OEM, self.parameter['oem']))
+        if segment_only:
+            # Initialize Tesseract (only for AnalyseLayout)
+            self.tessapi.InitForAnalysePage()
+        else:
+            # Initialize Tesseract (loading model)
+            self.tessapi.InitFull(lang=model, oem=getattr(OEM, self.parameter['oem']))
+        # models for xpath_model and auto_model will be loaded on demand
+        cache_size = self.parameter['model_cache']
+        if self.parameter['auto_model']:
+            # all candidates must be loaded at the same time
+            cache_size = max(cache_size, len(model.split('+')))
+        self.tessapi_pool = TessBaseAPIPool(self.tessapi, cache_size)
+        self.auto_model_candidates = None
+        self.auto_model_choice = None
+        self.segment_threads = self.parameter['segment_threads']
+        if self.segment_threads > 1 and (self.parameter['xpath_parameters'] or
+                                         self.parameter['xpath_model'] or
+                                         self.parameter['auto_model']):
+            self.logger.warning("Cannot use segment_threads with xpath_parameters, "
+                                "xpath_model or auto_model, recognizing sequentially")
+            self.segment_threads = 1
+        self.line_batch_size = self.parameter['line_batch_size']
+        if self.line_batch_size > 1 and (self.parameter['xpath_parameters'] or
+                                         self.parameter['xpath_model'] or
+                                         self.parameter['auto_model']):
+            self.logger.warning("Cannot use line_batch_size with xpath_parameters, "
+                                "xpath_model or auto_model, recognizing lines one by one")
+            self.line_batch_size = 1
+        self.max_threads = get_parameter_threads(self.parameter)
+        if self.parameter['preload_models'] and not segment_only:
+            self._preload(model)
+        self.threadpool = None
+        self.thread_state = local()
+        # words of the current results by line (from TSV, parsed lazily)
+        self.bulk_words = None
+        # symbol boxes of the current results (for shrink_polygons, collected lazily)
+        self.symbol_boxes = None
+        # validated parent polygons for polygon_for_parent (per page)
+        self.parent_cache = dict()
+        # compile XPath queries once (also validating them early)
+        self.xpath_queries = dict()
+        self.xpath_matches = dict()
+        self._compile_xpaths('pc', NAMESPACES['page'])
+
+    def shutdown(self):
+        if getattr(self, 'threadpool', None):
+            self.threadpool.shutdown()
+            self.threadpool = None
+        if getattr(self, 'tessapi_pool', None):
+            self.tessapi_pool.clear()
+
+    def _preload(self, model):
+        """Load all models and API clones which may be needed later on now.
+
+        (Page-parallel workers get forked after setup, so instead of each
+        loading its own copy, they share these copy-on-write.)
+        """
+        models = list(self.parameter['xpath_model'].values())
+        if self.parameter['auto_model']:
+            models.extend(model.split('+'))
+        # (unique, in order of priority)
+        models = [model_ for model_ in dict.fromkeys(models)
+                  if model_ != model]
+        if len(models) > self.tessapi_pool.size:
+            self.logger.warning("Cannot preload more than model_cache=%d models, skipping %s",
+                                self.tessapi_pool.size, models[self.tessapi_pool.size:])
+        clones = self.segment_threads if self.segment_threads > 1 else 0
+        self.logger.info("Preloading models %s and %d clones of '%s'", models, clones, model)
+        self.tessapi_pool.preload(models, clones)
+        # loading leaves freed buffers behind, which would only get copied on write
+        trim_memory()
+
+    def process_workspace(self, workspace):
+        TIMER.start_run()
+        super().process_workspace(workspace)
+        TIMER.end_run(self.logger)
+
+    def process_page_file(self, *input_files):
+        page_id = next(input_file.pageId for input_file in input_files
+                       if input_file is not None)
+        try:
+            with TIMER.methods(self.workspace, ['image_from_page', 'image_from_segment',
+                                                'save_image_file', 'add_file']), \
+                 TIMER('page'):
+                super().process_page_file(*input_files)
+        finally:
+            TIMER.end_page(page_id, self.logger)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            usage = memory_usage()
+            if usage:
+                # (PSS accounts shared pages proportionally, so it sums up over workers)
+                self.logger.debug("Memory of process %d after page: RSS %.1f MiB, PSS %.1f MiB",
+                                  os.getpid(), *usage)
+
+    def _get_threadpool(self):
+        # create lazily, i.e. not before page-parallel workers get forked
+        if self.threadpool is None:
+            self.threadpool = ThreadPoolExecutor(max_workers=self.max_threads,
+                                                 thread_name_prefix='tesserocr')
+        return self.threadpool
+
+    def _get_thread_tessapi(self):
+        # each worker thread needs its own API (created lazily, too)
+        tessapi = getattr(self.thread_state, 'tessapi', None)
+        if tessapi is None:
+            tessapi = self.thread_state.tessapi = self.tessapi_pool.clone()
+        return self.tessapi_pool.sync(tessapi)
+
+    def _compile_xpaths(self, prefix, nsuri):
+        """Compile ``xpath_parameters`` and ``xpath_model`` queries for the PAGE namespace ``nsuri``.
+
+        Wrap each (segment-relative) expression into a predicate on all segments
+        (page, regions, lines, words and glyphs), so it can be evaluated on the
+        whole document at once (cf. ``_match_xpaths``). Expressions depending on
+        the context position or size (``position()`` or ``last()``) would mean
+        something else in a predicate on all segments, so these are wrapped into
+        a predicate on the context node only instead (to be evaluated on each
+        segment separately, cf. ``_get_xpath_matches``).
+
+        Cache the result per namespace and prefix.
+        """
+        if (prefix, nsuri) not in self.xpath_queries:
+            ns = {'re': 'http://exslt.org/regular-expressions',
+                  'pc': nsuri}
+            if prefix:
+                ns[prefix] = nsuri
+            def compile_xpath(xpath):
+                if CONTEXT_POSITION.search(xpath):
+                    # (single node in context, like for segment.xpath)
+                    return etree.XPath('self::*[boolean(%s)]' % xpath, namespaces=ns), False
+                return etree.XPath('//*[%s][boolean(%s)]' % (SEGMENT_TEST, xpath), namespaces=ns), True
+            self.xpath_queries[prefix, nsuri] = {
+                key: [(xpath, *compile_xpath(xpath), value)
+                      for xpath, value in self.parameter[key].items()]
+                for key in ['xpath_parameters', 'xpath_model']}
+        return self.xpath_queries[prefix, nsuri]
+
+    def _match_xpaths(self, pcgts):
+        """Evaluate ``xpath_parameters`` and ``xpath_model`` queries for the whole page.
+
+        Store the identifiers of all matching segments for each query,
+        so ``_reinit`` only needs to look them up. (Queries which cannot
+        be evaluated for the whole page are kept for each segment.)
+        """
+        root = pcgts.etree
+        queries = self._compile_xpaths(root.prefix, root.nsmap[root.prefix])
+        self.xpath_matches = {
+            key: [(xpath, value, set(node.get('id', node.get('imageFilename'))
+                                     for node in query(root)) if on_page else query)
+                  for xpath, query, on_page, value in queries[key]]
+            for key in queries}
+
+    def _get_xpath_matches(self, key, node, ident):
+        """Get the (expression, value) pairs of all ``key`` queries matching the segment ``node``.
 
+        (Call ``_match_xpaths`` for the page first.)
+        """
+        for xpath, value, matches in self.xpath_matches[key]:
+            if isinstance(matches, set):
+                if ident in matches:
+                    yield xpath, value
+            elif matches(node):
+                yield xpath, value
+
+    @timed('reinit')
     def _reinit(self, segment, mapping):
         """Reset Tesseract API to initial state, and apply API-level settings for the given segment.
 
@@ -209,17 +614,23 @@ class TesserocrRecognize(Processor):
         and in case of a match, apply given parameters, respectively.
 
         If ``xpath_model`` is used, try each XPath expression against ``segment``,
-        and in case of a match, load the given language/model, respectively.
+        and in case of a match, switch to the given language/model, respectively.
 
         If ``auto_model`` is used, and no ``xpath_model`` was applied yet,
-        try each given language/model individually on ``segment``, compare
-        their confidences, and load the best-scoring language/model.
+        then unless a model has already been chosen for the current region
+        or page (cf. ``auto_model_level``), prepare all given languages/models
+        as candidates for ``_recognize``.
+
+        (Models other than the default are kept loaded in ``tessapi_pool``
+        up to ``model_cache``, so switching back and forth is cheap.)
 
-        Before returning, store all previous settings (to catch by the next call).
+        Before, undo all temporary settings from the previous call (cheaply,
+        by setting the changed variables back, unless some of them can only
+        be applied by initialization).
         """
         # Tesseract API is stateful but does not allow copy constructors
         # for segment-by-segment configuration we therefore need to
-        # re-initialize the API with the currently loaded settings,
+        # switch between APIs initialized with the respective model,
         # and add some custom choices
         node = mapping.get(id(segment), None)
         tag = segment.__class__.__name__[:-4]
@@ -228,56 +639,295 @@ class TesserocrRecognize(Processor):
         else:
             at_ident = 'imageFilename'
         ident = getattr(segment, at_ident)
-        with self.tessapi:
-            # apply temporary changes
-            if self.parameter['xpath_parameters']:
-                if node is not None and node.attrib.get(at_ident, None) == ident:
-                    ns = {'re': 'http://exslt.org/regular-expressions',
-                          'pc': node.nsmap[node.prefix],
-                          node.prefix: node.nsmap[node.prefix]}
-                    for xpath, params in self.parameter['xpath_parameters'].items():
-                        if node.xpath(xpath, namespaces=ns):
-                            self.logger.info("Found '%s' in '%s', setting '%s'",
-                                             xpath, ident, params)
-                            for name, val in params.items():
-                                self.tessapi.SetVariable(name, val)
-                else:
-                    self.logger.error("Cannot find segment '%s' in etree mapping, "
-                                      "ignoring xpath_parameters", ident)
-            if self.parameter['xpath_model']:
-                if node is not None and node.attrib.get(at_ident, None) == ident:
-                    ns = {'re': 'http://exslt.org/regular-expressions',
-                          'pc': node.nsmap[node.prefix],
-                          node.prefix: node.nsmap[node.prefix]}
-                    models = []
-                    for xpath, model in self.parameter['xpath_model'].items():
-                        if node.xpath(xpath, namespaces=ns):
-                            self.logger.info("Found '%s' in '%s', reloading with '%s'",
-                                             xpath, ident, model)
-                            models.append(model)
-                    if models:
-                        model = '+'.join(models)
-                        self.logger.debug("Reloading model '%s' for %s '%s'", model, tag, ident)
-                        self.tessapi.Reset(lang=model)
-                        return
-                else:
-                    self.logger.error("Cannot find segment '%s' in etree mapping, "
-                                      "ignoring xpath_model", ident)
-            if self.parameter['auto_model']:
-                models = self.parameter['model'].split('+')
-                if len(models) > 1:
-                    confs = list()
-                    for model in models:
-                        self.tessapi.Reset(lang=model)
-                        self.tessapi.Recognize()
-                        confs.append(self.tessapi.MeanTextConf())
-                    model = models[np.argmax(confs)]
-                    self.logger.debug("Reloading best model '%s' for %s '%s'", model, tag, ident)
-                    self.tessapi.Reset(lang=model)
-                    return
-            if self.parameter['xpath_model'] or self.parameter['auto_model']:
-                # default: undo all settings from previous calls (reset to init-state)
-                self.tessapi.Reset()
+        self.tessapi_pool.restore()
+        parameters = dict()
+        if self.parameter['xpath_parameters']:
+            if node is not None and node.attrib.get(at_ident, None) == ident:
+                for xpath, params in self._get_xpath_matches('xpath_parameters', node, ident):
+                    self.logger.info("Found '%s' in '%s', setting '%s'",
+                                     xpath, ident, params)
+                    parameters.update(params)
+            else:
+                self.logger.error("Cannot find segment '%s' in etree mapping, "
+                                  "ignoring xpath_parameters", ident)
+        model = None
+        if self.parameter['xpath_model']:
+            if node is not None and node.attrib.get(at_ident, None) == ident:
+                models = []
+                for xpath, model in self._get_xpath_matches('xpath_model', node, ident):
+                    self.logger.info("Found '%s' in '%s', switching to '%s'",
+                                     xpath, ident, model)
+                    models.append(model)
+                model = '+'.join(models) or None
+            else:
+                self.logger.error("Cannot find segment '%s' in etree mapping, "
+                                  "ignoring xpath_model", ident)
+        self.auto_model_candidates = None
+        if self.parameter['auto_model'] and not model:
+            models = self.parameter['model'].split('+')
+            if self.auto_model_choice:
+                model = self.auto_model_choice
+                self.logger.debug("Switching to chosen model '%s' for %s '%s'", model, tag, ident)
+            elif len(models) > 1:
+                # defer decision to _recognize (after the image has been set)
+                self.auto_model_candidates = models
+                model = models[0]
+        if self.parameter['xpath_model'] or self.parameter['auto_model']:
+            # default: undo model switch from previous calls (back to init-state)
+            self.tessapi = self.tessapi_pool.get(model)
+        tessapis = [self.tessapi]
+        if self.auto_model_candidates:
+            tessapis = [self.tessapi_pool.get(model) for model in self.auto_model_candidates]
+        for tessapi in tessapis:
+            with tessapi:
+                # apply temporary changes
+                for name, val in parameters.items():
+                    tessapi.SetVariable(name, val)
+
+    def _recognize(self):
+        """Run text recognition on the current image and page segmentation mode.
+
+        If ``auto_model`` is used, and the model has not been chosen for ``segment``
+        already (during ``_reinit``), then recognize with each of the given
+        languages/models concurrently (on separate APIs), compare their confidences,
+        and keep the best-scoring API (along with its results) as the current one.
+
+        If ``auto_model_level`` is not ``segment``, remember the choice for the rest
+        of the region or page, respectively.
+        """
+        # invalidate results from previous call
+        self.bulk_words = None
+        if not self.auto_model_candidates:
+            self.tessapi.Recognize()
+            return
+        models = self.auto_model_candidates
+        self.auto_model_candidates = None
+        image = self.tessapi.image
+        rectangle = self.tessapi.rectangle
+        psm = self.tessapi.psm
+        apis = [self.tessapi_pool.get(model) for model in models]
+        def recognize(tessapi):
+            if tessapi.image is not image:
+                tessapi.SetImage(image)
+            if rectangle:
+                tessapi.SetRectangle(*rectangle)
+            tessapi.SetPageSegMode(psm)
+            tessapi.Recognize()
+            return tessapi.MeanTextConf()
+        confs = list(self._get_threadpool().map(recognize, apis))
+        best = int(np.argmax(confs))
+        self.logger.debug("Switching to best model '%s' (confidences: %s)", models[best],
+                          ', '.join("%s=%d" % (model, conf) for model, conf in zip(models, confs)))
+        self.tessapi = apis[best]
+        if self.parameter['auto_model_level'] != 'segment':
+            self.auto_model_choice = models[best]
+
+    def _get_rectangle(self, segment, parent_image, parent_coords):
+        """Get the bounding box of ``segment`` within ``parent_image`` for ``SetRectangle``.
+
+        Only possible if ``segment`` has no AlternativeImage or orientation of its own,
+        and its polygon is an axis-aligned rectangle in the parent image (i.e. cropping
+        would not need any masking or rotation).
+
+        Return left, top, width, height (or None if not possible or empty).
+        """
+        if segment.get_AlternativeImage() or getattr(segment, 'orientation', None):
+            return None
+        polygon = coordinates_of_segment(segment, parent_image, parent_coords)
+        left, top = np.min(polygon, axis=0)
+        right, bottom = np.max(polygon, axis=0)
+        if not (np.all(np.isin(polygon[:, 0], [left, right])) and
+                np.all(np.isin(polygon[:, 1], [top, bottom]))):
+            return None
+        left = max(0, int(left))
+        top = max(0, int(top))
+        right = min(parent_image.width, int(right))
+        bottom = min(parent_image.height, int(bottom))
+        if right <= left or bottom <= top:
+            return None
+        return left, top, right - left, bottom - top
+
+    def _recognize_concurrently(self, segments, images, psm, word_conf=False):
+        """Run text recognition on all ``images`` with ``psm`` concurrently.
+
+        Use up to ``segment_threads`` worker threads, each with its own API
+        initialized like the current one.
+
+        Annotate the resulting text and confidence on the respective ``segments``
+        (in document order). If ``word_conf``, use the first word's confidence
+        instead of the mean.
+        """
+        def recognize(image):
+            tessapi = self._get_thread_tessapi()
+            tessapi.SetImage(image)
+            tessapi.SetPageSegMode(psm)
+            tessapi.Recognize()
+            text = tessapi.GetUTF8Text().rstrip("\n\f")
+            if word_conf:
+                conf = tessapi.AllWordConfidences()
+                conf = conf[0]/100.0 if conf else 0.0
+            else:
+                # iterator scores are arithmetic averages, too
+                conf = tessapi.MeanTextConf()/100.0
+            return text, conf
+        for segment, (text, conf) in zip(segments, self._get_threadpool().map(recognize, images)):
+            segment.add_TextEquiv(TextEquivType(Unicode=text, conf=conf))
+
+    def _recognize_batch(self, lines, images):
+        """Run text recognition on all line ``images`` at once.
+
+        Stack the images vertically (separated by blank gaps) into a single
+        composite image, and recognize that as a single block of text. Map the
+        resulting text lines back to the respective ``lines`` via their vertical
+        offsets, and annotate text and confidence.
+
+        Lines which do not receive exactly one result line (or share one with
+        others) get recognized on their own afterwards.
+        """
+        gap = max(image.height for image in images)
+        width = max(image.width for image in images) + 2 * gap
+        height = sum(image.height for image in images) + (len(images) + 1) * gap
+        composite = Image.new('L', (width, height), 255)
+        offsets = []
+        top = gap
+        for image in images:
+            composite.paste(image.convert('L'), (gap, top))
+            offsets.append((top, top + image.height))
+            top += image.height + gap
+        self.logger.debug("Recognizing text in %d lines at once", len(lines))
+        self.tessapi.SetImage(composite)
+        self.tessapi.SetPageSegMode(PSM.SINGLE_BLOCK)
+        self._recognize()
+        results = [[] for _ in lines]
+        result_it = self.tessapi.GetIterator()
+        if result_it and not result_it.Empty(RIL.TEXTLINE):
+            # (lines may get split into paragraphs, but not blocks)
+            for it in iterate_level(result_it, RIL.TEXTLINE, parent=RIL.BLOCK):
+                _, y0, _, y1 = it.BoundingBox(RIL.TEXTLINE)
+                slots = [index for index, (top, bottom) in enumerate(offsets)
+                         if y0 < bottom and y1 > top]
+                result = (it.GetUTF8Text(RIL.TEXTLINE).rstrip("\n\f"),
+                          # iterator scores are arithmetic averages, too
+                          it.Confidence(RIL.TEXTLINE)/100.0)
+                for index in slots:
+                    results[index].append(result if len(slots) == 1 else None)
+        for line, image, line_results in zip(lines, images, results):
+            if len(line_results) == 1 and line_results[0]:
+                text, conf = line_results[0]
+                line.add_TextEquiv(TextEquivType(Unicode=text, conf=conf))
+                continue
+            self.logger.debug("Recognizing text in line '%s' on its own", line.id)
+            self.tessapi.SetImage(image)
+            self.tessapi.SetPageSegMode(PSM.SINGLE_LINE)
+            self._recognize()
+            line.add_TextEquiv(TextEquivType(
+                Unicode=self.tessapi.GetUTF8Text().rstrip("\n\f"),
+                # iterator scores are arithmetic averages, too
+                conf=self.tessapi.MeanTextConf()/100.0))
+
+    def _recognize_aligned(self, segments, image, coords, ril):
+        """Run text recognition on the current image once, and align results to ``segments``.
+
+        Iterate the results on level ``ril`` (words or symbols), and assign each
+        of them to the segment it overlaps most with (by bounding box, relative to
+        the parent ``image`` and ``coords``). Annotate the joined text and mean
+        confidence of all results assigned to each segment (along with the choices
+        of a single symbol).
+
+        Return the list of segments which no result could be assigned to.
+        """
+        self._recognize()
+        boxes = []
+        results = []
+        result_it = self.tessapi.GetIterator()
+        if result_it and not result_it.Empty(ril):
+            for it in iterate_level(result_it, ril):
+                boxes.append(it.BoundingBox(ril))
+                text = it.GetUTF8Text(ril)
+                conf = it.Confidence(ril)/100
+                choices = []
+                if ril == RIL.SYMBOL:
+                    for choice_no, choice in enumerate(it.GetChoiceIterator(), 1):
+                        alternative_text = choice.GetUTF8Text() or ''
+                        alternative_conf = choice.Confidence()/100
+                        if alternative_text == text:
+                            continue
+                        if (conf - alternative_conf > CHOICE_THRESHOLD_CONF or
+                            choice_no > CHOICE_THRESHOLD_NUM):
+                            break
+                        choices.append((choice_no, alternative_text, alternative_conf))
+                results.append((text, conf, choices))
+        aligned = [[] for _ in segments]
+        if boxes:
+            # intersection areas between all results (rows) and segments (columns)
+            overlaps = bbox_overlaps(boxes, [bbox_of_segment(segment, image, coords)
+                                             for segment in segments])
+            for index in np.flatnonzero(overlaps.max(axis=1) > 0):
+                aligned[overlaps[index].argmax()].append(results[index])
+        unaligned = []
+        for segment, segment_results in zip(segments, aligned):
+            if not segment_results:
+                unaligned.append(segment)
+                continue
+            if segment.get_TextEquiv():
+                if not self.parameter['overwrite_text']:
+                    continue
+                self.logger.warning("Segment '%s' already contained text results", segment.id)
+                segment.set_TextEquiv([])
+            texts, confs, choices = zip(*segment_results)
+            text = ''.join(texts)
+            # iterator scores are arithmetic averages, too
+            conf = float(np.mean(confs))
+            if ril == RIL.SYMBOL:
+                segment.add_TextEquiv(TextEquivType(index=0, Unicode=text, conf=conf))
+                if len(choices) == 1:
+                    for choice_no, alternative_text, alternative_conf in choices[0]:
+                        segment.add_TextEquiv(TextEquivType(
+                            index=choice_no,
+                            Unicode=alternative_text,
+                            conf=alternative_conf))
+            else:
+                segment.add_TextEquiv(TextEquivType(Unicode=text, conf=conf))
+        return unaligned
+
+    @timed('choose_model')
+    def _choose_model(self, lines, image, coords):
+        """Choose the best model for ``auto_model`` from a sample of ``lines``.
+
+        Recognize up to ``AUTO_MODEL_SAMPLE_LINES`` lines (evenly spaced) with each
+        of the given languages/models concurrently (on separate APIs), and return
+        the model with the best average confidence.
+        """
+        models = self.parameter['model'].split('+')
+        if len(models) < 2:
+            return None
+        step = max(1, len(lines) // AUTO_MODEL_SAMPLE_LINES)
+        images = []
+        for line in lines[::step][:AUTO_MODEL_SAMPLE_LINES]:
+            line_image, _ = self.workspace.image_from_segment(line, image, coords)
+            if not line_image.width or not line_image.height:
+                continue
+            if self.parameter['padding']:
+                line_image = pad_image(line_image, self.parameter['padding'])
+            images.append(line_image)
+        if not images:
+            return None
+        apis = [self.tessapi_pool.get(model) for model in models]
+        psm = PSM.RAW_LINE if self.parameter['raw_lines'] else PSM.SINGLE_LINE
+        def recognize(tessapi):
+            confs = []
+            for line_image in images:
+                tessapi.SetImage(line_image)
+                tessapi.SetPageSegMode(psm)
+                tessapi.Recognize()
+                confs.append(tessapi.MeanTextConf())
+            return np.mean(confs)
+        confs = list(self._get_threadpool().map(recognize, apis))
+        model = models[int(np.argmax(confs))]
+        self.logger.info("Choosing best model '%s' from %d sample lines (confidences: %s)",
+                         model, len(images),
+                         ', '.join("%s=%.1f" % (model, conf) for model, conf in zip(models, confs)))
+        return model
 
     def process_page_pcgts(self, *input_pcgts: Optional[OcrdPage], page_id: Optional[str] = None) -> OcrdPageResult:
         """Perform layout segmentation and/or text recognition with Tesseract.
@@ -402,8 +1052,17 @@ class TesserocrRecognize(Processor):
 
         Similarly, for local (per-segment) OCR model selection based on XPath queries
         into the input PAGE, use ``xpath_model``. For auto-detection of the best performing
-        model (among the models given in ``model``), enable ``auto_model``. To constrain
-        models by type (called OCR engine mode), use ``oem``.
+        model (among the models given in ``model``), enable ``auto_model``; to decide only
+        once per region or page (from a sample of its lines), set ``auto_model_level``. To constrain
+        models by type (called OCR engine mode), use ``oem``. Models switched to are
+        kept loaded (up to ``model_cache``, least recently used ones get unloaded).
+
+        To recognize existing regions, lines or words (without re-segmentation)
+        concurrently in multiple threads, set ``segment_threads``. To avoid cropping
+        rectangular segments (recognizing them within their parent's image), set
+        ``reuse_images``. To recognize existing lines in batches (stacked into one
+        composite image), set ``line_batch_size``. To recognize existing words (or glyphs) in the context of
+        their line (or word) at once (aligning results by overlap), set ``align_segments``.
         """
         pcgts = input_pcgts[0]
         inlevel = self.parameter['segmentation_level']
@@ -427,7 +1086,19 @@ class TesserocrRecognize(Processor):
             dpi = 0
             self.logger.info("Page '%s' images will use DPI estimated from segmentation",
                              page_id)
+        # start with the default model (cached models will be synchronized on demand)
+        self.tessapi = self.tessapi_pool.default
         self.tessapi.SetVariable('user_defined_dpi', str(dpi))
+        if self.parameter['xpath_parameters'] or self.parameter['xpath_model']:
+            self._match_xpaths(pcgts)
+        self.parent_cache.clear()
+        self.auto_model_choice = None
+        if (self.parameter['auto_model'] and
+            self.parameter['auto_model_level'] == 'page' and
+            inlevel != 'region' and not segment_only):
+            lines = page.get_AllTextLines()
+            if lines:
+                self.auto_model_choice = self._choose_model(lines, page_image, page_coords)
 
         self.logger.info("Processing page '%s'", page_id)
         result = OcrdPageResult(pcgts)
@@ -483,7 +1154,7 @@ class TesserocrRecognize(Processor):
                 self.tessapi.AnalyseLayout()
             else:
                 self.logger.debug("Recognizing text in page '%s'", page_id)
-                self.tessapi.Recognize()
+                self._recognize()
             page_image_bin = self.tessapi.GetThresholdedImage()
             # update PAGE (reference the image file):
             page_image_ref = AlternativeImageType(comments=page_coords['features'] + ',binarized,clipped')
@@ -524,6 +1195,50 @@ class TesserocrRecognize(Processor):
 
         return result
 
+    def _get_symbol_polygon(self, result_it, ril):
+        """Get the hull polygon of all symbols in the current element of ``result_it`` at ``ril``.
+
+        Unless already done for ``result_it``, collect the bounding boxes of all
+        (non-empty) symbols of the results in a single pass, along with the span
+        of symbols contained in each block, paragraph, line and word (keyed by
+        their bounding boxes).
+
+        Return None if the element cannot be identified (so the caller can fall
+        back to iterating the symbols, then rewinding).
+        """
+        if self.symbol_boxes is None or self.symbol_boxes[0] is not result_it:
+            padding = self.parameter['padding']
+            boxes = []
+            spans = dict()
+            current = [None] * (RIL.WORD + 1)
+            it = self.tessapi.GetIterator()
+            while it:
+                if not it.Empty(RIL.SYMBOL):
+                    word = tuple(it.BoundingBox(RIL.WORD))
+                    if (RIL.WORD,) + word != current[RIL.WORD]:
+                        for level in [RIL.BLOCK, RIL.PARA, RIL.TEXTLINE, RIL.WORD]:
+                            key = (level,) + (word if level == RIL.WORD else
+                                              tuple(it.BoundingBox(level)))
+                            if key == current[level]:
+                                continue
+                            current[level] = key
+                            # not unique: cannot be identified
+                            spans[key] = None if key in spans else [len(boxes), len(boxes)]
+                    boxes.append(polygon_from_x0y0x1y1(
+                        it.BoundingBox(RIL.SYMBOL, padding=padding)))
+                    for key in current:
+                        if spans[key]:
+                            spans[key][1] = len(boxes)
+                if not it.Next(RIL.SYMBOL):
+                    break
+            self.symbol_boxes = (result_it, boxes, spans)
+        _, boxes, spans = self.symbol_boxes
+        span = spans.get((ril,) + tuple(result_it.BoundingBox(ril)), None)
+        if not span:
+            return None
+        return join_polygons(boxes[span[0]:span[1]])
+
+    @timed('iterate_results')
     def _process_regions_in_page(self, result_it, page, page_coords, mapping, dpi):
         index = 0
         ro = page.get_ReadingOrder()
@@ -560,19 +1275,21 @@ class TesserocrRecognize(Processor):
             if self.parameter['block_polygons']:
                 polygon = it.BlockPolygon()
             elif self.parameter['shrink_polygons'] and not it.Empty(RIL.SYMBOL):
-                polygon = join_polygons([polygon_from_x0y0x1y1(
-                    symbol.BoundingBox(RIL.SYMBOL, padding=self.parameter['padding']))
-                                         for symbol in iterate_level(it, RIL.SYMBOL, parent=RIL.BLOCK)])
-                # simulate a RestartBlock(), not defined by Tesseract:
-                it.Begin()
-                for j, it in enumerate(iterate_level(it, RIL.BLOCK)):
-                    if i == j:
-                        break
+                polygon = self._get_symbol_polygon(it, RIL.BLOCK)
+                if polygon is None:
+                    polygon = join_polygons([polygon_from_x0y0x1y1(
+                        symbol.BoundingBox(RIL.SYMBOL, padding=self.parameter['padding']))
+                                             for symbol in iterate_level(it, RIL.SYMBOL, parent=RIL.BLOCK)])
+                    # simulate a RestartBlock(), not defined by Tesseract:
+                    it.Begin()
+                    for j, it in enumerate(iterate_level(it, RIL.BLOCK)):
+                        if i == j:
+                            break
             else:
                 polygon = polygon_from_x0y0x1y1(bbox)
             xywh = xywh_from_polygon(polygon)
             polygon = coordinates_for_segment(polygon, None, page_coords)
-            polygon2 = polygon_for_parent(polygon, page)
+            polygon2 = polygon_for_parent(polygon, page, cache=self.parent_cache)
             if polygon2 is not None:
                 polygon = polygon2
             points = points_from_polygon(polygon)
@@ -687,6 +1404,7 @@ class TesserocrRecognize(Processor):
             # schema forbids empty OrderedGroup
             ro.set_OrderedGroup(None)
 
+    @timed('iterate_results')
     def _process_cells_in_table(self, result_it, region, rogroup, page_coords, mapping):
         if self.parameter['segmentation_level'] == 'cell':
             ril = RIL.BLOCK # for sparse_text mode
@@ -695,21 +1413,23 @@ class TesserocrRecognize(Processor):
         for index, it in enumerate(iterate_level(result_it, ril)):
             bbox = it.BoundingBox(ril, padding=self.parameter['padding'])
             if self.parameter['shrink_polygons'] and not it.Empty(RIL.SYMBOL):
-                polygon = join_polygons([polygon_from_x0y0x1y1(
-                    symbol.BoundingBox(RIL.SYMBOL, padding=self.parameter['padding']))
-                                         for symbol in iterate_level(it, RIL.SYMBOL, parent=ril)])
-                if ril == RIL.BLOCK:
-                    # simulate a RestartBlock(), not defined by Tesseract:
-                    it.Begin()
-                    for j, it in enumerate(iterate_level(it, RIL.BLOCK)):
-                        if index == j:
-                            break
-                else:
-                    it.RestartParagraph()
+                polygon = self._get_symbol_polygon(it, ril)
+                if polygon is None:
+                    polygon = join_polygons([polygon_from_x0y0x1y1(
+                        symbol.BoundingBox(RIL.SYMBOL, padding=self.parameter['padding']))
+                                             for symbol in iterate_level(it, RIL.SYMBOL, parent=ril)])
+                    if ril == RIL.BLOCK:
+                        # simulate a RestartBlock(), not defined by Tesseract:
+                        it.Begin()
+                        for j, it in enumerate(iterate_level(it, RIL.BLOCK)):
+                            if index == j:
+                                break
+                    else:
+                        it.RestartParagraph()
             else:
                 polygon = polygon_from_x0y0x1y1(bbox)
             polygon = coordinates_for_segment(polygon, None, page_coords)
-            polygon2 = polygon_for_parent(polygon, region)
+            polygon2 = polygon_for_parent(polygon, region, cache=self.parent_cache)
             if polygon2 is not None:
                 polygon = polygon2
             points = points_from_polygon(polygon)
@@ -732,6 +1452,7 @@ class TesserocrRecognize(Processor):
                     # iterator scores are arithmetic averages, too
                     conf=it.Confidence(ril)/100.0))
 
+    @timed('iterate_results')
     def _process_lines_in_region(self, result_it, region, page_coords, mapping, parent_ril=RIL.BLOCK):
         if self.parameter['sparse_text']:
             it = result_it
@@ -751,14 +1472,16 @@ class TesserocrRecognize(Processor):
         for index, it in enumerate(iterate_level(result_it, RIL.TEXTLINE, parent=parent_ril)):
             bbox = it.BoundingBox(RIL.TEXTLINE, padding=self.parameter['padding'])
             if self.parameter['shrink_polygons'] and not it.Empty(RIL.SYMBOL):
-                polygon = join_polygons([polygon_from_x0y0x1y1(
-                    symbol.BoundingBox(RIL.SYMBOL, padding=self.parameter['padding']))
-                                         for symbol in iterate_level(it, RIL.SYMBOL, parent=RIL.TEXTLINE)])
-                it.RestartRow()
+                polygon = self._get_symbol_polygon(it, RIL.TEXTLINE)
+                if polygon is None:
+                    polygon = join_polygons([polygon_from_x0y0x1y1(
+                        symbol.BoundingBox(RIL.SYMBOL, padding=self.parameter['padding']))
+                                             for symbol in iterate_level(it, RIL.SYMBOL, parent=RIL.TEXTLINE)])
+                    it.RestartRow()
             else:
                 polygon = polygon_from_x0y0x1y1(bbox)
             polygon = coordinates_for_segment(polygon, None, page_coords)
-            polygon2 = polygon_for_parent(polygon, region)
+            polygon2 = polygon_for_parent(polygon, region, cache=self.parent_cache)
             if polygon2 is not None:
                 polygon = polygon2
             points = points_from_polygon(polygon)
@@ -779,22 +1502,96 @@ class TesserocrRecognize(Processor):
                     # iterator scores are arithmetic averages, too
                     conf=it.Confidence(RIL.TEXTLINE)/100.0))
 
+    @timed('iterate_results')
+    def _get_bulk_words(self, result_it):
+        """Get all words in the line of ``result_it`` from the current results in bulk.
+
+        Unless already done for the current results, get Tesseract's TSV output
+        for the whole image, and parse the word rows into arrays (grouped by line,
+        keyed by line bbox).
+
+        Return a tuple of word bboxes (as x0y0x1y1), confidences and texts
+        in the line, or None if the line cannot be identified.
+        """
+        if self.bulk_words is None:
+            self.bulk_words = dict()
+            # columns: level, page_num, block_num, par_num, line_num, word_num,
+            #          left, top, width, height, conf, text
+            rows = [row.split('\t', 11) for row in self.tessapi.GetTSVText(0).splitlines()]
+            rows = [row for row in rows if len(row) == 12]
+            if not rows:
+                return None
+            table = np.array([row[:11] for row in rows], dtype=float)
+            texts = np.array([row[11] for row in rows], dtype=object)
+            level = table[:, 0].astype(int)
+            bboxes = table[:, 6:10].astype(int)
+            # to x0y0x1y1
+            bboxes[:, 2:] += bboxes[:, :2]
+            # each word belongs to the last line row before it
+            lineno = np.cumsum(level == 4)
+            for i in np.flatnonzero(level == 4):
+                key = tuple(bboxes[i])
+                if key in self.bulk_words:
+                    # ambiguous, use iterator for these
+                    self.bulk_words[key] = None
+                    continue
+                words = (level == 5) & (lineno == lineno[i])
+                self.bulk_words[key] = (bboxes[words], table[words, 10], texts[words])
+        return self.bulk_words.get(tuple(result_it.BoundingBox(RIL.TEXTLINE)), None)
+
+    @timed('iterate_results')
     def _process_words_in_line(self, result_it, line, coords, mapping):
+        if (self.parameter['bulk_results'] and
+            self.parameter['textequiv_level'] == 'word' and
+            self.parameter.get('model', '') and
+            not self.parameter['shrink_polygons'] and
+            not self.parameter['padding'] and
+            not self.parameter['sparse_text']):
+            words = self._get_bulk_words(result_it)
+            if words is not None:
+                self._process_words_in_line_bulk(words, line, coords)
+                return
+        if (self.parameter['textequiv_level'] == 'word' and
+            not self.parameter['shrink_polygons']):
+            # no recursion into glyphs: get all bboxes and texts from the
+            # iterator first, then convert and clip coordinates in one batch
+            bboxes, confs, texts = [], [], []
+            for it in iterate_level(result_it, RIL.WORD):
+                bboxes.append(it.BoundingBox(RIL.WORD, padding=self.parameter['padding']))
+                if self.parameter.get('model', ''):
+                    texts.append(it.GetUTF8Text(RIL.WORD))
+                    confs.append(it.Confidence(RIL.WORD))
+            all_points = self._points_for_bboxes(bboxes, line, coords, 'word')
+            for index, points in enumerate(all_points):
+                if points is None:
+                    continue
+                ID = line.id + "_word%04d" % index
+                self.logger.debug("Detected word '%s': %s", ID, points)
+                word = WordType(id=ID, Coords=CoordsType(points=points))
+                line.add_Word(word)
+                if self.parameter.get('model', ''):
+                    word.add_TextEquiv(TextEquivType(
+                        Unicode=texts[index],
+                        # iterator scores are arithmetic averages, too
+                        conf=confs[index]/100.0))
+            return
         for index, it in enumerate(iterate_level(result_it, RIL.WORD)):
             bbox = it.BoundingBox(RIL.WORD, padding=self.parameter['padding'])
             if self.parameter['shrink_polygons'] and not it.Empty(RIL.SYMBOL):
-                polygon = join_polygons([polygon_from_x0y0x1y1(
-                    symbol.BoundingBox(RIL.SYMBOL, padding=self.parameter['padding']))
-                                         for symbol in iterate_level(it, RIL.SYMBOL, parent=RIL.WORD)])
-                # simulate a BeginWord(index), not exposed by tesserocr:
-                it.RestartRow()
-                for j, it in enumerate(iterate_level(it, RIL.WORD)):
-                    if index == j:
-                        break
+                polygon = self._get_symbol_polygon(it, RIL.WORD)
+                if polygon is None:
+                    polygon = join_polygons([polygon_from_x0y0x1y1(
+                        symbol.BoundingBox(RIL.SYMBOL, padding=self.parameter['padding']))
+                                             for symbol in iterate_level(it, RIL.SYMBOL, parent=RIL.WORD)])
+                    # simulate a BeginWord(index), not exposed by tesserocr:
+                    it.RestartRow()
+                    for j, it in enumerate(iterate_level(it, RIL.WORD)):
+                        if index == j:
+                            break
             else:
                 polygon = polygon_from_x0y0x1y1(bbox)
             polygon = coordinates_for_segment(polygon, None, coords)
-            polygon2 = polygon_for_parent(polygon, line)
+            polygon2 = polygon_for_parent(polygon, line, cache=self.parent_cache)
             if polygon2 is not None:
                 polygon = polygon2
             points = points_from_polygon(polygon)
@@ -813,29 +1610,38 @@ class TesserocrRecognize(Processor):
                     # iterator scores are arithmetic averages, too
                     conf=it.Confidence(RIL.WORD)/100.0))
 
-    def _process_glyphs_in_word(self, result_it, word, coords, mapping):
-        for index, it in enumerate(iterate_level(result_it, RIL.SYMBOL)):
-            bbox = it.BoundingBox(RIL.SYMBOL, padding=self.parameter['padding'])
-            polygon = polygon_from_x0y0x1y1(bbox)
-            polygon = coordinates_for_segment(polygon, None, coords)
-            polygon2 = polygon_for_parent(polygon, word)
-            if polygon2 is not None:
-                polygon = polygon2
-            points = points_from_polygon(polygon)
-            if polygon2 is None:
-                self.logger.warning('Ignoring extant glyph: %s', points)
+    def _process_words_in_line_bulk(self, words, line, coords):
+        # like _process_words_in_line, but from arrays instead of iterator
+        bboxes, confs, texts = words
+        all_points = self._points_for_bboxes(bboxes, line, coords, 'word')
+        for index, (points, conf, text) in enumerate(zip(all_points, confs, texts)):
+            if points is None:
                 continue
-            ID = word.id + '_glyph%04d' % index
-            #self.logger.debug("Detected glyph '%s': %s", ID, points)
-            glyph = GlyphType(id=ID, Coords=CoordsType(points))
-            word.add_Glyph(glyph)
+            ID = line.id + "_word%04d" % index
+            self.logger.debug("Detected word '%s': %s", ID, points)
+            word = WordType(id=ID, Coords=CoordsType(points=points))
+            line.add_Word(word)
+            word.add_TextEquiv(TextEquivType(
+                Unicode=text,
+                # iterator scores are arithmetic averages, too
+                conf=float(conf)/100.0))
+
+    @timed('iterate_results')
+    def _process_glyphs_in_word(self, result_it, word, coords, mapping):
+        # first get all bboxes and texts from the iterator,
+        # then convert and clip all coordinates in one batch
+        bboxes = []
+        textequivs = []
+        for it in iterate_level(result_it, RIL.SYMBOL):
+            bboxes.append(it.BoundingBox(RIL.SYMBOL, padding=self.parameter['padding']))
+            textequivs.append([])
             if self.parameter['textequiv_level'] != 'glyph':
                 pass
             elif self.parameter.get('model', ''):
                 glyph_text = it.GetUTF8Text(RIL.SYMBOL) # equals first choice?
                 glyph_conf = it.Confidence(RIL.SYMBOL)/100 # equals first choice?
                 #self.logger.debug('best glyph: "%s" [%f]', glyph_text, glyph_conf)
-                glyph.add_TextEquiv(TextEquivType(
+                textequivs[-1].append(TextEquivType(
                     index=0,
                     Unicode=glyph_text,
                     conf=glyph_conf))
@@ -850,10 +1656,40 @@ class TesserocrRecognize(Processor):
                         choice_no > CHOICE_THRESHOLD_NUM):
                         break
                     # todo: consider SymbolIsSuperscript (TextStyle), SymbolIsDropcap (RelationType) etc
-                    glyph.add_TextEquiv(TextEquivType(
+                    textequivs[-1].append(TextEquivType(
                         index=choice_no,
                         Unicode=alternative_text,
                         conf=alternative_conf))
+        all_points = self._points_for_bboxes(bboxes, word, coords, 'glyph')
+        for index, (points, glyph_textequivs) in enumerate(zip(all_points, textequivs)):
+            if points is None:
+                continue
+            ID = word.id + '_glyph%04d' % index
+            #self.logger.debug("Detected glyph '%s': %s", ID, points)
+            glyph = GlyphType(id=ID, Coords=CoordsType(points))
+            word.add_Glyph(glyph)
+            for textequiv in glyph_textequivs:
+                glyph.add_TextEquiv(textequiv)
+
+    def _points_for_bboxes(self, bboxes, parent, coords, name):
+        """Convert relative bboxes of new segments to absolute points clipped to ``parent``.
+
+        Instead of converting each segment on its own, apply the coordinate
+        transform and the (rectangular) parent clipping to all in one batch.
+
+        Return a list of points (or None for segments extant to ``parent``),
+        respectively.
+        """
+        polygons = polygons_from_bboxes(bboxes, coords)
+        clipped = polygons_for_parent(polygons, parent, cache=self.parent_cache)
+        all_points = []
+        for polygon, polygon2 in zip(polygons, clipped):
+            if polygon2 is None:
+                self.logger.warning('Ignoring extant %s: %s', name, points_from_polygon(polygon))
+                all_points.append(None)
+            else:
+                all_points.append(points_from_polygon(polygon2))
+        return all_points
 
     def _process_existing_tables(self, tables, page, page_image, page_coords, mapping):
         # prepare dict of reading order
@@ -920,6 +1756,9 @@ class TesserocrRecognize(Processor):
             if not table_image.width or not table_image.height:
                 self.logger.warning("Skipping table region '%s' with zero size", table.id)
                 continue
+            if (self.parameter['auto_model'] and
+                self.parameter['auto_model_level'] == 'region'):
+                self.auto_model_choice = None
             if not segment_only:
                 self._reinit(table, mapping)
             if self.parameter['padding']:
@@ -935,31 +1774,55 @@ class TesserocrRecognize(Processor):
                 self.tessapi.AnalyseLayout()
             else:
                 self.logger.debug("Recognizing text in table '%s'", table.id)
-                self.tessapi.Recognize()
+                self._recognize()
             self._process_cells_in_table(self.tessapi.GetIterator(), table, roelem, table_coords, mapping)
 
     def _process_existing_regions(self, regions, page_image, page_coords, mapping):
         if self.parameter['textequiv_level'] in ['region', 'cell'] and not self.parameter.get('model', ''):
             return
         segment_only = self.parameter['textequiv_level'] == 'none' or not self.parameter.get('model', '')
+        # recognize in worker threads (after the loop)?
+        concurrent = (self.segment_threads > 1 and
+                      self.parameter['textequiv_level'] in ['region', 'cell'])
+        pending = []
+        # recognize within the parent image (instead of cropping)?
+        reuse = (self.parameter['reuse_images'] and not concurrent and
+                 not self.parameter['padding'] and
+                 self.parameter['textequiv_level'] in ['region', 'cell'])
         for region in regions:
-            region_image, region_coords = self.workspace.image_from_segment(
-                region, page_image, page_coords)
-            if not region_image.width or not region_image.height:
-                self.logger.warning("Skipping text region '%s' with zero size", region.id)
-                continue
+            rectangle = reuse and self._get_rectangle(region, page_image, page_coords)
+            if not rectangle:
+                region_image, region_coords = self.workspace.image_from_segment(
+                    region, page_image, page_coords)
+                if not region_image.width or not region_image.height:
+                    self.logger.warning("Skipping text region '%s' with zero size", region.id)
+                    continue
+            if (self.parameter['auto_model'] and
+                self.parameter['auto_model_level'] == 'region' and
+                not segment_only):
+                self.auto_model_choice = None
+                if (self.parameter['textequiv_level'] not in ['region', 'cell'] and
+                    self.parameter['segmentation_level'] != 'line' and
+                    region.get_TextLine()):
+                    self.auto_model_choice = self._choose_model(
+                        region.get_TextLine(), region_image, region_coords)
             if not segment_only:
                 self._reinit(region, mapping)
             if (region.get_TextEquiv() and not self.parameter['overwrite_text']
                 if self.parameter['textequiv_level'] in ['region', 'cell']
                 else self.parameter['segmentation_level'] != 'line'):
                 pass # image not used here
+            elif rectangle:
+                if self.tessapi.image is not page_image:
+                    self.tessapi.SetImage(page_image)
+                self.tessapi.SetRectangle(*rectangle)
             elif self.parameter['padding']:
                 region_image = pad_image(region_image, self.parameter['padding'])
-                self.tessapi.SetImage(region_image)
+                if not concurrent:
+                    self.tessapi.SetImage(region_image)
                 region_coords['transform'] = shift_coordinates(
                     region_coords['transform'], 2*[self.parameter['padding']])
-            else:
+            elif not concurrent:
                 self.tessapi.SetImage(region_image)
             self.tessapi.SetPageSegMode(PSM.SINGLE_BLOCK)
             # cell (region in table): we could enter from existing_tables or top-level existing regions
@@ -971,6 +1834,10 @@ class TesserocrRecognize(Processor):
                     self.logger.warning("Region '%s' already contained text results", region.id)
                     region.set_TextEquiv([])
                 self.logger.debug("Recognizing text in region '%s'", region.id)
+                if concurrent:
+                    pending.append((region, region_image))
+                    continue
+                self._recognize()
                 # todo: consider SetParagraphSeparator
                 region.add_TextEquiv(TextEquivType(
                     Unicode=self.tessapi.GetUTF8Text().rstrip("\n\f"),
@@ -989,36 +1856,62 @@ class TesserocrRecognize(Processor):
                     self.tessapi.AnalyseLayout()
                 else:
                     self.logger.debug("Recognizing text in region '%s'", region.id)
-                    self.tessapi.Recognize()
+                    self._recognize()
                 self._process_lines_in_region(self.tessapi.GetIterator(), region, region_coords, mapping)
             elif textlines:
                 self._process_existing_lines(textlines, region_image, region_coords, mapping)
             else:
                 self.logger.warning("Region '%s' contains no text lines (but segmentation is off)",
                                     region.id)
+        if pending:
+            self._recognize_concurrently(*zip(*pending), PSM.SINGLE_BLOCK)
 
     def _process_existing_lines(self, textlines, region_image, region_coords, mapping):
         if self.parameter['textequiv_level'] == 'line' and not self.parameter.get('model', ''):
             return
         segment_only = self.parameter['textequiv_level'] == 'none' or not self.parameter.get('model', '')
+        # recognize in worker threads (after the loop)?
+        concurrent = (self.segment_threads > 1 and
+                      self.parameter['textequiv_level'] == 'line')
+        pending = []
+        # recognize multiple lines in a composite image (after every batch)?
+        batched = (self.line_batch_size > 1 and not concurrent and
+                   not self.parameter['raw_lines'] and
+                   self.parameter['textequiv_level'] == 'line')
+        batch = []
+        # recognize within the parent image (instead of cropping)?
+        reuse = (self.parameter['reuse_images'] and not concurrent and not batched and
+                 not self.parameter['padding'] and
+                 self.parameter['textequiv_level'] == 'line')
+        # recognize lines once for their existing words?
+        align = (self.parameter['align_segments'] and not segment_only and
+                 self.parameter['textequiv_level'] == 'word')
         for line in textlines:
-            line_image, line_coords = self.workspace.image_from_segment(
-                line, region_image, region_coords)
-            if not line_image.width or not line_image.height:
-                self.logger.warning("Skipping text line '%s' with zero size", line.id)
-                continue
+            rectangle = reuse and self._get_rectangle(line, region_image, region_coords)
+            if not rectangle:
+                line_image, line_coords = self.workspace.image_from_segment(
+                    line, region_image, region_coords)
+                if not line_image.width or not line_image.height:
+                    self.logger.warning("Skipping text line '%s' with zero size", line.id)
+                    continue
             if not segment_only:
                 self._reinit(line, mapping)
             if (line.get_TextEquiv() and not self.parameter['overwrite_text']
                 if self.parameter['textequiv_level'] == 'line'
-                else self.parameter['segmentation_level'] != 'word'):
+                else (self.parameter['segmentation_level'] != 'word' and
+                      not (align and line.get_Word()))):
                 pass # image not used here
+            elif rectangle:
+                if self.tessapi.image is not region_image:
+                    self.tessapi.SetImage(region_image)
+                self.tessapi.SetRectangle(*rectangle)
             elif self.parameter['padding']:
                 line_image = pad_image(line_image, self.parameter['padding'])
-                self.tessapi.SetImage(line_image)
+                if not concurrent and not batched:
+                    self.tessapi.SetImage(line_image)
                 line_coords['transform'] = shift_coordinates(
                     line_coords['transform'], 2*[self.parameter['padding']])
-            else:
+            elif not concurrent and not batched:
                 self.tessapi.SetImage(line_image)
             if self.parameter['raw_lines']:
                 self.tessapi.SetPageSegMode(PSM.RAW_LINE)
@@ -1032,6 +1925,16 @@ class TesserocrRecognize(Processor):
                     self.logger.warning("Line '%s' already contained text results", line.id)
                     line.set_TextEquiv([])
                 self.logger.debug("Recognizing text in line '%s'", line.id)
+                if concurrent:
+                    pending.append((line, line_image))
+                    continue
+                if batched:
+                    batch.append((line, line_image))
+                    if len(batch) == self.line_batch_size:
+                        self._recognize_batch(*zip(*batch))
+                        batch = []
+                    continue
+                self._recognize()
                 # todo: consider BlankBeforeWord, SetLineSeparator
                 line.add_TextEquiv(TextEquivType(
                     Unicode=self.tessapi.GetUTF8Text().rstrip("\n\f"),
@@ -1050,39 +1953,68 @@ class TesserocrRecognize(Processor):
                     self.tessapi.AnalyseLayout()
                 else:
                     self.logger.debug("Recognizing text in line '%s'", line.id)
-                    self.tessapi.Recognize()
+                    self._recognize()
                 ## internal word and glyph layout:
                 self._process_words_in_line(self.tessapi.GetIterator(), line, line_coords, mapping)
             elif words:
                 ## external word layout:
+                if align:
+                    self.logger.debug("Recognizing text in line '%s' for its words", line.id)
+                    words = self._recognize_aligned(words, line_image, line_coords, RIL.WORD)
+                    if not words:
+                        continue
                 self.logger.warning("Line '%s' contains words already, recognition might be suboptimal", line.id)
                 self._process_existing_words(words, line_image, line_coords, mapping)
             else:
                 self.logger.warning("Line '%s' contains no words (but segmentation is off)",
                                     line.id)
+        if batch:
+            self._recognize_batch(*zip(*batch))
+        if pending:
+            self._recognize_concurrently(*zip(*pending), PSM.RAW_LINE
+                                         if self.parameter['raw_lines'] else PSM.SINGLE_LINE)
 
     def _process_existing_words(self, words, line_image, line_coords, mapping):
         if self.parameter['textequiv_level'] == 'word' and not self.parameter.get('model', ''):
             return
         segment_only = self.parameter['textequiv_level'] == 'none' or not self.parameter.get('model', '')
+        # recognize in worker threads (after the loop)?
+        concurrent = (self.segment_threads > 1 and
+                      self.parameter['textequiv_level'] == 'word')
+        pending = []
+        # recognize within the parent image (instead of cropping)?
+        reuse = (self.parameter['reuse_images'] and not concurrent and
+                 not self.parameter['padding'] and
+                 self.parameter['textequiv_level'] == 'word')
+        # recognize words once for their existing glyphs?
+        align = (self.parameter['align_segments'] and not segment_only and
+                 self.parameter['textequiv_level'] == 'glyph')
         for word in words:
-            word_image, word_coords = self.workspace.image_from_segment(
-                word, line_image, line_coords)
-            if not word_image.width or not word_image.height:
-                self.logger.warning("Skipping word '%s' with zero size", word.id)
-                continue
+            rectangle = reuse and self._get_rectangle(word, line_image, line_coords)
+            if not rectangle:
+                word_image, word_coords = self.workspace.image_from_segment(
+                    word, line_image, line_coords)
+                if not word_image.width or not word_image.height:
+                    self.logger.warning("Skipping word '%s' with zero size", word.id)
+                    continue
             if not segment_only:
                 self._reinit(word, mapping)
             if (word.get_TextEquiv() and not self.parameter['overwrite_text']
                 if self.parameter['textequiv_level'] == 'word'
-                else self.parameter['segmentation_level'] != 'glyph'):
+                else (self.parameter['segmentation_level'] != 'glyph' and
+                      not (align and word.get_Glyph()))):
                 pass # image not used here
+            elif rectangle:
+                if self.tessapi.image is not line_image:
+                    self.tessapi.SetImage(line_image)
+                self.tessapi.SetRectangle(*rectangle)
             elif self.parameter['padding']:
                 word_image = pad_image(word_image, self.parameter['padding'])
-                self.tessapi.SetImage(word_image)
+                if not concurrent:
+                    self.tessapi.SetImage(word_image)
                 word_coords['transform'] = shift_coordinates(
                     word_coords['transform'], 2*[self.parameter['padding']])
-            else:
+            elif not concurrent:
                 self.tessapi.SetImage(word_image)
             self.tessapi.SetPageSegMode(PSM.SINGLE_WORD)
             if self.parameter['textequiv_level'] == 'word':
@@ -1092,6 +2024,10 @@ class TesserocrRecognize(Processor):
                     self.logger.warning("Word '%s' already contained text results", word.id)
                     word.set_TextEquiv([])
                 self.logger.debug("Recognizing text in word '%s'", word.id)
+                if concurrent:
+                    pending.append((word, word_image))
+                    continue
+                self._recognize()
                 word_conf = self.tessapi.AllWordConfidences()
                 word.add_TextEquiv(TextEquivType(
                     Unicode=self.tessapi.GetUTF8Text().rstrip("\n\f"),
@@ -1109,16 +2045,23 @@ class TesserocrRecognize(Processor):
                     self.tessapi.AnalyseLayout()
                 else:
                     self.logger.debug("Recognizing text in word '%s'", word.id)
-                    self.tessapi.Recognize()
+                    self._recognize()
                 ## internal glyph layout:
                 self._process_glyphs_in_word(self.tessapi.GetIterator(), word, word_coords, mapping)
             elif glyphs:
                 ## external glyph layout:
+                if align:
+                    self.logger.debug("Recognizing text in word '%s' for its glyphs", word.id)
+                    glyphs = self._recognize_aligned(glyphs, word_image, word_coords, RIL.SYMBOL)
+                    if not glyphs:
+                        continue
                 self.logger.warning("Word '%s' contains glyphs already, recognition might be suboptimal", word.id)
                 self._process_existing_glyphs(glyphs, word_image, word_coords, mapping)
             else:
                 self.logger.warning("Word '%s' contains no glyphs (but segmentation is off)",
                                     word.id)
+        if pending:
+            self._recognize_concurrently(*zip(*pending), PSM.SINGLE_WORD, word_conf=True)
 
     def _process_existing_glyphs(self, glyphs, word_image, word_xywh, mapping):
         if not self.parameter.get('model', ''):
@@ -1143,6 +2086,7 @@ class TesserocrRecognize(Processor):
                 self.logger.warning("Glyph '%s' already contained text results", glyph.id)
                 glyph.set_TextEquiv([])
             self.logger.debug("Recognizing text in glyph '%s'", glyph.id)
+            self._recognize()
             glyph_text = self.tessapi.GetUTF8Text().rstrip("\n\f")
             glyph_conf = self.tessapi.AllWordConfidences()
             glyph_conf = glyph_conf[0]/100.0 if glyph_conf else 1.0
@@ -0,0 +1,87 @@
+from __future__ import absolute_import
+
+import errno
+import json
+import os
+import socket
+import socketserver
+import stat
+import time
+
+from ocrd_utils import getLogger
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+    """Run one job (a JSON line) per connection and respond with a JSON line."""
+    def handle(self):
+        LOG = getLogger('processor.TesserocrServer')
+        line = self.rfile.readline()
+        if not line:
+            return
+        start = time.time()
+        try:
+            job = json.loads(line)
+            LOG.info("running job on %s: %s", job['mets'], job['tasks'])
+            self.server.run_job(job)
+            response = {'status': 'ok'}
+        except Exception as err:
+            LOG.exception("job failed: %s", line)
+            response = {'status': 'error', 'message': '%s: %s' % (err.__class__.__name__, err)}
+        response['time'] = time.time() - start
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+class WorkerServer(socketserver.UnixStreamServer):
+    """Local server keeping ocrd-tesserocr processors set up across workspaces.
+
+    Listens on a Unix socket for jobs, each with the METS path, the tasks
+    (as in ``ocrd process``) and optionally the page IDs. Jobs are run one
+    at a time (via :py:func:`~ocrd_tesserocr.pipeline.run_pipeline`) with
+    processors taken from a :py:class:`~ocrd_tesserocr.pipeline.ProcessorCache`,
+    so models only get loaded for the first job with the same parameters.
+    """
+    def __init__(self, path, maxsize=None):
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                try:
+                    sock.connect(path)
+                except ConnectionRefusedError:
+                    # left behind by a server which is gone
+                    os.unlink(path)
+                else:
+                    raise OSError(errno.EADDRINUSE, "Another server is listening on %s" % path)
+        super().__init__(path, WorkerHandler)
+        # (not needed by the client)
+        from .pipeline import ProcessorCache
+        self.cache = ProcessorCache(maxsize)
+
+    def run_job(self, job):
+        from ocrd import Resolver
+        from .pipeline import parse_tasks, run_pipeline
+        workspace = Resolver().workspace_from_url(job['mets'])
+        # (not via the global config, which is shared with other jobs)
+        run_pipeline(workspace, parse_tasks(job['tasks']),
+                     page_id=job.get('page_id'),
+                     save_all=job.get('save_all', False),
+                     cache=self.cache,
+                     existing_output='OVERWRITE' if job.get('overwrite') else None)
+
+    def server_close(self):
+        super().server_close()
+        self.cache.clear()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+def submit_job(path, mets, tasks, page_id=None, save_all=False, overwrite=False):
+    """Send a job to the :py:class:`WorkerServer` on ``path`` and wait for its response."""
+    if '://' not in mets:
+        # the server has another working directory
+        mets = os.path.abspath(mets)
+    job = {'mets': mets,
+           'tasks': list(tasks),
+           'page_id': page_id,
+           'save_all': save_all,
+           'overwrite': overwrite}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(json.dumps(job).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as response:
+            return json.loads(response.readline())
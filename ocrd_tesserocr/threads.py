@@ -0,0 +1,79 @@
+from __future__ import absolute_import
+
+import os
+import re
+
+# (nothing here may import tesserocr, because this must run before Tesseract gets loaded)
+
+def get_cores():
+    """Get the number of CPUs this process may run on (honouring its affinity mask)."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def get_page_workers():
+    """Get the number of page-parallel workers (``OCRD_MAX_PARALLEL_PAGES``) from the configuration."""
+    from ocrd_utils import config
+    try:
+        return max(1, int(config.OCRD_MAX_PARALLEL_PAGES))
+    except (ValueError, TypeError):
+        return 1
+
+def get_parameter_threads(parameter):
+    """Get the number of threads a processor with ``parameter`` recognizes with concurrently.
+
+    (This is ``segment_threads``, or the number of ``auto_model`` candidates,
+    whichever is larger. ``segment_threads`` cannot be combined with XPath
+    parameters/models or ``auto_model``.)
+    """
+    threads = parameter.get('segment_threads', 1)
+    if (parameter.get('xpath_parameters') or parameter.get('xpath_model') or
+        parameter.get('auto_model')):
+        threads = 1
+    if parameter.get('auto_model'):
+        threads = max(threads, len(parameter.get('model', '').split('+')))
+    return max(1, threads)
+
+def get_thread_budget(workers=1, threads=1, cores=None):
+    """Split ``cores`` (or all available) between ``workers`` processes with ``threads`` threads each.
+
+    Return the number of cores and the number of (OpenMP) threads each
+    Tesseract call within these may use without oversubscribing (at least 1).
+    """
+    if cores is None:
+        cores = get_cores()
+    return cores, max(1, cores // (max(1, workers) * max(1, threads)))
+
+def set_openmp_limit(threads=1, workers=None):
+    """Limit Tesseract's OpenMP threads to the share of each of ``threads`` in each page worker.
+
+    (Page workers default to ``OCRD_MAX_PARALLEL_PAGES``.)
+
+    Must run before Tesseract (and thus the OpenMP runtime, if any) gets
+    loaded, because ``OMP_THREAD_LIMIT`` is only read on initialization.
+    Does nothing if ``OMP_THREAD_LIMIT`` has already been set.
+    """
+    if 'OMP_THREAD_LIMIT' not in os.environ:
+        if workers is None:
+            workers = get_page_workers()
+        _, limit = get_thread_budget(workers, threads)
+        os.environ['OMP_THREAD_LIMIT'] = str(limit)
+
+def get_openmp_limit():
+    """Get the thread limit of the OpenMP runtime loaded into this process.
+
+    (Return None if no OpenMP runtime has been loaded, e.g. because Tesseract
+    was built without it, or if this cannot be determined on this platform.)
+    """
+    try:
+        with open('/proc/self/maps') as maps:
+            paths = set(re.findall(r'\s(/\S*/lib[gi]?omp[^/\s]*\.so[^/\s]*)$', maps.read(), re.M))
+    except OSError:
+        return None
+    import ctypes
+    for path in sorted(paths):
+        try:
+            return ctypes.CDLL(path).omp_get_thread_limit()
+        except (OSError, AttributeError):
+            continue
+    return None
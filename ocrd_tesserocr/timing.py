@@ -0,0 +1,168 @@
+from __future__ import absolute_import
+
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from threading import local
+import json
+import math
+import os
+import time
+
+# stages which need not be timed
+_UNTIMED = nullcontext()
+
+class Timer:
+    """Collects how much time is spent in each stage of processing (opt-in).
+
+    Enabled via the environment variable ``OCRD_TESSEROCR_TIMING``: either
+    ``log`` (to log the results as JSON), or the path of a file to append
+    them to (as JSON lines). Results are aggregated per page (with count,
+    total and percentiles of the durations of each stage), and per run (with
+    count, total, share of the total page time and percentiles of the page
+    totals of each stage). Stages can be nested, but re-entering the same
+    stage (e.g. by recursion) only gets timed on the outermost level.
+    Durations from concurrent threads add up, and nested stages are included
+    in their parents, so shares do not necessarily sum to 1.
+
+    Pages processed in parallel workers also get aggregated per run if
+    results go to a file.
+    """
+    def __init__(self, target=None):
+        self.target = target
+        # durations per stage of the current page
+        self.stages = {}
+        # page results of the current run
+        self.pages = []
+        self.run_id = None
+        # stages currently being timed (per thread)
+        self.active = local()
+
+    @property
+    def enabled(self):
+        return bool(self.target)
+
+    def __call__(self, stage):
+        """Get a context manager timing ``stage`` (if enabled)."""
+        if not self.target:
+            return _UNTIMED
+        return self._time(stage)
+
+    @contextmanager
+    def _time(self, stage):
+        active = self.active.__dict__.setdefault('stages', set())
+        if stage in active:
+            yield
+            return
+        active.add(stage)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.setdefault(stage, []).append(time.perf_counter() - start)
+            active.discard(stage)
+
+    @contextmanager
+    def methods(self, obj, names):
+        """Time calls to the methods ``names`` of ``obj`` (as stages of the same name) within this context."""
+        if not self.target:
+            yield
+            return
+        for name in names:
+            setattr(obj, name, self._timed_method(name, getattr(obj, name)))
+        try:
+            yield
+        finally:
+            for name in names:
+                delattr(obj, name)
+
+    def _timed_method(self, stage, method):
+        @wraps(method)
+        def timed_method(*args, **kwargs):
+            with self(stage):
+                return method(*args, **kwargs)
+        return timed_method
+
+    def start_run(self):
+        self.run_id = '%d-%d' % (os.getpid(), time.time_ns())
+        self.stages = {}
+        self.pages = []
+
+    def end_page(self, page_id, logger):
+        """Aggregate and emit the durations of the current page."""
+        if not self.target:
+            return
+        stages, self.stages = self.stages, {}
+        result = {'run': self.run_id,
+                  'pid': os.getpid(),
+                  'page_id': page_id,
+                  'stages': {stage: _summarize(durations)
+                             for stage, durations in sorted(stages.items())}}
+        self.pages.append(result)
+        self._emit('Timing for page %s' % page_id, result, logger)
+
+    def end_run(self, logger):
+        """Aggregate and emit the page results of the current run."""
+        if not self.target:
+            return
+        pages, self.pages = self.pages, []
+        if not pages and self.target != 'log' and os.path.exists(self.target):
+            # pages have been processed by forked workers (sharing our run_id)
+            with open(self.target, encoding='utf-8') as target:
+                for line in target:
+                    result = json.loads(line)
+                    if result.get('run') == self.run_id and 'page_id' in result:
+                        pages.append(result)
+        if not pages:
+            logger.warning("No page timings to aggregate for this run "
+                           "(page-parallel workers need a file as OCRD_TESSEROCR_TIMING)")
+            return
+        totals = {}
+        counts = {}
+        for page in pages:
+            for stage, summary in page['stages'].items():
+                totals.setdefault(stage, []).append(summary['total'])
+                counts[stage] = counts.get(stage, 0) + summary['count']
+        total = sum(totals.get('page', [])) or sum(map(sum, totals.values()))
+        result = {'run': self.run_id,
+                  'pages': len(pages),
+                  'stages': {}}
+        for stage, page_totals in sorted(totals.items()):
+            summary = _summarize(page_totals)
+            summary['count'] = counts[stage]
+            summary['share'] = round(summary['total'] / total, 4) if total else 0
+            result['stages'][stage] = summary
+        self._emit('Timing for run', result, logger)
+
+    def _emit(self, message, result, logger):
+        if self.target == 'log':
+            logger.info("%s: %s", message, json.dumps(result))
+        else:
+            # (small appends are atomic, even from several processes)
+            with open(self.target, 'a', encoding='utf-8') as target:
+                target.write(json.dumps(result) + '\n')
+
+def _summarize(durations):
+    durations = sorted(durations)
+    return {'count': len(durations),
+            'total': round(sum(durations), 6),
+            'p50': round(_percentile(durations, 0.5), 6),
+            'p90': round(_percentile(durations, 0.9), 6),
+            'max': round(durations[-1], 6)}
+
+def _percentile(values, fraction):
+    # nearest rank
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+TIMER = Timer(os.environ.get('OCRD_TESSEROCR_TIMING'))
+
+def timed(stage):
+    """Decorate a function to be timed as ``stage`` by :py:data:`TIMER` (if enabled)."""
+    def decorator(func):
+        @wraps(func)
+        def timed_func(*args, **kwargs):
+            if not TIMER.target:
+                return func(*args, **kwargs)
+            with TIMER._time(stage):
+                return func(*args, **kwargs)
+        return timed_func
+    return decorator
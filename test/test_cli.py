@@ -1,5 +1,6 @@
 from pathlib import Path
 from os import environ
+import sys
 from subprocess import run
 
 
@@ -22,3 +23,35 @@ def test_list_all_resources(tmpdir, monkeypatch):
     r = run(['ocrd-tesserocr-recognize', '-L'],
             env=env, text=True, capture_output=True)
     assert not r.returncode, r.output
+
+def importtime(module):
+    # get own import time (in s) per imported module
+    r = run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+            text=True, capture_output=True)
+    assert not r.returncode, r.stderr
+    times = {}
+    for line in r.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, _, name = [field.strip() for field in
+                            line[len('import time:'):].split('|')]
+        times[name] = int(self_us) / 1e6
+    return times
+
+# budget (in s) for the package's own modules during CLI startup
+IMPORT_BUDGET = 0.1
+
+def test_import_time():
+    times = importtime('ocrd_tesserocr.cli')
+    # processors (and their dependencies) get imported by each command only
+    assert 'ocrd_tesserocr.recognize' not in times
+    assert 'tesserocr' not in times
+    own = sum(time for name, time in times.items()
+              if name.startswith('ocrd_tesserocr'))
+    assert own < IMPORT_BUDGET, own
+    times = importtime('ocrd_tesserocr.recognize')
+    # geometry dependencies get imported on first use only
+    assert 'scipy' not in times
+    own = sum(time for name, time in times.items()
+              if name.startswith('ocrd_tesserocr'))
+    assert own < IMPORT_BUDGET, own
@@ -0,0 +1,208 @@
+from types import SimpleNamespace
+import logging
+import os
+import struct
+
+import numpy as np
+import pytest
+
+import shapely
+from shapely.geometry import Polygon, box
+from scipy.sparse.csgraph import minimum_spanning_tree
+
+from ocrd_models.ocrd_page import CoordsType, TextRegionType
+from ocrd_utils import (
+    coordinates_for_segment,
+    points_from_polygon,
+    polygon_from_x0y0x1y1,
+    rotate_coordinates,
+    shift_coordinates,
+)
+
+from ocrd_tesserocr.common import (
+    MAX_DENSE_DISTANCES,
+    MAX_REPAIR_POINTS,
+    check_model,
+    get_models,
+    make_distances,
+    make_join,
+    make_valid,
+    polygon_for_parent,
+    polygons_for_parent,
+    polygons_from_bboxes,
+)
+from ocrd_tesserocr.recognize import TesserocrRecognize
+
+def _check_valid(polygon, area):
+    result = make_valid(polygon)
+    assert result.is_valid
+    assert result.geom_type == 'Polygon'
+    assert result.area >= 0.9 * area
+    return result
+
+def test_make_valid_bowtie():
+    # two triangles of area 25 each (signed areas cancel out)
+    bowtie = Polygon([(0, 0), (10, 10), (10, 0), (0, 10)])
+    assert not bowtie.is_valid
+    result = _check_valid(bowtie, 50)
+    assert result.covers(shapely.make_valid(bowtie))
+
+def test_make_valid_many_points():
+    # figure eight: two lobes which zero buffering would only keep one of
+    angles = np.linspace(0, 2 * np.pi, 4 * MAX_REPAIR_POINTS, endpoint=False)
+    eight = Polygon(np.c_[100 + 100 * np.sin(angles), 100 + 50 * np.sin(2 * angles)])
+    assert not eight.is_valid
+    _check_valid(eight, shapely.make_valid(eight).area)
+    # circle with spikes crossing their neighbours
+    points = np.c_[100 + 80 * np.cos(angles), 100 + 80 * np.sin(angles)]
+    points[::7] += np.random.default_rng(0).normal(0, 15, (len(points[::7]), 2))
+    circle = Polygon(points)
+    assert not circle.is_valid
+    _check_valid(circle, shapely.make_valid(circle).area)
+
+def test_make_valid_degenerate():
+    line = Polygon([(0, 0), (10, 10), (20, 20), (0, 0)])
+    assert not line.is_valid
+    result = _check_valid(line, 0)
+    assert result.area > 0
+    assert result.covers(shapely.geometry.LineString([(0, 0), (20, 20)]))
+
+def _boxes(count, seed=0):
+    # symbol boxes in lines (some touching or overlapping)
+    rng = np.random.default_rng(seed)
+    boxes = []
+    for index in range(count):
+        line, column = divmod(index, 30)
+        left, top = column * 20 + rng.uniform(0, 4), line * 40 + rng.uniform(0, 4)
+        boxes.append(box(left, top, left + rng.uniform(10, 25), top + rng.uniform(20, 30)))
+    return boxes
+
+def _blobs(count, seed=0):
+    # irregular (non-rectangular) polygons scattered with clusters and gaps
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0, 2 * np.pi, 7, endpoint=False)
+    blobs = []
+    for _ in range(count):
+        center = rng.uniform(0, 300, 2) + rng.choice([0, 1000], 2)
+        radii = rng.uniform(3, 15, len(angles))
+        blobs.append(Polygon(center + np.c_[radii * np.cos(angles), radii * np.sin(angles)]))
+    return blobs
+
+@pytest.mark.parametrize('polygons', [_boxes(100), _boxes(MAX_DENSE_DISTANCES + 100), _blobs(150)],
+                         ids=['rectangles', 'rectangles (sparse)', 'polygons'])
+def test_make_distances(polygons):
+    # same minimum spanning tree as from all distances
+    npoly = len(polygons)
+    dense = np.zeros((npoly, npoly))
+    for i in range(npoly):
+        for j in range(i + 1, npoly):
+            dense[i, j] = max(polygons[i].distance(polygons[j]), 1e-5)
+    expected = minimum_spanning_tree(dense)
+    result = minimum_spanning_tree(make_distances(np.array(polygons, dtype=object)))
+    assert result.nnz == npoly - 1
+    assert result.sum() == pytest.approx(expected.sum())
+    joint = make_join(polygons)
+    assert joint.geom_type == 'Polygon'
+    assert joint.is_valid
+    # (up to rounding to integer coordinates)
+    assert shapely.union_all(polygons).difference(joint.buffer(1)).area < 1
+
+def _region(points):
+    return TextRegionType(id='r', Coords=CoordsType(points=points_from_polygon(points)))
+
+RECTANGLE = [[10, 10], [110, 10], [110, 60], [10, 60]]
+# L-shape
+NON_RECTANGLE = [[10, 10], [110, 10], [110, 30], [50, 30], [50, 60], [10, 60]]
+
+@pytest.mark.parametrize('parent', [RECTANGLE, NON_RECTANGLE], ids=['rectangle', 'L-shape'])
+@pytest.mark.parametrize('child', [
+    [[20, 15], [40, 15], [40, 25], [20, 25]], # inside
+    [[90, 20], [130, 20], [130, 50], [90, 50]], # partly outside (of both)
+    [[0, 0], [120, 0], [120, 70], [0, 70]], # around
+    [[20, 20], [45, 15], [40, 25]], # inside (not a rectangle)
+    [[200, 200], [220, 200], [220, 220], [200, 220]], # disjoint
+], ids=['inside', 'partly outside', 'around', 'triangle', 'disjoint'])
+def test_polygon_for_parent(parent, child):
+    expected = Polygon(child).intersection(Polygon(parent))
+    region = _region(parent)
+    cache = {}
+    # first call fills the cache, second uses it
+    for result in [polygon_for_parent(child, region),
+                   polygon_for_parent(child, region, cache=cache),
+                   polygon_for_parent(child, region, cache=cache)]:
+        if expected.is_empty:
+            assert result is None
+            continue
+        result = Polygon(result)
+        assert result.is_valid
+        assert result.symmetric_difference(expected).area < 1e-6
+    assert list(cache.values())[0][0] is region
+
+def test_polygon_for_parent_cache():
+    cache = {}
+    region = _region(RECTANGLE)
+    child = [[90, 20], [130, 20], [130, 50], [90, 50]]
+    assert Polygon(polygon_for_parent(child, region, cache=cache)).area == 20 * 30
+    # changed parent coordinates must not be served from the cache
+    region.set_Coords(CoordsType(points=points_from_polygon(NON_RECTANGLE)))
+    assert Polygon(polygon_for_parent(child, region, cache=cache)).area == 20 * 10
+
+@pytest.mark.parametrize('angle', [0, 5, -3.7, 90])
+@pytest.mark.parametrize('parent', [
+    [[100, 100], [700, 100], [700, 500], [100, 500]],
+    [[100, 100], [700, 100], [700, 300], [400, 300], [400, 500], [100, 500]],
+], ids=['rectangle', 'L-shape'])
+def test_polygons_from_bboxes(angle, parent):
+    # cropped and rotated (as by image_from_segment)
+    transform = shift_coordinates(np.eye(3), np.array([-37, -112]))
+    transform = rotate_coordinates(transform, angle, np.array([400, 300]))
+    coords = {'transform': transform}
+    rng = np.random.default_rng(0)
+    corners = rng.integers(0, 800, (300, 2))
+    bboxes = np.c_[corners, corners + rng.integers(1, 60, (300, 2))]
+    region = _region(parent)
+    # per segment
+    expected = []
+    for bbox in bboxes:
+        polygon = coordinates_for_segment(polygon_from_x0y0x1y1(bbox), None, coords)
+        polygon = polygon_for_parent(polygon, region)
+        expected.append(None if polygon is None else points_from_polygon(polygon))
+    assert any(expected) and not all(expected)
+    # in batch
+    polygons = polygons_from_bboxes(bboxes, coords)
+    for polygon, bbox in zip(polygons, bboxes):
+        assert np.array_equal(polygon, coordinates_for_segment(
+            polygon_from_x0y0x1y1(bbox), None, coords))
+    result = [None if polygon is None else points_from_polygon(polygon)
+              for polygon in polygons_for_parent(polygons, region, cache={})]
+    assert result == expected
+    processor = SimpleNamespace(parent_cache={}, logger=logging.getLogger())
+    assert TesserocrRecognize._points_for_bboxes(
+        processor, bboxes, region, coords, 'word') == expected
+
+def test_model_inventory(tmpdir, monkeypatch):
+    def write_model(path, components):
+        # traineddata header only: 24 component offsets (-1 if absent)
+        offsets = [8 + 24 * 8 if index in components else -1 for index in range(24)]
+        with open(path, 'wb') as file:
+            file.write(struct.pack('<i24q', 24, *offsets))
+    write_model(str(tmpdir.join('legacy.traineddata')), [1, 3])
+    write_model(str(tmpdir.join('lstm.traineddata')), [1, 17])
+    monkeypatch.setenv('TESSDATA_PREFIX', str(tmpdir))
+    path, models = get_models()
+    assert path == os.path.join(str(tmpdir), '')
+    assert sorted(models) == ['legacy', 'lstm']
+    assert models['legacy']['legacy'] and not models['legacy']['lstm']
+    assert models['lstm']['lstm'] and not models['lstm']['legacy']
+    assert models['lstm']['size'] == 4 + 24 * 8
+    # cached until the directory changes
+    assert get_models()[1] is models
+    tmpdir.mkdir('sub')
+    write_model(str(tmpdir.join('sub', 'both.traineddata')), [3, 17])
+    assert 'sub/both' in get_models()[1]
+    check_model('legacy+sub/both', 'TESSERACT_ONLY')
+    check_model('lstm+legacy', 'DEFAULT')
+    with pytest.raises(Exception, match="not installed"):
+        check_model('lstm+foo')
+    with pytest.raises(Exception, match="no legacy"):
+        check_model('lstm', 'TESSERACT_LSTM_COMBINED')
@@ -1,15 +1,29 @@
 import os
+from threading import Thread
+from types import MethodType, SimpleNamespace
 
-from ocrd import run_processor
+import numpy as np
+import pytest
+from PIL import Image
+from lxml import etree
+
+from ocrd import Resolver, run_processor
+from ocrd.processor.helpers import get_processor
 from ocrd_models.constants import NAMESPACES
+from ocrd_models.ocrd_page import CoordsType, TextStyleType, WordType
 from ocrd_modelfactory import page_from_file
-from ocrd_utils import MIMETYPE_PAGE, config
+from ocrd_utils import MIMETYPE_PAGE, config, points_from_polygon, polygon_from_bbox
 from ocrd_tesserocr import TesserocrDeskew
 from ocrd_tesserocr import TesserocrSegmentWord
 from ocrd_tesserocr import TesserocrSegmentLine
 from ocrd_tesserocr import TesserocrSegmentRegion
 from ocrd_tesserocr import TesserocrRecognize
 from ocrd_tesserocr import TesserocrFontShape
+from ocrd_tesserocr import TesserocrPreprocess
+from ocrd_tesserocr import TesserocrCrop
+from ocrd_tesserocr.recognize import TessBaseAPI
+from ocrd_tesserocr.pipeline import parse_tasks, run_pipeline
+from ocrd_tesserocr.server import WorkerServer, submit_job
 
 def test_run_modular(workspace_kant_binarized):
     run_processor(TesserocrSegmentRegion,
@@ -87,6 +101,363 @@ def test_run_modular_full(workspace_kant_binarized):
     style0 = result0.etree.xpath('//page:Word/page:TextStyle', namespaces=NAMESPACES)
     assert len(style0) > 0
 
+def test_run_modular_preprocess(workspace_kant_binarized):
+    run_processor(TesserocrPreprocess,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-IMG",
+                  output_file_grp="OCR-D-PRE")
+    run_processor(TesserocrSegmentRegion,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-PRE",
+                  output_file_grp="OCR-D-SEG-BLOCK")
+    workspace_kant_binarized.save_mets()
+    results = workspace_kant_binarized.find_files(file_grp='OCR-D-PRE', mimetype=MIMETYPE_PAGE)
+    result0 = next(results, False)
+    assert result0
+    result0 = page_from_file(result0)
+    assert result0.get_Page().get_Border()
+    images0 = result0.get_Page().get_AlternativeImage()
+    assert len(images0) == 2
+    assert 'cropped' in images0[0].get_comments()
+    assert 'binarized' in images0[1].get_comments()
+    results = workspace_kant_binarized.find_files(file_grp='OCR-D-SEG-BLOCK', mimetype=MIMETYPE_PAGE)
+    result0 = next(results, False)
+    assert result0
+    result0 = page_from_file(result0)
+    assert len(result0.get_Page().get_AllRegions(classes=['Text']))
+
+def test_run_pipeline(workspace_kant_binarized):
+    run_pipeline(workspace_kant_binarized, parse_tasks([
+        "tesserocr-segment-region -I OCR-D-IMG -O OCR-D-SEG-BLOCK",
+        "tesserocr-segment-line -O OCR-D-SEG-LINE",
+        "tesserocr-recognize -O OCR-D-OCR-TESS -P textequiv_level line -P model Fraktur"]))
+    ws = workspace_kant_binarized
+    # only the last fileGrp gets written
+    assert 'OCR-D-SEG-LINE' not in ws.mets.file_groups
+    assert os.path.isdir(os.path.join(ws.directory, 'OCR-D-OCR-TESS'))
+    results = ws.find_files(file_grp='OCR-D-OCR-TESS', mimetype=MIMETYPE_PAGE)
+    result0 = next(results, False)
+    assert result0
+    result0 = page_from_file(result0)
+    text0 = result0.etree.xpath('//page:TextLine/page:TextEquiv/page:Unicode', namespaces=NAMESPACES)
+    assert len(text0) > 0
+
+def _make_workspace(directory, npages):
+    workspace = Resolver().workspace_from_nothing(directory=str(directory))
+    for index in range(1, npages + 1):
+        Image.new('L', (300, 200), 255).save(str(directory / ('page%d.png' % index)))
+        workspace.add_file('OCR-D-IMG', file_id='IMG_%d' % index, page_id='P%d' % index,
+                           mimetype='image/png', local_filename='page%d.png' % index)
+    workspace.save_mets()
+    return workspace
+
+@pytest.mark.parametrize('missing_output', ['SKIP', 'COPY', 'ABORT'])
+def test_run_pipeline_failure(tmp_path, monkeypatch, missing_output):
+    monkeypatch.setenv('OCRD_MISSING_OUTPUT', missing_output)
+    monkeypatch.setenv('OCRD_MAX_MISSING_OUTPUTS', '0.5')
+    ws = _make_workspace(tmp_path, 3)
+    process_page_pcgts = TesserocrCrop.process_page_pcgts
+    def fail_page(self, *input_pcgts, page_id=None):
+        if page_id == 'P2':
+            raise ValueError("cannot process page %s" % page_id)
+        return process_page_pcgts(self, *input_pcgts, page_id=page_id)
+    monkeypatch.setattr(TesserocrCrop, 'process_page_pcgts', fail_page)
+    tasks = parse_tasks(["tesserocr-crop -I OCR-D-IMG -O OCR-D-CROP",
+                         "tesserocr-binarize -O OCR-D-BIN -P operation_level page"])
+    if missing_output == 'ABORT':
+        with pytest.raises(ValueError):
+            run_pipeline(ws, tasks)
+    else:
+        run_pipeline(ws, tasks)
+    # results of the pages before (and after) the failing one are in the METS
+    ws = Resolver().workspace_from_url(str(tmp_path / 'mets.xml'))
+    pages = [f.pageId for f in ws.find_files(file_grp='OCR-D-BIN', mimetype=MIMETYPE_PAGE)]
+    images = [f.pageId for f in ws.find_files(file_grp='OCR-D-BIN', mimetype='image/png')]
+    assert {'ABORT': ['P1'], 'SKIP': ['P1', 'P3'], 'COPY': ['P1', 'P2', 'P3']}[missing_output] == pages
+    assert images == [page for page in pages if page != 'P2']
+    # (unless too many)
+    if missing_output != 'ABORT':
+        monkeypatch.setenv('OCRD_MAX_MISSING_OUTPUTS', '0.2')
+        with pytest.raises(Exception, match='too many failures'):
+            run_pipeline(ws, tasks, existing_output='OVERWRITE')
+
+def test_run_server(workspace_kant_binarized, tmpdir):
+    path = str(tmpdir.join('worker.sock'))
+    server = WorkerServer(path)
+    thread = Thread(target=server.serve_forever)
+    thread.start()
+    ws = workspace_kant_binarized
+    tasks = ["tesserocr-segment-region -I OCR-D-IMG -O OCR-D-SEG-BLOCK",
+             "tesserocr-recognize -O OCR-D-OCR-TESS -P segmentation_level line "
+             "-P textequiv_level line -P model Fraktur"]
+    try:
+        response = submit_job(path, os.path.join(ws.directory, 'mets.xml'), tasks)
+        assert response['status'] == 'ok', response
+        # processors are kept set up
+        assert len(server.cache.processors) == 2
+        response = submit_job(path, os.path.join(ws.directory, 'mets.xml'), tasks, overwrite=True)
+        assert response['status'] == 'ok', response
+        assert len(server.cache.processors) == 2
+        # (without changing the global configuration)
+        assert config.OCRD_EXISTING_OUTPUT != 'OVERWRITE'
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+    ws.reload_mets()
+    results = ws.find_files(file_grp='OCR-D-OCR-TESS', mimetype=MIMETYPE_PAGE)
+    result0 = next(results, False)
+    assert result0
+    assert not os.path.exists(path)
+
+def _run_fontshape_input(workspace):
+    run_processor(TesserocrRecognize,
+                  workspace=workspace,
+                  input_file_grp="OCR-D-IMG",
+                  output_file_grp="OCR-D-OCR-TESS",
+                  parameter={'segmentation_level': 'region', 'textequiv_level': 'word', 'model': 'Fraktur'})
+
+def _run_fontshape(workspace, monkeypatch, preset=(), **parameter):
+    # (in this process, to see which words get recognized on their own,
+    #  and which get sampled together)
+    detected = []
+    sampled = []
+    process_word = TesserocrFontShape._process_word
+    process_sample = TesserocrFontShape._process_sample
+    def record_word(self, word, *args):
+        detected.append(word.id)
+        return process_word(self, word, *args)
+    def record_sample(self, words, *args):
+        sampled.append([word.id for word in words])
+        return process_sample(self, words, *args)
+    monkeypatch.setattr(TesserocrFontShape, '_process_word', record_word)
+    monkeypatch.setattr(TesserocrFontShape, '_process_sample', record_sample)
+    processor = get_processor(TesserocrFontShape, parameter=parameter, workspace=workspace,
+                              input_file_grp="OCR-D-OCR-TESS", output_file_grp="OCR-D-OCR-STYLE")
+    input_file = next(workspace.find_files(file_grp="OCR-D-OCR-TESS", mimetype=MIMETYPE_PAGE))
+    pcgts = page_from_file(input_file)
+    for line in pcgts.get_Page().get_AllTextLines():
+        for word in line.get_Word():
+            if word.id in preset:
+                word.set_TextStyle(TextStyleType(fontFamily='Preset'))
+    page = processor.process_page_pcgts(pcgts, page_id=input_file.pageId).pcgts.get_Page()
+    processor.shutdown()
+    monkeypatch.undo()
+    words = [word for line in page.get_AllTextLines() for word in line.get_Word()]
+    assert len(words) > 0
+    # no word gets recognized twice
+    assert len(detected) == len(set(detected))
+    # each word has its own style
+    styles = [word.get_TextStyle() for word in words if word.get_TextStyle()]
+    assert len(set(map(id, styles))) == len(styles)
+    if parameter.get('sample_size'):
+        # each segment of sample_level gets sampled once
+        if parameter.get('sample_level', 'region') == 'region':
+            segments = [[word.id for line in region.get_TextLine() for word in line.get_Word()]
+                        for region in page.get_AllRegions(classes=['Text'])]
+        else:
+            segments = [[word.id for word in line.get_Word()]
+                        for line in page.get_AllTextLines()]
+        segments = [[word for word in segment if word not in preset]
+                    for segment in segments]
+        assert (sorted(sample for sample in sampled if sample) ==
+                sorted(segment for segment in segments if segment))
+    return {word.id: word.get_TextStyle() for word in words}, detected
+
+def _style_shape(style):
+    return style and (style.bold, style.italic)
+
+def test_run_modular_fontshape_line(workspace_kant_binarized, monkeypatch):
+    ws = workspace_kant_binarized
+    _run_fontshape_input(ws)
+    words, detected = _run_fontshape(ws, monkeypatch)
+    assert sorted(detected) == sorted(words)
+    aligned = []
+    process_aligned = TesserocrFontShape._process_aligned
+    def record_aligned(self, words, *args):
+        unaligned = process_aligned(self, words, *args)
+        aligned.extend(word.id for word in words if word not in unaligned)
+        return unaligned
+    for level in ['line', 'region']:
+        aligned.clear()
+        monkeypatch.setattr(TesserocrFontShape, '_process_aligned', record_aligned)
+        styles, detected = _run_fontshape(ws, monkeypatch, operation_level=level)
+        assert len(aligned) > 0
+        # only unaligned words get recognized on their own
+        assert sorted(detected + aligned) == sorted(words)
+        # mostly the same font shape as on the word level
+        agree = sum(_style_shape(styles[word]) == _style_shape(words[word]) for word in words)
+        assert agree > 0.5 * len(words)
+
+class _WordResults:
+    """result iterator over detected words (bbox and font attributes)"""
+    def __init__(self, words):
+        self.words = words
+        self.index = 0
+    def Empty(self, ril):
+        return self.index >= len(self.words)
+    def IsAtFinalElement(self, parent, level):
+        return self.index == len(self.words) - 1
+    def Next(self, ril):
+        self.index += 1
+        return not self.Empty(ril)
+    def BoundingBox(self, ril):
+        return self.words[self.index][0]
+    def WordFontAttributes(self):
+        return self.words[self.index][1]
+
+def test_fontshape_aligned():
+    results = _WordResults([((0, 0, 100, 20), {'font_name': 'Antiqua', 'bold': True}),
+                            ((110, 0, 200, 20), {'font_name': 'Fraktur', 'italic': True}),
+                            ((210, 0, 300, 20), {})])
+    processor = SimpleNamespace(tessapi=SimpleNamespace(Recognize=lambda: None,
+                                                        GetIterator=lambda: results))
+    processor._get_style = MethodType(TesserocrFontShape._get_style, processor)
+    # two existing words for the first detected word, one for a detected word without style, one without overlap
+    words = [WordType(id=ident, Coords=CoordsType(points=points_from_polygon(polygon_from_bbox(*bbox))))
+             for ident, bbox in [('w1', (0, 0, 40, 20)), ('w2', (50, 0, 100, 20)),
+                                 ('w3', (120, 0, 190, 20)), ('w4', (220, 0, 290, 20)),
+                                 ('w5', (400, 0, 450, 20))]]
+    unaligned = TesserocrFontShape._process_aligned(processor, words, None, {'transform': np.eye(3)})
+    assert [word.id for word in unaligned] == ['w4', 'w5']
+    assert [word.get_TextStyle().fontFamily for word in words[:3]] == ['Antiqua', 'Antiqua', 'Fraktur']
+    assert words[0].get_TextStyle().bold and words[2].get_TextStyle().italic
+    # each word gets its own style
+    assert words[0].get_TextStyle() is not words[1].get_TextStyle()
+
+def test_run_modular_fontshape_sample(workspace_kant_binarized, monkeypatch):
+    ws = workspace_kant_binarized
+    _run_fontshape_input(ws)
+    words, detected = _run_fontshape(ws, monkeypatch)
+    # a single sample always agrees with itself: propagated to the other words
+    for level in ['region', 'line']:
+        for operation_level in ['word', 'region']:
+            styles, detected = _run_fontshape(ws, monkeypatch, operation_level=operation_level,
+                                              sample_size=1, sample_level=level, sample_confidence=0)
+            assert 0 < len(detected) < len(words)
+            assert sum(map(bool, styles.values())) >= sum(map(bool, words.values()))
+    # samples never reach the confidence: detect all words as usual
+    styles, detected = _run_fontshape(ws, monkeypatch, sample_size=3, sample_confidence=1)
+    assert sorted(detected) == sorted(words)
+    # words with a style already are kept as they are
+    word0 = next(iter(words))
+    styles, detected = _run_fontshape(ws, monkeypatch, preset=[word0],
+                                      sample_size=1, sample_confidence=0)
+    assert styles[word0].fontFamily == 'Preset'
+    assert word0 not in detected
+    assert all(style.fontFamily != 'Preset' for word, style in styles.items() if style and word != word0)
+
+def test_run_modular_threads(workspace_kant_binarized):
+    run_processor(TesserocrSegmentRegion,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-IMG",
+                  output_file_grp="OCR-D-SEG-BLOCK")
+    run_processor(TesserocrSegmentLine,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-SEG-BLOCK",
+                  output_file_grp="OCR-D-SEG-LINE")
+    run_processor(TesserocrRecognize,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-SEG-LINE",
+                  output_file_grp="OCR-D-OCR-TESS",
+                  parameter={'textequiv_level': 'line', 'model': 'Fraktur'})
+    run_processor(TesserocrRecognize,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-SEG-LINE",
+                  output_file_grp="OCR-D-OCR-TESS-THREADS",
+                  parameter={'textequiv_level': 'line', 'model': 'Fraktur',
+                             'segment_threads': 3})
+    ws = workspace_kant_binarized
+    ws.save_mets()
+    texts = []
+    for grp in ['OCR-D-OCR-TESS', 'OCR-D-OCR-TESS-THREADS']:
+        result0 = next(ws.find_files(file_grp=grp, mimetype=MIMETYPE_PAGE), False)
+        assert result0
+        result0 = page_from_file(result0)
+        texts.append(result0.etree.xpath('//page:TextLine/page:TextEquiv/page:Unicode/text()',
+                                         namespaces=NAMESPACES))
+    assert len(texts[0]) > 0
+    # same results in same order
+    assert texts[0] == texts[1]
+
+def test_run_modular_reuse_images(workspace_kant_binarized):
+    run_processor(TesserocrSegmentRegion,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-IMG",
+                  output_file_grp="OCR-D-SEG-BLOCK")
+    run_processor(TesserocrSegmentLine,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-SEG-BLOCK",
+                  output_file_grp="OCR-D-SEG-LINE")
+    run_processor(TesserocrRecognize,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-SEG-LINE",
+                  output_file_grp="OCR-D-OCR-TESS",
+                  parameter={'textequiv_level': 'line', 'model': 'Fraktur',
+                             'reuse_images': True})
+    ws = workspace_kant_binarized
+    ws.save_mets()
+    results = ws.find_files(file_grp='OCR-D-OCR-TESS', mimetype=MIMETYPE_PAGE)
+    result0 = next(results, False)
+    assert result0
+    result0 = page_from_file(result0)
+    text0 = result0.etree.xpath('//page:TextLine/page:TextEquiv/page:Unicode', namespaces=NAMESPACES)
+    assert len(text0) > 0
+
+def test_run_modular_line_batch(workspace_kant_binarized):
+    run_processor(TesserocrSegmentRegion,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-IMG",
+                  output_file_grp="OCR-D-SEG-BLOCK")
+    run_processor(TesserocrSegmentLine,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-SEG-BLOCK",
+                  output_file_grp="OCR-D-SEG-LINE")
+    run_processor(TesserocrRecognize,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-SEG-LINE",
+                  output_file_grp="OCR-D-OCR-TESS",
+                  parameter={'textequiv_level': 'line', 'model': 'Fraktur',
+                             'line_batch_size': 8})
+    ws = workspace_kant_binarized
+    ws.save_mets()
+    results = ws.find_files(file_grp='OCR-D-OCR-TESS', mimetype=MIMETYPE_PAGE)
+    result0 = next(results, False)
+    assert result0
+    result0 = page_from_file(result0)
+    lines0 = result0.etree.xpath('//page:TextLine', namespaces=NAMESPACES)
+    text0 = result0.etree.xpath('//page:TextLine/page:TextEquiv/page:Unicode', namespaces=NAMESPACES)
+    assert len(text0) > 0
+    assert len(text0) == len(lines0)
+
+def test_run_modular_align_segments(workspace_kant_binarized):
+    run_processor(TesserocrRecognize,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-IMG",
+                  output_file_grp="OCR-D-SEG-GLYPH",
+                  parameter={'segmentation_level': 'region', 'textequiv_level': 'none'})
+    run_processor(TesserocrRecognize,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-SEG-GLYPH",
+                  output_file_grp="OCR-D-OCR-TESS-W",
+                  parameter={'segmentation_level': 'none', 'textequiv_level': 'word', 'model': 'Fraktur',
+                             'align_segments': True})
+    run_processor(TesserocrRecognize,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-SEG-GLYPH",
+                  output_file_grp="OCR-D-OCR-TESS-G",
+                  parameter={'segmentation_level': 'none', 'textequiv_level': 'glyph', 'model': 'Fraktur',
+                             'align_segments': True})
+    ws = workspace_kant_binarized
+    ws.save_mets()
+    for grp, level in [('OCR-D-OCR-TESS-W', 'Word'), ('OCR-D-OCR-TESS-G', 'Glyph')]:
+        results = ws.find_files(file_grp=grp, mimetype=MIMETYPE_PAGE)
+        result0 = next(results, False)
+        assert result0
+        result0 = page_from_file(result0)
+        text0 = result0.etree.xpath('//page:%s/page:TextEquiv/page:Unicode' % level, namespaces=NAMESPACES)
+        assert len(text0) > 0
+
 def test_run_allinone(workspace_kant_binarized):
     run_processor(TesserocrRecognize,
                   workspace=workspace_kant_binarized,
@@ -120,6 +491,29 @@ def test_run_allinone_sparse(workspace_kant_binarized):
                              'model': 'Fraktur'})
     workspace_kant_binarized.save_mets()
 
+def test_run_allinone_bulk(workspace_kant_binarized):
+    for grp, bulk in [('OCR-D-OCR-TESS', False), ('OCR-D-OCR-TESS-BULK', True)]:
+        run_processor(TesserocrRecognize,
+                      workspace=workspace_kant_binarized,
+                      input_file_grp="OCR-D-IMG",
+                      output_file_grp=grp,
+                      parameter={'segmentation_level': 'region', 'textequiv_level': 'word',
+                                 'bulk_results': bulk, 'model': 'Fraktur'})
+    ws = workspace_kant_binarized
+    ws.save_mets()
+    words = []
+    for grp in ['OCR-D-OCR-TESS', 'OCR-D-OCR-TESS-BULK']:
+        result0 = next(ws.find_files(file_grp=grp, mimetype=MIMETYPE_PAGE), False)
+        assert result0
+        result0 = page_from_file(result0)
+        words.append([(word.get('id'),
+                       word.xpath('page:Coords/@points', namespaces=NAMESPACES),
+                       word.xpath('page:TextEquiv/page:Unicode/text()', namespaces=NAMESPACES))
+                      for word in result0.etree.xpath('//page:Word', namespaces=NAMESPACES)])
+    assert len(words[0]) > 0
+    # same results as with iterator
+    assert words[0] == words[1]
+
 def test_run_allineone_multimodel(workspace_kant_binarized):
     run_processor(TesserocrRecognize,
                   workspace=workspace_kant_binarized,
@@ -138,6 +532,30 @@ def test_run_allinone_automodel(workspace_kant_binarized):
                              'model': 'Fraktur+eng+deu'})
     workspace_kant_binarized.save_mets()
 
+def test_run_modular_automodel_page(workspace_kant_binarized):
+    run_processor(TesserocrSegmentRegion,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-IMG",
+                  output_file_grp="OCR-D-SEG-BLOCK")
+    run_processor(TesserocrSegmentLine,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-SEG-BLOCK",
+                  output_file_grp="OCR-D-SEG-LINE")
+    run_processor(TesserocrRecognize,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-SEG-LINE",
+                  output_file_grp="OCR-D-OCR-TESS",
+                  parameter={'textequiv_level': 'word', 'auto_model': True,
+                             'auto_model_level': 'page',
+                             'model': 'Fraktur+eng+deu'})
+    workspace_kant_binarized.save_mets()
+    results = workspace_kant_binarized.find_files(file_grp='OCR-D-OCR-TESS', mimetype=MIMETYPE_PAGE)
+    result0 = next(results, False)
+    assert result0
+    result0 = page_from_file(result0)
+    text0 = result0.etree.xpath('//page:Word/page:TextEquiv/page:Unicode', namespaces=NAMESPACES)
+    assert len(text0) > 0
+
 def test_run_allinone_cached(workspace_kant_binarized):
     processor_instance = None
     for run in range(5):
@@ -164,3 +582,191 @@ def test_run_allinone_cached(workspace_kant_binarized):
     result0 = page_from_file(result0)
     text0 = result0.etree.xpath('//page:Glyph/page:TextEquiv/page:Unicode', namespaces=NAMESPACES)
     assert len(text0) > 0
+
+def test_run_modular_xpathmodel_cached(workspace_kant_binarized):
+    run_processor(TesserocrSegmentRegion,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-IMG",
+                  output_file_grp="OCR-D-SEG-BLOCK")
+    run_processor(TesserocrSegmentLine,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-SEG-BLOCK",
+                  output_file_grp="OCR-D-SEG-LINE")
+    # alternate between models per line, with only one extra model in memory
+    run_processor(TesserocrRecognize,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-SEG-LINE",
+                  output_file_grp="OCR-D-OCR-TESS",
+                  parameter={'textequiv_level': 'line',
+                             'xpath_model': {'contains(@id,"line0001")': 'deu',
+                                             'contains(@id,"line0002")': 'eng'},
+                             'model_cache': 1,
+                             'model': 'Fraktur'})
+    workspace_kant_binarized.save_mets()
+    results = workspace_kant_binarized.find_files(file_grp='OCR-D-OCR-TESS', mimetype=MIMETYPE_PAGE)
+    result0 = next(results, False)
+    assert result0
+    result0 = page_from_file(result0)
+    text0 = result0.etree.xpath('//page:TextLine/page:TextEquiv/page:Unicode', namespaces=NAMESPACES)
+    assert len(text0) > 0
+
+def test_run_modular_xpathparameters(workspace_kant_binarized):
+    run_processor(TesserocrSegmentRegion,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-IMG",
+                  output_file_grp="OCR-D-SEG-BLOCK")
+    run_processor(TesserocrSegmentLine,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-SEG-BLOCK",
+                  output_file_grp="OCR-D-SEG-LINE")
+    # restrict characters for some lines only (must not leak into the others)
+    run_processor(TesserocrRecognize,
+                  workspace=workspace_kant_binarized,
+                  input_file_grp="OCR-D-SEG-LINE",
+                  output_file_grp="OCR-D-OCR-TESS",
+                  parameter={'textequiv_level': 'line',
+                             'xpath_parameters': {'contains(@id,"line0001")': {
+                                 'tessedit_char_whitelist': '0123456789 '}},
+                             'model': 'Fraktur'})
+    workspace_kant_binarized.save_mets()
+    results = workspace_kant_binarized.find_files(file_grp='OCR-D-OCR-TESS', mimetype=MIMETYPE_PAGE)
+    result0 = next(results, False)
+    assert result0
+    result0 = page_from_file(result0)
+    lines = result0.etree.xpath('//page:TextLine', namespaces=NAMESPACES)
+    assert len(lines) > 0
+    for line in lines:
+        text = ''.join(line.xpath('page:TextEquiv/page:Unicode/text()', namespaces=NAMESPACES))
+        if 'line0001' in line.get('id'):
+            assert all(char in '0123456789 ' for char in text)
+    assert any(char.isalpha()
+               for text in result0.etree.xpath('//page:TextLine/page:TextEquiv/page:Unicode/text()',
+                                               namespaces=NAMESPACES)
+               for char in text)
+
+XPATH_PAGE = """<?xml version="1.0" encoding="UTF-8"?>
+<pc:PcGts xmlns:pc="%s">
+  <pc:Page imageFilename="page.png" imageWidth="100" imageHeight="100">
+    <pc:ReadingOrder><pc:OrderedGroup id="ro" caption="r1">
+      <pc:RegionRefIndexed id="ro_r1" index="0" regionRef="r1"/>
+      <pc:RegionRefIndexed id="ro_r2" index="1" regionRef="r2"/>
+    </pc:OrderedGroup></pc:ReadingOrder>
+    <pc:TextRegion id="r1" type="heading" custom="script:Latn">
+      <pc:TextLine id="r1_l1"><pc:Word id="r1_l1_w1" language="German"/><pc:Word id="r1_l1_w2"/></pc:TextLine>
+      <pc:TextLine id="r1_l2"><pc:Word id="r1_l2_w1"/></pc:TextLine>
+    </pc:TextRegion>
+    <pc:TableRegion id="t1">
+      <pc:TextRegion id="t1_r1"><pc:TextLine id="t1_r1_l1"/></pc:TextRegion>
+    </pc:TableRegion>
+    <pc:TextRegion id="r2" type="paragraph">
+      <pc:TextLine id="r2_l1" primaryScript="Latn"><pc:Word id="r2_l1_w1"><pc:Glyph id="r2_l1_w1_g1"/></pc:Word></pc:TextLine>
+    </pc:TextRegion>
+  </pc:Page>
+</pc:PcGts>
+""" % NAMESPACES['page']
+
+def test_xpath_matches():
+    xpaths = ['@type="heading"',
+              'contains(@custom,"Latn") or ../@primaryScript="Latn"',
+              'contains(@id,"r1")',
+              '../@type="paragraph"',
+              'parent::pc:TextRegion and position()=1',
+              'count(preceding-sibling::*)=0',
+              'pc:TextLine[2]',
+              'last()=1',
+              'ancestor::pc:TableRegion',
+              'pc:Word/@language',
+              'string(@id)']
+    processor = SimpleNamespace(parameter={'xpath_parameters': {xpath: {'xpath': xpath} for xpath in xpaths},
+                                           'xpath_model': {'@id="r2"': 'deu'}},
+                                xpath_queries={})
+    for name in ['_compile_xpaths', '_match_xpaths', '_get_xpath_matches']:
+        setattr(processor, name, MethodType(getattr(TesserocrRecognize, name), processor))
+    root = etree.fromstring(XPATH_PAGE.encode('utf-8'))
+    processor._match_xpaths(SimpleNamespace(etree=root))
+    namespaces = {'pc': NAMESPACES['page'], 're': 'http://exslt.org/regular-expressions'}
+    segments = root.xpath('//pc:Page | //pc:TextRegion | //pc:TableRegion | //pc:TextLine | //pc:Word | //pc:Glyph',
+                          namespaces=namespaces)
+    # same segments as when evaluating each expression on each segment
+    # (with the segment as single node in the context)
+    for xpath in xpaths:
+        single = xpath.replace('position()', '1').replace('last()', '1')
+        expected = [node for node in segments if node.xpath(single, namespaces=namespaces)]
+        result = [node for node in segments
+                  if any(params['xpath'] == xpath
+                         for _, params in processor._get_xpath_matches(
+                                 'xpath_parameters', node, node.get('id', node.get('imageFilename'))))]
+        assert result == expected, xpath
+    assert [model for node in segments
+            for _, model in processor._get_xpath_matches('xpath_model', node, node.get('id'))] == ['deu']
+    # reading order elements are not segments
+    assert 'ro' not in processor.xpath_matches['xpath_parameters'][2][2]
+    assert 'ro_r1' not in processor.xpath_matches['xpath_parameters'][2][2]
+
+def test_temporary_variables():
+    api = TessBaseAPI(init=False)
+    api.InitFull(lang='eng')
+    with api:
+        # runtime variables (incl. ones which Tesseract normalizes)
+        assert api.SetVariable('tessedit_char_whitelist', 'abc')
+        assert api.SetVariable('textord_debug_tabfind', 'true')
+        assert api.SetVariable('textord_tabfind_vertical_text_ratio', '0.50')
+        assert not api.SetVariable('no_such_variable', '1')
+    assert not api.dirty_init
+    assert api.GetVariableAsString('tessedit_char_whitelist') == 'abc'
+    api.RestoreVariables()
+    assert api.GetVariableAsString('tessedit_char_whitelist') == ''
+    assert api.GetVariableAsString('textord_debug_tabfind') == '0'
+    with api:
+        # init-only variables
+        assert api.SetVariable('load_system_dawg', '0')
+    assert api.GetVariableAsString('load_system_dawg') == '0'
+    assert 'load_system_dawg' not in api.parameters
+    api.RestoreVariables()
+    assert api.GetVariableAsString('load_system_dawg') == '1'
+    assert api.lang == 'eng'
+    api.End()
+    # layout-only APIs must not get a model
+    api = TessBaseAPI(init=False)
+    api.InitForAnalysePage()
+    with api:
+        assert api.SetVariable('load_system_dawg', '0')
+        assert api.SetVariable('textord_debug_tabfind', '1')
+    assert api.lang == '' and api.layout_only
+    assert api.GetInitLanguagesAsString() == ''
+    api.RestoreVariables()
+    assert api.GetVariableAsString('textord_debug_tabfind') == '0'
+    api.End()
+
+def test_server_socket(tmp_path):
+    path = str(tmp_path / 'worker.sock')
+    server = WorkerServer(path)
+    try:
+        # does not take over the socket of a running server
+        with pytest.raises(OSError):
+            WorkerServer(path)
+    finally:
+        server.socket.close()
+    # but does take over a stale one
+    assert os.path.exists(path)
+    server = WorkerServer(path)
+    server.server_close()
+    assert not os.path.exists(path)
+
+def test_preload_models():
+    # models for xpath_model get loaded during setup (before forking page workers)
+    processor = get_processor(TesserocrRecognize,
+                              parameter={'model': 'Fraktur',
+                                         'xpath_model': {'@language="German"': 'deu'},
+                                         'preload_models': True})
+    assert list(processor.tessapi_pool.apis) == ['deu']
+    processor.shutdown()
+    # and so do the copies for segment_threads
+    processor = get_processor(TesserocrRecognize,
+                              parameter={'model': 'Fraktur',
+                                         'segment_threads': 2,
+                                         'preload_models': True})
+    assert len(processor.tessapi_pool.spares) == 2
+    assert processor._get_thread_tessapi() is not processor.tessapi_pool.default
+    assert len(processor.tessapi_pool.spares) == 1
+    processor.shutdown()
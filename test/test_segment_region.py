@@ -1,4 +1,5 @@
 from ocrd import run_processor
+from ocrd.processor.helpers import get_processor
 from ocrd_tesserocr import TesserocrSegmentRegion
 from ocrd_modelfactory import page_from_file
 from ocrd_utils import MIMETYPE_PAGE
@@ -17,6 +18,13 @@ def test_run(workspace_herold_small):
     assert len(out_blocks)
     workspace_herold_small.save_mets()
 
+def test_layout_only():
+    # segmentation must not load any recognition model
+    processor = get_processor(TesserocrSegmentRegion, parameter={})
+    assert processor.helper.tessapi.layout_only
+    assert not processor.helper.tessapi.GetInitLanguagesAsString()
+    processor.shutdown()
+
 def test_run_shrink(workspace_herold_small):
     run_processor(TesserocrSegmentRegion,
                   workspace=workspace_herold_small,
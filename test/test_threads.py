@@ -0,0 +1,31 @@
+import os
+
+from ocrd_utils import config
+
+from ocrd_tesserocr import threads
+from ocrd_tesserocr.threads import (
+    get_page_workers,
+    get_parameter_threads,
+    get_thread_budget,
+    set_openmp_limit,
+)
+
+def test_thread_budget(monkeypatch):
+    assert get_thread_budget(1, 1, cores=8) == (8, 8)
+    assert get_thread_budget(4, 1, cores=8) == (8, 2)
+    assert get_thread_budget(3, 2, cores=8) == (8, 1)
+    assert get_thread_budget(16, 1, cores=8) == (8, 1)
+    assert get_parameter_threads({}) == 1
+    assert get_parameter_threads({'segment_threads': 3}) == 3
+    assert get_parameter_threads({'segment_threads': 3, 'xpath_model': {'//x': 'deu'}}) == 1
+    assert get_parameter_threads({'auto_model': True, 'model': 'eng+deu'}) == 2
+    # (also set in code, not only in the environment)
+    monkeypatch.setattr(config, 'OCRD_MAX_PARALLEL_PAGES', 3)
+    assert get_page_workers() == 3
+    monkeypatch.setattr(threads, 'get_cores', lambda: 12)
+    monkeypatch.delenv('OMP_THREAD_LIMIT', raising=False)
+    set_openmp_limit(2)
+    assert os.environ['OMP_THREAD_LIMIT'] == '2'
+    # (never overrides what the user has set)
+    set_openmp_limit(1, workers=1)
+    assert os.environ['OMP_THREAD_LIMIT'] == '2'
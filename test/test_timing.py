@@ -0,0 +1,31 @@
+import json
+import logging
+import time
+
+from ocrd_tesserocr.timing import Timer
+
+def test_timing(tmp_path):
+    target = tmp_path / 'timing.jsonl'
+    timer = Timer(str(target))
+    timer.start_run()
+    for page_id, durations in [('P1', [0.01, 0.02]), ('P2', [0.03])]:
+        for duration in durations:
+            with timer('stage'):
+                # re-entering the same stage is not counted twice
+                with timer('stage'):
+                    time.sleep(duration)
+        timer.end_page(page_id, logging.getLogger())
+    # (as if from page-parallel workers)
+    timer.pages.clear()
+    timer.end_run(logging.getLogger())
+    pages = [json.loads(line) for line in target.read_text().splitlines()]
+    assert [page.get('page_id') for page in pages] == ['P1', 'P2', None]
+    assert pages[0]['stages']['stage']['count'] == 2
+    assert pages[0]['stages']['stage']['p50'] >= 0.01
+    assert pages[0]['stages']['stage']['max'] >= 0.02
+    run = pages[-1]
+    assert run['run'] == timer.run_id
+    assert run['pages'] == 2
+    assert run['stages']['stage']['count'] == 3
+    assert run['stages']['stage']['total'] >= 0.06
+    assert Timer()('stage') is Timer(None)('other')